@@ -0,0 +1,224 @@
+# admission.py - Admission control and backpressure for the inference endpoints
+# At most `max_concurrent` requests run the CPU-bound pipeline at once (on a dedicated thread
+# pool, so the event loop and /health stay responsive); up to `max_queue` more wait for a slot.
+# Beyond that requests are rejected immediately with a Retry-After hint, and requests whose
+# deadline can no longer be met are dropped instead of occupying the pipeline.
+# Bulk items are never rejected but only get a bounded share of the queue: the rest wait
+# outside it, with their deadline not yet running (admit_bulk).
+# A slot is only freed once the request's pool work has ended: a thread cannot be cancelled, so
+# work abandoned at its deadline keeps its slot until it finishes, and the pipeline never runs
+# more than max_concurrent requests' work at once.
+
+import asyncio
+import contextvars
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+ADMISSION_CONFIG = {
+    'max_concurrent': int(os.getenv('MAX_CONCURRENT_REQUESTS', '0')) or None,  # in the pipeline (None → batch size)
+    'max_queue': int(os.getenv('MAX_QUEUED_REQUESTS', '64')),            # waiting for a slot
+    'deadline_s': float(os.getenv('REQUEST_DEADLINE_S', '30')),          # default per-request budget
+    'cpu_workers': int(os.getenv('PIPELINE_THREADS', '0')) or None,      # preprocess / Grad-CAM threads
+    'bulk_queue': int(os.getenv('MAX_QUEUED_BULK_ITEMS', '0')) or None,  # queued bulk items (None → max_queue // 4)
+}
+
+
+class Overloaded(Exception):
+    """The wait queue is full. `retry_after` is a hint in whole seconds."""
+    def __init__(self, retry_after):
+        super().__init__(f"Server overloaded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed (or cannot be met) before its work finished."""
+    def __init__(self, stage, retry_after=1):
+        super().__init__(f"Request deadline exceeded ({stage})")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+# Pool futures started by the admitted request running in this context (see admit / run)
+_request_work = contextvars.ContextVar('request_work', default=None)
+
+
+class AdmissionController:
+    """
+    Bounded concurrency + bounded queue + per-request deadlines.
+
+    Args:
+        max_concurrent: requests allowed to run the pipeline at once (from_config: the batch size)
+        max_queue: requests allowed to wait for a slot; more are rejected (Overloaded)
+        deadline_s: default deadline for deadline()
+        cpu_workers: size of the dedicated pipeline thread pool (None → max_concurrent + 2)
+        bulk_queue: queue places bulk items may take on top of the slots (None → max_queue // 4)
+    """
+    EWMA_ALPHA = 0.2  # smoothing of the observed service time
+
+    def __init__(self, max_concurrent=8, max_queue=64, deadline_s=30.0, cpu_workers=None, bulk_queue=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.deadline_s = deadline_s
+        self.bulk_queue = max(1, max_queue // 4) if bulk_queue is None else bulk_queue
+        self.executor = ThreadPoolExecutor(max_workers=cpu_workers or max_concurrent + 2,
+                                           thread_name_prefix='pipeline')
+        self._slots = None  # asyncio.Semaphore, created on the serving loop
+        self._bulk_gate = None  # asyncio.Semaphore: bulk items admitted or queued
+        self.active = 0
+        self.waiting = 0
+        self.bulk_waiting = 0  # bulk items waiting outside the queue
+        self.abandoned = 0  # slots held by work whose request already ended (deadline / error)
+        self._draining = set()  # tasks releasing those slots
+        self.service_ms = None  # EWMA of admitted request durations
+        self.counters = {'admitted': 0, 'completed': 0, 'rejected': 0, 'deadline_dropped': 0}
+
+    @classmethod
+    def from_config(cls, config=ADMISSION_CONFIG, batch_size=None):
+        """
+        batch_size: the micro-batcher's max_batch_size. Each admitted single-image request adds one
+        row to a batch, so max_concurrent defaults to it (fewer slots could never fill a batch).
+        """
+        max_concurrent = config['max_concurrent'] or batch_size or 8
+        if batch_size and max_concurrent < batch_size:
+            print(f"Warning: MAX_CONCURRENT_REQUESTS={max_concurrent} < MAX_BATCH_SIZE={batch_size} — "
+                  f"single-image batches never exceed {max_concurrent} rows")
+        return cls(max_concurrent=max_concurrent, max_queue=config['max_queue'],
+                   deadline_s=config['deadline_s'], cpu_workers=config['cpu_workers'],
+                   bulk_queue=config['bulk_queue'])
+
+    def deadline(self, timeout_s=None):
+        """Absolute (monotonic) deadline `timeout_s` from now (default: the configured budget)."""
+        return time.monotonic() + (self.deadline_s if timeout_s is None else timeout_s)
+
+    @staticmethod
+    def remaining(deadline):
+        return deadline - time.monotonic()
+
+    def retry_after(self):
+        """Seconds until the current queue has likely drained (at least 1)."""
+        service_s = (self.service_ms or 1000.0) / 1000.0
+        backlog = self.waiting + self.active
+        return max(1, math.ceil(backlog * service_s / self.max_concurrent))
+
+    @asynccontextmanager
+    async def admit(self, deadline, bounded=True):
+        """
+        Holds a pipeline slot for the body of the `async with`, and past it while pool work the
+        body started through run() is still executing (it cannot be cancelled once running).
+        bounded=False skips the queue-length check (callers that already limit themselves,
+        e.g. admit_bulk), but still honours the deadline.
+        Raises: Overloaded (queue full), DeadlineExceeded (expired while queued / cannot finish)
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        if bounded and self.active >= self.max_concurrent and self.waiting >= self.max_queue:
+            self.counters['rejected'] += 1
+            raise Overloaded(self.retry_after())
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=max(0.0, self.remaining(deadline)))
+        except asyncio.TimeoutError:
+            self.counters['deadline_dropped'] += 1
+            raise DeadlineExceeded('queued', self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        work = set()
+        token = _request_work.set(work)
+        try:
+            # Not enough budget left for a typical request: give the slot to someone who can finish
+            if self.service_ms is not None and self.remaining(deadline) * 1000 < self.service_ms:
+                self.counters['deadline_dropped'] += 1
+                raise DeadlineExceeded('insufficient time', self.retry_after())
+
+            self.active += 1
+            self.counters['admitted'] += 1
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.active -= 1
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.service_ms = elapsed_ms if self.service_ms is None else \
+                (1 - self.EWMA_ALPHA) * self.service_ms + self.EWMA_ALPHA * elapsed_ms
+            self.counters['completed'] += 1
+        finally:
+            _request_work.reset(token)
+            running = [future for future in work if not future.done()]
+            if running:
+                self.abandoned += 1
+                task = asyncio.ensure_future(self._release_after(running))
+                self._draining.add(task)
+                task.add_done_callback(self._draining.discard)
+            else:
+                self._slots.release()
+
+    async def _release_after(self, futures):
+        """Frees the slot of an ended request once its abandoned pool work has finished."""
+        try:
+            await asyncio.wait([asyncio.wrap_future(future) for future in futures])
+        finally:
+            self.abandoned -= 1
+            self._slots.release()
+
+    @asynccontextmanager
+    async def admit_bulk(self, timeout_s=None):
+        """
+        admit() for one bulk item; yields its deadline. At most max_concurrent + bulk_queue bulk
+        items are in the pipeline or its queue at once; further items wait outside the queue,
+        and their deadline (`timeout_s`, default the configured budget) starts once they get in.
+        Raises: DeadlineExceeded (see admit)
+        """
+        if self._bulk_gate is None:
+            self._bulk_gate = asyncio.Semaphore(self.max_concurrent + self.bulk_queue)
+        self.bulk_waiting += 1
+        try:
+            await self._bulk_gate.acquire()
+        finally:
+            self.bulk_waiting -= 1
+        try:
+            deadline = self.deadline(timeout_s)
+            async with self.admit(deadline, bounded=False):  # the gate bounds bulk's share of the queue
+                yield deadline
+        finally:
+            self._bulk_gate.release()
+
+    async def within(self, deadline, awaitable):
+        """Awaits `awaitable`, cancelling it once `deadline` passes (DeadlineExceeded)."""
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(0.0, self.remaining(deadline)))
+        except asyncio.TimeoutError:
+            self.counters['deadline_dropped'] += 1
+            raise DeadlineExceeded('running', self.retry_after())
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a CPU-bound callable on the dedicated pipeline pool. Inside admit(), the work counts
+        against the request's slot until it ends, even if the request is cancelled meanwhile.
+        """
+        future = self.executor.submit(fn, *args, **kwargs)
+        work = _request_work.get()
+        if work is not None:
+            work.add(future)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            **self.counters,
+            'active': self.active,
+            'queue_length': self.waiting,
+            'bulk_waiting': self.bulk_waiting,
+            'abandoned': self.abandoned,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'bulk_queue': self.bulk_queue,
+            'deadline_s': self.deadline_s,
+            'avg_service_ms': round(self.service_ms, 1) if self.service_ms is not None else None,
+        }
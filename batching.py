@@ -0,0 +1,171 @@
+# batching.py - Dynamic micro-batching for concurrent /analyze-xray requests
+# Requests wait a few milliseconds so their images can share one ensemble forward pass.
+
+import asyncio
+import time
+from collections import Counter
+
+import numpy as np
+from metrics import STAGE_SECONDS
+
+
+class MicroBatcher:
+    """
+    Collects preprocessed images from concurrent requests and runs them through
+    `predict_fn` as a single (N, 224, 224, C) batch.
+
+    A batch is dispatched as soon as it holds `max_batch_size` rows, or when the
+    oldest waiting image has waited `max_wait_ms`, whichever comes first.
+    `predict_fn` runs on `executor` (default thread pool) so the event loop
+    keeps serving other requests while the ensemble is busy.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10.0, executor=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+
+        self._queue = None
+        self._worker = None
+        self._carry = None  # item that did not fit into the previous batch
+
+        # Stats (read by /batching/stats)
+        self.batches_run = 0
+        self.items_run = 0
+        self.rows_run = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        self.batch_size_counts = Counter()
+
+    async def start(self):
+        """Starts the dispatcher task (idempotent; must be called from the event loop)."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the dispatcher and fails any request still waiting."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        pending = [self._carry] if self._carry else []
+        self._carry = None
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, fut, _ in pending:
+            if not fut.done():
+                fut.set_exception(RuntimeError("Batcher stopped"))
+
+    async def submit(self, img_array):
+        """
+        Queues a (n, H, W, 3) array (n > 1 for TTA variants) and waits for its result.
+        Returns: this request's n rows of the predict_fn output (an (n, num_classes)
+                 array, or a tuple of per-row outputs if predict_fn returns a tuple)
+        """
+        await self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((img_array, fut, time.perf_counter()))
+        return await fut
+
+    def queue_depth(self):
+        """Number of requests waiting to be picked up by the next batch."""
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return depth + (1 if self._carry else 0)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "avg_batch_size": round(self.rows_run / self.batches_run, 2) if self.batches_run else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_counts.items())},
+        }
+
+    async def _collect(self):
+        """Waits for the first item, then fills the batch until it is full or the window closes."""
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = await self._queue.get()
+
+        items = [first]
+        rows = len(first[0])
+        deadline = first[2] + self.max_wait_ms / 1000.0
+
+        while rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+
+            if rows + len(item[0]) > self.max_batch_size:
+                self._carry = item  # goes first in the next batch
+                break
+            items.append(item)
+            rows += len(item[0])
+
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            items = [item for item in items if not item[1].done()]  # drop cancelled requests
+            if not items:
+                continue
+
+            now = time.perf_counter()
+            for _, _, enqueued in items:
+                STAGE_SECONDS.observe(now - enqueued, stage='batch_wait')
+
+            sizes = [len(arr) for arr, _, _ in items]
+            batch = items[0][0] if len(items) == 1 else np.concatenate([arr for arr, _, _ in items])
+
+            start = time.perf_counter()
+            try:
+                probs = await loop.run_in_executor(self.executor, self.predict_fn, batch)
+            except asyncio.CancelledError:
+                # stop() while this batch was running: its requests would otherwise wait forever
+                for _, fut, _ in items:
+                    if not fut.done():
+                        fut.set_exception(RuntimeError("Batcher stopped"))
+                raise
+            except Exception as e:
+                for _, fut, _ in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.last_batch_ms = (time.perf_counter() - start) * 1000
+            self.last_batch_size = len(batch)
+            self.batch_size_counts[len(batch)] += 1
+            self.batches_run += 1
+            self.items_run += len(items)
+            self.rows_run += len(batch)
+
+            offset = 0
+            for (_, fut, _), n in zip(items, sizes):
+                if not fut.done():
+                    fut.set_result(_slice_rows(probs, offset, n))
+                offset += n
+
+
+def _slice_rows(result, offset, n):
+    """Rows [offset, offset + n) of a predict_fn result (array, or tuple of per-row outputs)."""
+    if isinstance(result, tuple):
+        return tuple(part[offset:offset + n] for part in result)
+    return result[offset:offset + n]
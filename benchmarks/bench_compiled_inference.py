@@ -0,0 +1,66 @@
+# bench_compiled_inference.py - Per-call overhead: Keras model.predict() vs compiled tf.function path
+# Compares one member (ResNet50) and the whole weighted ensemble at small batch sizes.
+#
+# Usage:
+#   python benchmarks/bench_compiled_inference.py --batch-sizes 1 4 16 --runs 30 [--jit]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import PneumoniaEnsemble, CompiledPredictor  # noqa: E402
+
+
+def median_ms(fn, runs, warmup=3):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='model.predict vs compiled inference overhead')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--jit', action='store_true', help='XLA jit_compile for the compiled path')
+    args = parser.parse_args()
+
+    # Latency only: untrained members (no artifacts yet) time the same as trained ones
+    keras_ens = PneumoniaEnsemble(inference_mode='keras', allow_untrained=True)
+    compiled_ens = PneumoniaEnsemble(inference_mode='compiled', jit_compile=args.jit, allow_untrained=True)
+    resnet = keras_ens.get_member('resnet50')
+    resnet_compiled = CompiledPredictor.for_model(resnet, jit_compile=args.jit)
+
+    header = f"{'target':<10}{'batch':>6}{'predict() ms':>14}{'compiled ms':>13}{'speedup':>9}"
+    print(header)
+    print('-' * len(header))
+    for batch_size in args.batch_sizes:
+        batch = np.random.randint(0, 256, (batch_size, 224, 224, 3), dtype=np.uint8)
+
+        rows = [
+            ('resnet50',
+             median_ms(lambda: resnet.predict(batch, verbose=0), args.runs),
+             median_ms(lambda: resnet_compiled(batch), args.runs)),
+            ('ensemble',
+             median_ms(lambda: keras_ens.predict(batch), args.runs),
+             median_ms(lambda: compiled_ens.predict(batch), args.runs)),
+        ]
+        for target, keras_ms, compiled_ms in rows:
+            print(f"{target:<10}{batch_size:>6}{keras_ms:>14.2f}{compiled_ms:>13.2f}{keras_ms / compiled_ms:>8.2f}x")
+
+    # Numerical parity of the compiled ensemble against the Keras path
+    batch = np.random.randint(0, 256, (4, 224, 224, 3), dtype=np.uint8)
+    diff = np.abs(keras_ens.predict(batch) - compiled_ens.predict(batch)).max()
+    print(f"\nMax |keras - compiled| ensemble prob difference: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bench_heatmap_delivery.py - Payload size and serialization time per heatmap response mode
+# Same overlay for every mode; measures encode + body serialization only (the Grad-CAM
+# matrix is random unless --gradcam is given, which runs the ensemble's ResNet50 once).
+#
+# Usage:
+#   python benchmarks/bench_heatmap_delivery.py --image virus.jpeg --runs 20 [--gradcam] [--no-colorbar]
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from delivery import encode_image, multipart_parts, quantize_heatmap  # noqa: E402
+from explainability import overlay_heatmap_on_image  # noqa: E402
+from preprocess import load_image_context  # noqa: E402
+
+# A typical scored result without the heatmap
+BASE_RESULT = {
+    "probabilities": [0.12, 0.88], "pneumonia_probability": 0.88, "symptom_score": 0.25, "past_score": 0.0,
+    "final_score": 61.3, "explanation": "Adjusted based on symptoms and history due to unclear X-ray.",
+    "tta_variants": 1, "members_used": ["resnet50", "efficientnetv2s", "vit_tiny"],
+    "cached": False, "near_duplicate": False, "match_distance": None,
+}
+
+
+def median_ms(fn, runs):
+    fn()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times)), out
+
+
+def json_base64(overlaid, fmt, quality):
+    encoded = encode_image(overlaid, fmt, quality)
+    return json.dumps({**BASE_RESULT, "heatmap": base64.b64encode(encoded).decode('ascii')}).encode('utf-8')
+
+
+def multipart(overlaid, fmt, quality):
+    encoded = encode_image(overlaid, fmt, quality)
+    _, parts = multipart_parts({**BASE_RESULT, "heatmap": None}, encoded, fmt)
+    return b''.join(parts)
+
+
+def matrix(heatmap):
+    return json.dumps({**BASE_RESULT, "heatmap": None, "heatmap_matrix": quantize_heatmap(heatmap)}).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Heatmap delivery: payload size and serialization time')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'virus.jpeg'))
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--gradcam', action='store_true', help='real Grad-CAM matrix instead of a random one')
+    parser.add_argument('--no-colorbar', action='store_true')
+    args = parser.parse_args()
+
+    context = load_image_context(args.image)
+    if args.gradcam:
+        from pipeline import compute_heatmap
+        heatmap = compute_heatmap(context.tensor)
+    else:
+        heatmap = np.random.default_rng(0).random((7, 7)).astype(np.float32)
+    overlaid = overlay_heatmap_on_image(heatmap, context, alpha=0.45, add_colorbar=not args.no_colorbar)
+    print(f"Overlay: {overlaid.shape[1]}×{overlaid.shape[0]} | runs: {args.runs}\n")
+
+    modes = [
+        ('json + base64', 'jpeg', 90, lambda: json_base64(overlaid, 'jpeg', 90)),
+        ('json + base64', 'png', 3, lambda: json_base64(overlaid, 'png', 3)),
+        ('multipart', 'jpeg', 90, lambda: multipart(overlaid, 'jpeg', 90)),
+        ('multipart', 'jpeg', 75, lambda: multipart(overlaid, 'jpeg', 75)),
+        ('multipart', 'png', 3, lambda: multipart(overlaid, 'png', 3)),
+        ('multipart', 'png', 9, lambda: multipart(overlaid, 'png', 9)),
+        ('multipart', 'webp', 80, lambda: multipart(overlaid, 'webp', 80)),
+        ('multipart', 'webp', 100, lambda: multipart(overlaid, 'webp', 100)),
+        ('image stream', 'webp', 80, lambda: encode_image(overlaid, 'webp', 80)),
+        ('matrix (uint8)', '-', None, lambda: matrix(heatmap)),
+    ]
+
+    header = f"{'mode':<16}{'format':>8}{'quality':>9}{'payload KB':>12}{'serialize ms':>14}"
+    print(header)
+    print('-' * len(header))
+    for name, fmt, quality, fn in modes:
+        ms, body = median_ms(fn, args.runs)
+        print(f"{name:<16}{fmt:>8}{'' if quality is None else quality:>9}{len(body) / 1024:>12.1f}{ms:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bench_member_parallelism.py - Sequential vs parallel ensemble members
+# Measures single-image latency and batch throughput for each PneumoniaEnsemble execution mode.
+#
+# Usage (run on the target many-core CPU box):
+#   python benchmarks/bench_member_parallelism.py --modes sequential threads processes --runs 50
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import PneumoniaEnsemble  # noqa: E402
+
+
+def time_calls(fn, runs):
+    """Returns per-call latencies in milliseconds."""
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def bench_mode(mode, runs, warmup, batch_size):
+    ensemble = PneumoniaEnsemble(execution_mode=mode, allow_untrained=True)  # latency only
+    try:
+        single = np.random.randint(0, 256, (1, 224, 224, 3), dtype=np.uint8)
+        batch = np.random.randint(0, 256, (batch_size, 224, 224, 3), dtype=np.uint8)
+
+        time_calls(lambda: ensemble.predict(single), warmup)
+        time_calls(lambda: ensemble.predict(batch), max(1, warmup // 2))
+
+        single_ms = time_calls(lambda: ensemble.predict(single), runs)
+        batch_ms = time_calls(lambda: ensemble.predict(batch), max(1, runs // 4))
+        return {
+            'mode': mode,
+            'members': len(ensemble),
+            'p50_ms': np.percentile(single_ms, 50),
+            'p95_ms': np.percentile(single_ms, 95),
+            'single_img_per_s': 1000.0 / single_ms.mean(),
+            'batch_img_per_s': batch_size * 1000.0 / batch_ms.mean(),
+        }
+    finally:
+        ensemble.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sequential vs parallel ensemble members')
+    parser.add_argument('--modes', nargs='+', default=list(PneumoniaEnsemble.EXECUTION_MODES))
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()} | runs: {args.runs} | batch size: {args.batch_size}\n")
+    rows = [bench_mode(mode, args.runs, args.warmup, args.batch_size) for mode in args.modes]
+
+    header = f"{'mode':<12}{'members':>8}{'p50 ms':>10}{'p95 ms':>10}{'1-img/s':>10}{'batch img/s':>13}"
+    print(header)
+    print('-' * len(header))
+    for r in rows:
+        print(f"{r['mode']:<12}{r['members']:>8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['single_img_per_s']:>10.2f}{r['batch_img_per_s']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bench_preprocess_batch.py - Images/s of the batch preprocessing engine vs. the per-image loop
+# "loop" is the previous preprocess_batch: preprocess_image per item, then np.concatenate so both
+# sides end with the same (N, 224, 224, 3) uint8 tensor. "engine" is preprocess_batch() with a
+# thread pool of each requested size.
+#
+# Usage:
+#   python benchmarks/bench_preprocess_batch.py --image virus.jpeg --batch-sizes 1 8 32 --threads 1 2 4 8
+#   python benchmarks/bench_preprocess_batch.py --dir /data/chest_xray/test/PNEUMONIA --runs 5
+#   python benchmarks/bench_preprocess_batch.py --channels 1    → grayscale-native input (N, 224, 224, 1)
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from preprocess import preprocess_batch, preprocess_image  # noqa: E402
+
+
+def loop_batch(items, channels=3):
+    arrays = [preprocess_image(item, is_bytes=True, channels=channels) for item in items]
+    return np.concatenate([a for a in arrays if a is not None], axis=0)
+
+
+def images_per_second(fn, items, runs):
+    fn(items)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(items)
+        times.append(time.perf_counter() - start)
+    return len(items) / float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch preprocessing throughput')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'virus.jpeg'))
+    parser.add_argument('--dir', help='use every .jpeg/.jpg/.png in this directory instead of --image')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--channels', type=int, choices=(1, 3), default=3)
+    args = parser.parse_args()
+
+    if args.dir:
+        paths = sorted(p for ext in ('jpeg', 'jpg', 'png') for p in glob.glob(os.path.join(args.dir, f'*.{ext}')))
+    else:
+        paths = [args.image]
+    blobs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            blobs.append(f.read())
+    print(f"{len(blobs)} source image(s) | runs: {args.runs} | cpus: {os.cpu_count()} | channels: {args.channels}\n")
+
+    # Parity: same tensor either way
+    sample = (blobs * 4)[:4]
+    batch, valid = preprocess_batch(sample, is_bytes=True, channels=args.channels)
+    assert valid.all() and np.array_equal(batch, loop_batch(sample, args.channels)), "engine output differs from loop"
+
+    header = f"{'batch':>6}{'loop img/s':>12}" + ''.join(f"{f'{t} thr img/s':>14}" for t in args.threads)
+    print(header)
+    print('-' * len(header))
+    pools = {t: ThreadPoolExecutor(max_workers=t) for t in args.threads}
+    for n in args.batch_sizes:
+        items = (blobs * (n // len(blobs) + 1))[:n]
+        loop = lambda xs: loop_batch(xs, args.channels)  # noqa: E731
+        row = f"{n:>6}{images_per_second(loop, items, args.runs):>12.1f}"
+        for t in args.threads:
+            engine = lambda xs, pool=pools[t]: preprocess_batch(xs, is_bytes=True, executor=pool,  # noqa: E731
+                                                                channels=args.channels)
+            row += f"{images_per_second(engine, items, args.runs):>14.1f}"
+        print(row)
+    for pool in pools.values():
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_worker_threads.py - Workers × intra-op threads sweep for multi-worker serving
+# Each worker is a separate process (like a uvicorn worker) with its own TF runtime, sized and
+# optionally pinned via configure_threading(); all workers hammer the ensemble at the same time.
+#
+# Usage (run on the target box):
+#   python benchmarks/bench_worker_threads.py --workers 1 2 4 --threads 1 2 4 8 --seconds 20 --pin
+#   python benchmarks/bench_worker_threads.py --batch-size 8 --mode fused
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from models import available_cpus  # noqa: E402
+
+
+def worker_main(index, num_workers, threads, pin, mode, batch_size, seconds, start_barrier, results):
+    """One serving process: configure pools before any TF op, load, warm up, then run flat out."""
+    from models import PneumoniaEnsemble, configure_threading
+
+    applied = configure_threading(intra_op_threads=threads, cpu_affinity='auto' if pin else '',
+                                  worker_index=index, num_workers=num_workers)
+    ensemble = PneumoniaEnsemble(inference_mode=mode, allow_untrained=True)  # latency only
+    batch = np.random.randint(0, 256, (batch_size, 224, 224, 3), dtype=np.uint8)
+    for _ in range(3):
+        ensemble.predict(batch)
+
+    start_barrier.wait()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        ensemble.predict(batch)
+        latencies.append((time.perf_counter() - start) * 1000)
+    ensemble.close()
+    results.put((index, len(latencies) * batch_size, latencies, applied['cpus']))
+
+
+def run_layout(num_workers, threads, args):
+    ctx = mp.get_context('spawn')  # TF is not fork-safe
+    start_barrier = ctx.Barrier(num_workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker_main,
+                         args=(i, num_workers, threads, args.pin, args.mode, args.batch_size,
+                               args.seconds, start_barrier, results))
+             for i in range(num_workers)]
+    for proc in procs:
+        proc.start()
+    rows = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    images = sum(r[1] for r in rows)
+    latencies = np.concatenate([r[2] for r in rows])
+    return {
+        'workers': num_workers,
+        'threads': threads,
+        'img_per_s': images / args.seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep serving workers × TF intra-op threads')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=15.0, help='measurement window per layout')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--mode', default='compiled', help='PneumoniaEnsemble inference_mode')
+    parser.add_argument('--pin', action='store_true', help="pin each worker to its own cores ('auto' affinity)")
+    parser.add_argument('--oversubscribe', action='store_true', help='also run layouts with workers × threads > cores')
+    args = parser.parse_args()
+
+    cores = len(available_cpus())
+    layouts = [(w, t) for w in args.workers for t in args.threads if args.oversubscribe or w * t <= cores]
+    print(f"Cores: {cores} | mode: {args.mode} | batch: {args.batch_size} | pinned: {args.pin} "
+          f"| {len(layouts)} layouts × {args.seconds:.0f}s\n")
+
+    header = f"{'workers':>8}{'threads':>8}{'img/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    rows = []
+    for num_workers, threads in layouts:
+        r = run_layout(num_workers, threads, args)
+        rows.append(r)
+        print(f"{r['workers']:>8}{r['threads']:>8}{r['img_per_s']:>10.2f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+    if rows:
+        best = max(rows, key=lambda r: r['img_per_s'])
+        print(f"\nHighest throughput: WEB_CONCURRENCY={best['workers']} TF_INTRA_OP_THREADS={best['threads']}"
+              f"{' CPU_AFFINITY=auto' if args.pin else ''} → {best['img_per_s']:.2f} img/s "
+              f"(p99 {best['p99_ms']:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# near_dup_false_matches.py - pHash radius vs. false / true near-duplicate matches on the test split
+# Near-duplicate reuse (dedup.py, NEAR_DUP_MAX_DISTANCE) hands one upload's probabilities to
+# another. Chest radiographs are structurally alike, so different patients can hash close
+# together. Per Hamming radius this reports:
+#   false-match rate: share of test images whose nearest *other* test image is within the radius
+#                     (they would be served another patient's findings)
+#   true-match rate:  share of re-encoded copies (JPEG quality 60, half resolution) found within
+#                     the radius of their original
+# Pick the largest radius whose false-match rate is acceptable (ideally 0); the results are
+# written to REPORT_PATH.
+#
+# Usage:
+#   python benchmarks/near_dup_false_matches.py [--limit 0] [--max-radius 12] [--report near_dup_report.md]
+
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from dedup import perceptual_hash  # noqa: E402
+from preprocess import preprocess_image  # noqa: E402
+
+REPORT_PATH = 'near_dup_report.md'
+
+
+def load_test_split(limit):
+    """Raw encoded bytes from the HF test split (images left undecoded)."""
+    from datasets import Image, load_dataset
+    split = load_dataset("hf-vision/chest-xray-pneumonia", split='test').cast_column('image', Image(decode=False))
+    if limit:
+        split = split.select(range(min(limit, len(split))))
+    return [row['image']['bytes'] for row in split]
+
+
+def re_encodes(data):
+    """The copies near-duplicate reuse is meant for: lower JPEG quality, half resolution."""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    low_quality = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 60])[1].tobytes()
+    half = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    return [low_quality, cv2.imencode('.jpg', half, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()]
+
+
+def phash(data):
+    return perceptual_hash(preprocess_image(data, is_bytes=True))
+
+
+def distances(a, b):
+    """Pairwise Hamming distances between two uint64 hash arrays: (len(a), len(b))."""
+    xor = (a[:, np.newaxis] ^ b[np.newaxis, :]).view(np.uint8).reshape(len(a), len(b), 8)
+    return np.unpackbits(xor, axis=-1).sum(axis=-1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Near-duplicate pHash radius: false vs. true match rates')
+    parser.add_argument('--limit', type=int, default=0, help='first N test images (0 = all)')
+    parser.add_argument('--max-radius', type=int, default=12)
+    parser.add_argument('--report', default=REPORT_PATH, help='Markdown report path')
+    args = parser.parse_args()
+
+    blobs = load_test_split(args.limit)
+    # Byte-identical files are exact-cache hits, not near-duplicates: keep one of each
+    blobs = list(dict.fromkeys(blobs))
+    originals = np.array([phash(data) for data in blobs], dtype=np.uint64)
+    copies = [(i, phash(copy)) for i, data in enumerate(blobs) for copy in re_encodes(data)]
+
+    between = distances(originals, originals)
+    np.fill_diagonal(between, 64)
+    nearest_other = between.min(axis=1)
+    copy_distance = np.array([distances(np.array([h], dtype=np.uint64), originals[i:i + 1])[0, 0]
+                              for i, h in copies])
+
+    lines = [
+        f"# Near-duplicate radius report ({len(blobs)} distinct test images, {len(copies)} re-encodes)",
+        "",
+        "| radius (bits) | false-match rate | true-match rate |",
+        "|---|---|---|",
+    ]
+    for radius in range(args.max_radius + 1):
+        lines.append(f"| {radius} | {np.mean(nearest_other <= radius):.4f} | {np.mean(copy_distance <= radius):.4f} |")
+    lines += ["", f"Nearest distinct image: min {nearest_other.min()} bits, "
+                  f"median {int(np.median(nearest_other))} bits"]
+
+    report = "\n".join(lines) + "\n"
+    with open(args.report, 'w') as f:
+        f.write(report)
+    print(report)
+    print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
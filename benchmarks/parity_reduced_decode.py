@@ -0,0 +1,141 @@
+# parity_reduced_decode.py - Reduced-scale / grayscale decode vs. full BGR decode on the test split
+# Per image: decode time and peak decode memory (tracemalloc sees OpenCV's numpy-backed bitmaps)
+# for both paths, then the ensemble's accuracy and prediction agreement on the two tensors.
+# The results are written to REPORT_PATH; the run fails (exit 1) if the reduced decode loses more
+# than --max-accuracy-drop accuracy, so the parity claim is a recorded, checked measurement.
+#
+# Usage:
+#   python benchmarks/parity_reduced_decode.py [--limit 200] [--batch-size 16] [--no-model]
+#                                              [--max-accuracy-drop 0.005] [--report decode_parity_report.md]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from preprocess import decode_image, probe_image, to_rgb  # noqa: E402
+
+TARGET_SIZE = (224, 224)
+REPORT_PATH = 'decode_parity_report.md'
+
+
+def full_decode(data):
+    """The previous path: full-resolution 3-channel decode, BGR → RGB, then INTER_AREA."""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return cv2.resize(img, TARGET_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def reduced_decode(data):
+    img = decode_image(data, TARGET_SIZE)
+    return to_rgb(cv2.resize(img, TARGET_SIZE, interpolation=cv2.INTER_AREA))
+
+
+def measure(fn, data):
+    """(resized RGB uint8, seconds, peak bytes allocated while decoding)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = fn(data)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, seconds, peak
+
+
+def load_test_split(limit):
+    """Raw encoded bytes + labels from the HF test split (images left undecoded)."""
+    from datasets import Image, load_dataset
+    split = load_dataset("hf-vision/chest-xray-pneumonia", split='test').cast_column('image', Image(decode=False))
+    if limit:
+        split = split.select(range(min(limit, len(split))))
+    return [row['image']['bytes'] for row in split], np.array(split['label'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reduced-resolution decode: speed, memory and accuracy parity')
+    parser.add_argument('--limit', type=int, default=0, help='first N test images (0 = all)')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--no-model', action='store_true', help='decode timings only')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.005,
+                        help='fail if reduced-decode accuracy is lower than full decode by more than this')
+    parser.add_argument('--report', default=REPORT_PATH, help='Markdown report path')
+    args = parser.parse_args()
+
+    blobs, labels = load_test_split(args.limit)
+    rows = {'full': [], 'reduced': []}
+    tensors = {'full': [], 'reduced': []}
+    sizes, gray = [], 0
+    for data in blobs:
+        info = probe_image(data)
+        if info is not None:
+            sizes.append(min(info[1], info[2]))
+            gray += info[3] == 1
+        for name, fn in (('full', full_decode), ('reduced', reduced_decode)):
+            img, seconds, peak = measure(fn, data)
+            rows[name].append((seconds * 1000, peak / 2**20))
+            tensors[name].append(img)
+
+    lines = [
+        f"# Reduced-decode parity report ({len(blobs)} test images)",
+        "",
+        f"Median short side: {int(np.median(sizes)) if sizes else '?'} px | single-channel sources: {gray}",
+        "",
+        "| decode | median ms | p95 ms | peak MB (median) | peak MB (max) |",
+        "|---|---|---|---|---|",
+    ]
+    for name, values in rows.items():
+        ms, mb = np.array(values).T
+        lines.append(f"| {name} | {np.median(ms):.2f} | {np.percentile(ms, 95):.2f} | "
+                     f"{np.median(mb):.2f} | {mb.max():.2f} |")
+
+    diff = np.abs(np.stack(tensors['full']).astype(np.int16) - np.stack(tensors['reduced']).astype(np.int16))
+    lines += ["", f"Resized pixels: mean |Δ| {diff.mean():.3f}, max |Δ| {diff.max()} (0-255)"]
+    passed = True
+    if not args.no_model:
+        passed = accuracy_parity(tensors, labels, args.batch_size, args.max_accuracy_drop, lines)
+
+    report = "\n".join(lines) + "\n"
+    with open(args.report, 'w') as f:
+        f.write(report)
+    print(report)
+    print(f"Report written to {args.report}")
+    if not passed:
+        sys.exit(1)
+
+
+def accuracy_parity(tensors, labels, batch_size, max_drop, lines):
+    """Ensemble accuracy on both decodes; appends the results to `lines`. Returns False if parity fails."""
+
+    from models import PneumoniaEnsemble
+    ensemble = PneumoniaEnsemble()  # trained weights only (no untrained fallback)
+    probs = {}
+    for name, images in tensors.items():
+        batch = np.stack(images)
+        probs[name] = np.concatenate([ensemble.predict(batch[i:i + batch_size])
+                                      for i in range(0, len(batch), batch_size)])
+    preds = {name: p.argmax(axis=1) for name, p in probs.items()}
+    accuracy = {name: float(np.mean(p == labels)) for name, p in preds.items()}
+    drop = accuracy['full'] - accuracy['reduced']
+    passed = drop <= max_drop
+    lines += [
+        "",
+        "| decode | accuracy |",
+        "|---|---|",
+        f"| full | {accuracy['full']:.4f} |",
+        f"| reduced | {accuracy['reduced']:.4f} |",
+        "",
+        f"Prediction agreement: {np.mean(preds['full'] == preds['reduced']):.4f} | "
+        f"max |Δp| {np.abs(probs['full'] - probs['reduced']).max():.4f}",
+        f"Accuracy drop: {drop:+.4f} (limit {max_drop:.4f}) → {'PASS' if passed else 'FAIL'}",
+    ]
+    return passed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# cache.py - Content-addressed cache of image findings (ensemble probabilities + heatmap)
+# Keyed by sha256(image bytes + inference fingerprint); symptom / history scoring is never
+# cached and runs fresh on every request (see pipeline.score_findings).
+#
+# Tiers: in-process LRU bounded by bytes → optional on-disk JSON store that survives restarts.
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+CACHE_CONFIG = {
+    'memory_mb': float(os.getenv('RESULT_CACHE_MB', '256')),    # 0 disables the in-process tier
+    'disk_dir': os.getenv('RESULT_CACHE_DIR', ''),              # '' disables the on-disk tier
+    'disk_mb': float(os.getenv('RESULT_CACHE_DISK_MB', '2048')),
+}
+
+
+def cache_key(image_bytes, fingerprint):
+    """sha256 over the raw upload and the inference fingerprint (hex digest)."""
+    h = hashlib.sha256()
+    h.update(image_bytes)
+    h.update(b'\0')
+    h.update(json.dumps(fingerprint, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe two-tier cache of JSON-serialisable findings dicts.
+
+    Args:
+        max_bytes: in-process tier budget (serialised size); least recently used entries go first
+        disk_dir: directory for the persistent tier (None = memory only)
+        max_disk_bytes: persistent tier budget; oldest files are pruned past it
+    """
+    DISK_PRUNE_EVERY = 64  # writes between disk budget checks
+
+    def __init__(self, max_bytes=256 * 2**20, disk_dir=None, max_disk_bytes=2 * 2**30):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir or None
+        self.max_disk_bytes = int(max_disk_bytes)
+        self._entries = OrderedDict()  # key → (findings, size)
+        self._bytes = 0
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_errors': 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config=CACHE_CONFIG):
+        return cls(max_bytes=config['memory_mb'] * 2**20, disk_dir=config['disk_dir'],
+                   max_disk_bytes=config['disk_mb'] * 2**20)
+
+    # ── in-process tier ─────────────────────────────────────────
+    def _remember(self, key, findings, size):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (findings, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.counters['evictions'] += 1
+
+    # ── on-disk tier ────────────────────────────────────────────
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.json')
+
+    def _disk_get(self, key):
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                payload = f.read()
+            return json.loads(payload), len(payload)
+        except FileNotFoundError:
+            return None, 0
+        except (OSError, ValueError) as e:
+            self.counters['disk_errors'] += 1
+            print(f"Result cache: unreadable entry {key[:12]}… ({e})")
+            return None, 0
+
+    def _disk_put(self, key, payload):
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)  # atomic: readers never see a partial entry
+        except OSError as e:
+            self.counters['disk_errors'] += 1
+            print(f"Result cache: failed to write {key[:12]}… ({e})")
+            return
+        self._disk_writes += 1
+        if self._disk_writes % self.DISK_PRUNE_EVERY == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Deletes the least recently written files until the disk tier fits its budget."""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    # ── public API ──────────────────────────────────────────────
+    def get(self, key, count=True):
+        """
+        Returns the cached findings dict, or None on a miss (disk hits are promoted to memory).
+        count=False leaves the hit / miss counters alone (secondary lookups, e.g. near-duplicates).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters['memory_hits'] += count
+                return entry[0]
+
+        if self.disk_dir:
+            findings, size = self._disk_get(key)
+            if findings is not None:
+                with self._lock:
+                    self._remember(key, findings, size)
+                    self.counters['disk_hits'] += count
+                return findings
+
+        with self._lock:
+            self.counters['misses'] += count
+        return None
+
+    def put(self, key, findings):
+        payload = json.dumps(findings).encode('utf-8')
+        with self._lock:
+            self._remember(key, findings, len(payload))
+        if self.disk_dir:
+            self._disk_put(key, payload)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            lookups = hits + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'memory_limit_bytes': self.max_bytes,
+                'disk_dir': self.disk_dir,
+            }
@@ -0,0 +1,5 @@
+# conftest.py - pytest collection settings
+# test_core.py is a standalone end-to-end script (python test_core.py): it runs at import and
+# needs the trained weights from train.py, so pytest only collects the unit tests.
+
+collect_ignore = ["test_core.py"]
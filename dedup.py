@@ -0,0 +1,138 @@
+# dedup.py - Perceptual-hash index of scored images (near-duplicate reuse)
+# The same radiograph re-exported at another JPEG quality / resolution hashes to different
+# bytes but (almost) the same 64-bit DCT pHash. Lookups are multi-index hashing (MIH):
+# the hash is split into CHUNKS substrings, and any hash within Hamming distance r shares
+# at least one substring within distance r // CHUNKS (pigeonhole), so only a few buckets
+# are probed instead of scanning every stored hash.
+
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+DEDUP_CONFIG = {
+    # Hamming bits; < 0 (default) disables reuse. Opt-in: chest radiographs are structurally
+    # alike, so pick the radius from measured false-match rates (benchmarks/near_dup_false_matches.py)
+    'max_distance': int(os.getenv('NEAR_DUP_MAX_DISTANCE', '-1')),
+    'max_entries': int(os.getenv('NEAR_DUP_MAX_ENTRIES', '100000')),
+}
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def perceptual_hash(img_array):
+    """
+    64-bit DCT pHash of a preprocessed uint8 image ((1, H, W, 3) or (H, W, 3), as returned by
+    preprocess_image). Channels are averaged, downscaled to 32×32, and the 8×8 lowest DCT
+    frequencies are thresholded at their median.
+    Returns: int in [0, 2**64)
+    """
+    img = np.asarray(img_array, dtype=np.float32)
+    if img.ndim == 4:
+        img = img[0]
+    gray = img.mean(axis=-1) if img.ndim == 3 else img
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # DC bit fixed at 0: overall brightness must not flip bits
+    bits = np.concatenate([[False], low[1:] > np.median(low[1:])])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _chunks(h):
+    return [(h >> (i * CHUNK_BITS)) & _CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _neighbours(value, radius):
+    """All CHUNK_BITS-bit values within `radius` bit flips of `value` (including itself)."""
+    yield value
+    for r in range(1, radius + 1):
+        for positions in itertools.combinations(range(CHUNK_BITS), r):
+            flipped = value
+            for pos in positions:
+                flipped ^= 1 << pos
+            yield flipped
+
+
+class NearDuplicateIndex:
+    """
+    Thread-safe pHash → payload index with bounded size (oldest entries evicted first).
+    Payloads are namespaced (e.g. by inference fingerprint) so results from another model
+    configuration are never reused.
+
+    Args:
+        max_distance: default Hamming radius for lookup()
+        max_entries: capacity
+    """
+    def __init__(self, max_distance=6, max_entries=100_000):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._entries = OrderedDict()                    # id → (hash, namespace, payload)
+        self._buckets = [dict() for _ in range(CHUNKS)]  # chunk value → set(ids)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @classmethod
+    def from_config(cls, config=DEDUP_CONFIG):
+        return cls(max_distance=config['max_distance'], max_entries=config['max_entries'])
+
+    def _remove(self, entry_id):
+        h, _, _ = self._entries.pop(entry_id)
+        for bucket, value in zip(self._buckets, _chunks(h)):
+            ids = bucket.get(value)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del bucket[value]
+
+    def add(self, h, payload, namespace=None):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (h, namespace, payload)
+            for bucket, value in zip(self._buckets, _chunks(h)):
+                bucket.setdefault(value, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def lookup(self, h, namespace=None, max_distance=None):
+        """
+        Nearest stored hash within `max_distance` bits in `namespace`.
+        Returns: (payload, distance) or (None, None)
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        if max_distance < 0:
+            return None, None
+        radius = max_distance // CHUNKS
+        with self._lock:
+            candidates = set()
+            for bucket, value in zip(self._buckets, _chunks(h)):
+                for probe in _neighbours(value, radius):
+                    candidates.update(bucket.get(probe, ()))
+
+            best, best_distance = None, None
+            for entry_id in candidates:
+                stored, ns, payload = self._entries[entry_id]
+                if ns != namespace:
+                    continue
+                distance = hamming(h, stored)
+                if distance <= max_distance and (best_distance is None or distance < best_distance):
+                    best, best_distance = payload, distance
+
+            self.counters['hits' if best is not None else 'misses'] += 1
+            return best, best_distance
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'entries': len(self._entries), 'max_distance': self.max_distance}
@@ -0,0 +1,91 @@
+# delivery.py - Heatmap encoding and response bodies (base64-in-JSON, multipart, raw matrix)
+# Base64 inflates the image by a third and needs the whole encoded image in memory before the
+# JSON is written; the binary modes send the encoded bytes as-is, and the matrix mode sends
+# only the native-resolution Grad-CAM grid (7×7 for ResNet50) for clients that draw their own overlay.
+
+import base64
+import json
+import uuid
+
+import cv2
+import numpy as np
+from metrics import timed
+
+RESPONSE_FORMATS = ('json', 'multipart', 'matrix')
+HEATMAP_FORMATS = ('jpeg', 'png', 'webp')
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+# jpeg / webp: quality 0-100; png: zlib compression level 0-9 (lossless either way)
+DEFAULT_QUALITY = {'jpeg': 90, 'png': 3, 'webp': 80}
+_QUALITY_FLAGS = {'jpeg': cv2.IMWRITE_JPEG_QUALITY, 'png': cv2.IMWRITE_PNG_COMPRESSION,
+                  'webp': cv2.IMWRITE_WEBP_QUALITY}
+STREAM_CHUNK = 64 * 1024
+
+
+def check_formats(response_format='json', heatmap_format='jpeg', quality=None):
+    """Raises ValueError for unsupported response / image formats or quality values."""
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"response_format must be one of {RESPONSE_FORMATS}, got '{response_format}'")
+    if heatmap_format not in HEATMAP_FORMATS:
+        raise ValueError(f"heatmap_format must be one of {HEATMAP_FORMATS}, got '{heatmap_format}'")
+    if quality is not None and not 0 <= quality <= (9 if heatmap_format == 'png' else 100):
+        raise ValueError(f"heatmap_quality {quality} out of range for {heatmap_format}")
+
+
+@timed('encode')
+def encode_image(rgb_image, fmt='jpeg', quality=None):
+    """Encodes an RGB uint8 image. Returns the encoded bytes (None if encoding fails)."""
+    quality = DEFAULT_QUALITY[fmt] if quality is None else quality
+    ok, buf = cv2.imencode('.' + fmt.replace('jpeg', 'jpg'), cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR),
+                           [_QUALITY_FLAGS[fmt], int(quality)])
+    return buf.tobytes() if ok else None
+
+
+def encode_image_base64(rgb_image, fmt='jpeg', quality=None):
+    """Encodes an RGB uint8 image to a base64 string (None if encoding fails)."""
+    encoded = encode_image(rgb_image, fmt, quality)
+    return base64.b64encode(encoded).decode('ascii') if encoded is not None else None
+
+
+# ────────────────────────────────────────────────────────────────
+# Raw heatmap matrix
+# ────────────────────────────────────────────────────────────────
+def quantize_heatmap(heatmap):
+    """Grad-CAM matrix in [0, 1] → nested lists of uint8 (0-255), at native resolution."""
+    return np.clip(np.round(np.asarray(heatmap, dtype=np.float32) * 255), 0, 255).astype(np.uint8).tolist()
+
+
+def dequantize_heatmap(matrix):
+    """Inverse of quantize_heatmap: uint8 lists → float32 array in [0, 1]."""
+    return np.asarray(matrix, dtype=np.float32) / 255.0
+
+
+# ────────────────────────────────────────────────────────────────
+# Binary bodies
+# ────────────────────────────────────────────────────────────────
+def iter_bytes(data, chunk_size=STREAM_CHUNK):
+    """Yields `data` in chunks (StreamingResponse bodies)."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+
+def multipart_parts(result, image_bytes, fmt='png', boundary=None):
+    """
+    multipart/mixed body: part 1 = the JSON result (without base64 heatmap), part 2 = the
+    encoded heatmap image (omitted when None).
+    Returns: (content_type, iterator of byte chunks)
+    """
+    boundary = boundary or uuid.uuid4().hex
+
+    def parts():
+        yield (f'--{boundary}\r\nContent-Type: application/json\r\n\r\n'.encode('ascii')
+               + json.dumps(result).encode('utf-8') + b'\r\n')
+        if image_bytes is not None:
+            yield (f'--{boundary}\r\nContent-Type: {CONTENT_TYPES[fmt]}\r\n'
+                   f'Content-Disposition: attachment; filename="heatmap.{fmt}"\r\n'
+                   f'Content-Length: {len(image_bytes)}\r\n\r\n').encode('ascii')
+            yield from iter_bytes(image_bytes)
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode('ascii')
+
+    return f'multipart/mixed; boundary={boundary}', parts()
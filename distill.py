@@ -0,0 +1,165 @@
+# distill.py - Knowledge distillation of the 3-model ensemble into one compact student
+# Teacher targets are PneumoniaEnsemble soft-vote probabilities; the student is MobileNetV2.
+# Serve the result with PneumoniaEnsemble(members=['student']).
+
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from explainability import build_gradcam_model, compute_gradcam_heatmap
+from models import GRADCAM_LAYERS
+
+DISTILL_ALPHA = 0.3          # weight of the hard-label loss (1 - alpha goes to the teacher)
+DISTILL_TEMPERATURE = 3.0    # softens teacher + student distributions for the KL term
+
+
+def teacher_dataset(ds, teacher, num_classes):
+    """
+    Wraps a batched (image, one-hot label) dataset so every batch also carries the
+    ensemble's soft-vote probabilities: yields (image, concat(label, teacher_probs)).
+    The teacher runs on the same (augmented) batch the student sees.
+    """
+    def generator():
+        for images, labels in ds:
+            teacher_probs = teacher.predict(images.numpy())
+            yield images, np.concatenate([labels.numpy(), teacher_probs.astype(np.float32)], axis=1)
+
+    image_spec, _ = ds.element_spec
+    return tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            image_spec,
+            tf.TensorSpec(shape=(None, 2 * num_classes), dtype=tf.float32)
+        )
+    ).prefetch(tf.data.AUTOTUNE)
+
+
+def distillation_loss(num_classes, alpha=DISTILL_ALPHA, temperature=DISTILL_TEMPERATURE):
+    """
+    alpha * CE(hard labels, student) + (1 - alpha) * T² * KL(teacher_T || student_T).
+    y_true = [one-hot label | teacher probs]; the student outputs softmax probabilities,
+    so temperatures are applied to their logs.
+    """
+    eps = 1e-7
+
+    def loss(y_true, y_pred):
+        hard, teacher = y_true[:, :num_classes], y_true[:, num_classes:]
+        y_pred = tf.clip_by_value(y_pred, eps, 1.0)
+        ce = tf.keras.losses.categorical_crossentropy(hard, y_pred)
+
+        teacher_t = tf.nn.softmax(tf.math.log(tf.clip_by_value(teacher, eps, 1.0)) / temperature)
+        student_log_t = tf.nn.log_softmax(tf.math.log(y_pred) / temperature)
+        kl = tf.reduce_sum(teacher_t * (tf.math.log(teacher_t + eps) - student_log_t), axis=-1)
+
+        return alpha * ce + (1 - alpha) * (temperature ** 2) * kl
+
+    return loss
+
+
+def distill_student(student, teacher, train_ds, val_ds, num_classes, epochs=10, learning_rate=1e-4,
+                    alpha=DISTILL_ALPHA, temperature=DISTILL_TEMPERATURE, callbacks=None):
+    """
+    Trains `student` on teacher targets, then recompiles it with the usual loss/metrics
+    (accuracy, Recall) so it can be evaluated and saved like any other member.
+    """
+    student.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                    loss=distillation_loss(num_classes, alpha, temperature))
+    student.fit(
+        teacher_dataset(train_ds, teacher, num_classes),
+        validation_data=teacher_dataset(val_ds, teacher, num_classes),
+        epochs=epochs,
+        callbacks=callbacks or [],
+        verbose=1
+    )
+    student.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                    loss='categorical_crossentropy',
+                    metrics=['accuracy', 'Recall'])
+    return student
+
+
+# ────────────────────────────────────────────────────────────────
+# Side-by-side report: student vs full ensemble
+# ────────────────────────────────────────────────────────────────
+def _weights_mb(ensemble):
+    models = ensemble.models or [ensemble.get_member(name) for name in ensemble.member_names]
+    return sum(w.size * w.dtype.itemsize for m in models for w in m.get_weights()) / 1e6
+
+
+def serving_rss_mb(members=None, channels=3):
+    """
+    Resident memory (MB) of a fresh process that loads PneumoniaEnsemble(members=...) and runs
+    one prediction plus one Grad-CAM pass on its Grad-CAM member, as the API does per request —
+    measured in a subprocess so both sides start from a clean slate.
+    Returns None if it cannot be measured (non-Linux, load failure).
+    """
+    code = (
+        "import numpy as np\n"
+        "from models import PneumoniaEnsemble, GRADCAM_LAYERS\n"
+        "from explainability import compute_gradcam_heatmap\n"
+        f"ens = PneumoniaEnsemble(members={members!r}, inference_mode='compiled', input_channels={channels})\n"
+        f"img = np.zeros((1, 224, 224, {channels}), dtype=np.uint8)\n"
+        "ens.predict(img)\n"
+        "compute_gradcam_heatmap(img, ens.get_member(ens.gradcam_member), GRADCAM_LAYERS[ens.gradcam_member])\n"
+        "print('RSS_KB', [l.split()[1] for l in open('/proc/self/status') if l.startswith('VmRSS:')][0])\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in result.stdout.splitlines():
+        if line.startswith('RSS_KB'):
+            return int(line.split()[1]) / 1024
+    return None
+
+
+def evaluate_predictor(ensemble, test_ds, latency_runs=30):
+    """
+    Test recall/accuracy + median single-image latency through PneumoniaEnsemble.predict(), and
+    of the Grad-CAM pass the API adds per request (on ResNet50, or the student served alone).
+    """
+    y_true, y_pred = [], []
+    for images, labels in test_ds:
+        y_pred.append(ensemble.predict(images.numpy()).argmax(axis=1))
+        y_true.append(labels.numpy().argmax(axis=1))
+    y_true, y_pred = np.concatenate(y_true), np.concatenate(y_pred)
+    positives = y_true > 0
+
+    single = next(iter(test_ds))[0].numpy()[:1]
+    ensemble.predict(single)
+    times = []
+    for _ in range(latency_runs):
+        start = time.perf_counter()
+        ensemble.predict(single)
+        times.append((time.perf_counter() - start) * 1000)
+
+    member = ensemble.gradcam_member
+    grad_model = build_gradcam_model(ensemble.get_member(member), GRADCAM_LAYERS[member])
+    compute_gradcam_heatmap(single, None, grad_model=grad_model)
+    gradcam_times = []
+    for _ in range(latency_runs):
+        start = time.perf_counter()
+        compute_gradcam_heatmap(single, None, grad_model=grad_model)
+        gradcam_times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'recall': float((y_pred[positives] > 0).mean()) if positives.any() else float('nan'),
+        'accuracy': float((y_pred == y_true).mean()),
+        'latency_ms': float(np.median(times)),
+        'gradcam_ms': float(np.median(gradcam_times)),
+        'weights_mb': _weights_mb(ensemble),
+    }
+
+
+def print_distillation_report(ensemble_stats, student_stats):
+    print("\n=== Distillation report (test split) ===")
+    print(f"{'':<16}{'ensemble':>12}{'student':>12}")
+    # gradcam_ms: ResNet50 for the ensemble, the student's last conv block for the student;
+    # rss_mb includes the Grad-CAM model on both sides
+    for key, fmt in [('recall', '{:.4f}'), ('accuracy', '{:.4f}'), ('latency_ms', '{:.1f}'),
+                     ('gradcam_ms', '{:.1f}'), ('weights_mb', '{:.1f}'), ('rss_mb', '{:.0f}')]:
+        e, s = ensemble_stats.get(key), student_stats.get(key)
+        if e is None or s is None:
+            continue
+        print(f"{key:<16}{fmt.format(e):>12}{fmt.format(s):>12}")
@@ -4,13 +4,28 @@ import cv2
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras import backend as K
-from preprocess import preprocess_image  # Reuse from your preprocess.py
+from preprocess import ImageContext, to_rgb  # Reuse from your preprocess.py
+from metrics import stage, timed
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt  # For optional colorbar
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 
-def compute_gradcam_heatmap(img_array, model, last_conv_layer_name='conv5_block3_out', pred_index=None):
+def build_gradcam_model(model, last_conv_layer_name='conv5_block3_out'):
+    """
+    Builds the Grad-CAM sub-model (last conv activations + final predictions).
+    Build it once and pass it to compute_gradcam_heatmap(grad_model=...) to avoid
+    rebuilding the graph on every request.
+    """
+    return tf.keras.models.Model(
+        [model.inputs],
+        [model.get_layer(last_conv_layer_name).output, model.output]
+    )
+
+
+@timed('gradcam')
+def compute_gradcam_heatmap(img_array, model, last_conv_layer_name='conv5_block3_out', pred_index=None,
+                            grad_model=None):
     """
     Computes the raw Grad-CAM heatmap matrix (activation map).
     Returns: numpy array (shape e.g. (224,224) or original conv size, values 0-1)
@@ -18,10 +33,8 @@ def compute_gradcam_heatmap(img_array, model, last_conv_layer_name='conv5_block3
     """
     try:
         # Build a sub-model that outputs last conv activations + final predictions
-        grad_model = tf.keras.models.Model(
-            [model.inputs],
-            [model.get_layer(last_conv_layer_name).output, model.output]
-        )
+        if grad_model is None:
+            grad_model = build_gradcam_model(model, last_conv_layer_name)
 
         with tf.GradientTape() as tape:
             conv_outputs, preds = grad_model(img_array)
@@ -49,73 +62,89 @@ def compute_gradcam_heatmap(img_array, model, last_conv_layer_name='conv5_block3
         return None, None
 
 
-def overlay_heatmap_on_image(heatmap, img_path, alpha=0.4, colormap=cv2.COLORMAP_JET,
+def overlay_heatmap_on_image(heatmap, image, alpha=0.4, colormap=cv2.COLORMAP_JET,
                              upsample_method=cv2.INTER_CUBIC, add_colorbar=False):
     """
     Improved overlay: preserves original image resolution, smooth upsampling, optional colorbar.
+
+    `image` is the preprocess.ImageContext of the analysed image (its decoded original is reused,
+    nothing is read again) or a file path.
     """
     if heatmap is None or heatmap.size == 0:
         return None
 
-    # Load original image (keep original size & quality)
-    img = cv2.imread(img_path)
+    # Original image (keep original size & quality)
+    if isinstance(image, ImageContext):
+        img = image.original
+    else:
+        with stage('overlay_decode'):
+            img = cv2.imread(image)
     if img is None:
         return None
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # Convert to RGB for correct colors
 
-    orig_h, orig_w = img.shape[:2]
+    with stage('overlay'):
+        img = to_rgb(img)  # Convert to RGB for correct colors (BGR or single-channel original)
 
-    # Protect against zero-division
-    if np.max(heatmap) == 0:
-        heatmap_resized = np.zeros((orig_h, orig_w))
-    else:
-        heatmap = heatmap / np.max(heatmap)
-        heatmap_resized = cv2.resize(heatmap, (orig_w, orig_h), interpolation=upsample_method)
+        orig_h, orig_w = img.shape[:2]
 
-    heatmap_8bit = np.uint8(255 * heatmap_resized)
-    heatmap_colored = cv2.applyColorMap(heatmap_8bit, colormap)
-    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+        # Protect against zero-division
+        if np.max(heatmap) == 0:
+            heatmap_resized = np.zeros((orig_h, orig_w))
+        else:
+            heatmap = heatmap / np.max(heatmap)
+            heatmap_resized = cv2.resize(heatmap, (orig_w, orig_h), interpolation=upsample_method)
 
-    # Overlay on original high-res image
-    overlaid = cv2.addWeighted(img, 1 - alpha, heatmap_colored, alpha, 0)
+        heatmap_8bit = np.uint8(255 * heatmap_resized)
+        heatmap_colored = cv2.applyColorMap(heatmap_8bit, colormap)
+        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+
+        # Overlay on original high-res image
+        overlaid = cv2.addWeighted(img, 1 - alpha, heatmap_colored, alpha, 0)
 
     if add_colorbar:
-        fig = plt.figure(figsize=(6, 4))
-        canvas = FigureCanvas(fig)
-        ax = fig.add_subplot(111)
-        im = ax.imshow(overlaid)
-        cbar = fig.colorbar(im, ax=ax, orientation='vertical')
-        cbar.set_label('Model Attention (Red = High)')
-        ax.axis('off')
-
-        # Tight layout to minimize whitespace
-        fig.tight_layout(pad=0)
-
-        canvas.draw()
-
-        buf = canvas.buffer_rgba()
-        rgba_array = np.asarray(buf)
-
-        # Optional: crop to non-transparent content if padding appears
-        # alpha = rgba_array[..., 3]
-        # non_zero = np.where(alpha > 0)
-        # if non_zero[0].size > 0:
-        #     min_y, max_y = non_zero[0].min(), non_zero[0].max()
-        #     min_x, max_x = non_zero[1].min(), non_zero[1].max()
-        #     rgba_array = rgba_array[min_y:max_y+1, min_x:max_x+1]
-
-        rgb_array = rgba_array[..., :3]
-        plt.close(fig)
-        return rgb_array
+        return _render_colorbar(overlaid)
     else:
         return overlaid
 
 
+@timed('colorbar')
+def _render_colorbar(overlaid):
+    """Draws the overlay with a matplotlib colorbar (the slowest part of the overlay)."""
+    fig = plt.figure(figsize=(6, 4))
+    canvas = FigureCanvas(fig)
+    ax = fig.add_subplot(111)
+    im = ax.imshow(overlaid)
+    cbar = fig.colorbar(im, ax=ax, orientation='vertical')
+    cbar.set_label('Model Attention (Red = High)')
+    ax.axis('off')
+
+    # Tight layout to minimize whitespace
+    fig.tight_layout(pad=0)
+
+    canvas.draw()
+
+    buf = canvas.buffer_rgba()
+    rgba_array = np.asarray(buf)
+
+    # Optional: crop to non-transparent content if padding appears
+    # alpha = rgba_array[..., 3]
+    # non_zero = np.where(alpha > 0)
+    # if non_zero[0].size > 0:
+    #     min_y, max_y = non_zero[0].min(), non_zero[0].max()
+    #     min_x, max_x = non_zero[1].min(), non_zero[1].max()
+    #     rgba_array = rgba_array[min_y:max_y+1, min_x:max_x+1]
+
+    rgb_array = rgba_array[..., :3]
+    plt.close(fig)
+    return rgb_array
+
+
 # ────────────────────────────────────────────────────────────────
 # NEW FUNCTION: Connects ensemble from models.py to existing Grad-CAM
 # ────────────────────────────────────────────────────────────────
 
-def get_ensemble_heatmap(img_array, ensemble, img_path, alpha=0.45, colormap=cv2.COLORMAP_JET, add_colorbar=True):
+def get_ensemble_heatmap(img_array, ensemble, image, alpha=0.45, colormap=cv2.COLORMAP_JET, add_colorbar=True,
+                         grad_model=None):
     """
     Generates Grad-CAM heatmap using the ResNet50 model inside the ensemble
     (because ResNet50 gives the clearest, most interpretable heatmaps).
@@ -123,24 +152,26 @@ def get_ensemble_heatmap(img_array, ensemble, img_path, alpha=0.45, colormap=cv2
     Args:
         img_array: Preprocessed image array (from preprocess_image)
         ensemble: PneumoniaEnsemble instance from models.py
-        img_path: Path to original X-ray image
+        image: ImageContext of the X-ray (from load_image_context) or path to the original image
         alpha, colormap, add_colorbar: Passed to overlay_heatmap_on_image
+        grad_model: Prebuilt Grad-CAM sub-model (from build_gradcam_model), optional
 
     Returns:
         (heatmap_matrix, overlaid_rgb_image)
     """
-    if not hasattr(ensemble, 'models') or not ensemble.models:
+    if not hasattr(ensemble, 'get_member') or len(ensemble) == 0:
         print("Error: Ensemble has no models loaded")
         return None, None
 
-    # Use ResNet50 (usually the first model in ensemble) for heatmap
-    resnet_model = ensemble.models[0]  # ResNet50 is index 0 in your current setup
+    # Use ResNet50 for heatmap (in-process copy even when members run in worker processes)
+    resnet_model = ensemble.get_member('resnet50')
 
     # Reuse the existing single-model Grad-CAM function
     heatmap_matrix, _ = compute_gradcam_heatmap(
         img_array,
         resnet_model,
-        last_conv_layer_name='conv5_block3_out'  # ResNet50-specific layer
+        last_conv_layer_name='conv5_block3_out',  # ResNet50-specific layer
+        grad_model=grad_model
     )
 
     if heatmap_matrix is None:
@@ -150,7 +181,7 @@ def get_ensemble_heatmap(img_array, ensemble, img_path, alpha=0.45, colormap=cv2
     # Generate the improved overlay (with colorbar if enabled)
     overlaid = overlay_heatmap_on_image(
         heatmap_matrix,
-        img_path,
+        image,
         alpha=alpha,
         colormap=colormap,
         upsample_method=cv2.INTER_CUBIC,
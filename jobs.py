@@ -0,0 +1,125 @@
+# jobs.py - Background job store for deferred work (Grad-CAM heatmaps)
+# /analyze-xray can answer with the scores right away and hand back a job ID; a small worker
+# pool renders the heatmap and callers poll or stream the result. The store is bounded and
+# jobs expire after a TTL, so abandoned results do not accumulate.
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_CONFIG = {
+    'workers': int(os.getenv('HEATMAP_WORKERS', '2')),          # concurrent Grad-CAM renders
+    'max_jobs': int(os.getenv('HEATMAP_MAX_JOBS', '1000')),     # pending + finished jobs kept
+    'ttl_seconds': float(os.getenv('HEATMAP_JOB_TTL', '300')),  # from submission
+}
+
+
+class JobStoreFull(Exception):
+    """Every slot holds a pending job; the caller should do the work inline or back off."""
+
+
+class Job:
+    __slots__ = ('job_id', 'future', 'created', 'finished')
+
+    def __init__(self, job_id, future):
+        self.job_id = job_id
+        self.future = future
+        self.created = time.monotonic()
+        self.finished = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'running' if self.future.running() else 'pending'
+        if self.future.cancelled():
+            return 'cancelled'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def to_dict(self):
+        """JSON view: status + result (done) or error (failed)."""
+        out = {'job_id': self.job_id, 'status': self.status}
+        if out['status'] == 'done':
+            out['result'] = self.future.result()
+            if self.finished is not None:
+                out['seconds'] = round(self.finished - self.created, 3)
+        elif out['status'] == 'failed':
+            out['error'] = str(self.future.exception())
+        return out
+
+
+class JobStore:
+    """
+    Runs callables on a worker pool and keeps their outcome by job ID.
+
+    Args:
+        workers: pool size
+        max_jobs: capacity; expired jobs go first, then the oldest finished ones
+        ttl_seconds: jobs (and their results) are dropped this long after submission
+    """
+    def __init__(self, workers=2, max_jobs=1000, ttl_seconds=300.0):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self._jobs = OrderedDict()  # job_id → Job, in submission order
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='heatmap-job')
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'expired': 0, 'rejected': 0}
+
+    @classmethod
+    def from_config(cls, config=JOB_CONFIG):
+        return cls(workers=config['workers'], max_jobs=config['max_jobs'], ttl_seconds=config['ttl_seconds'])
+
+    def _expire(self, now):
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if now - job.created < self.ttl_seconds:
+                break
+            del self._jobs[job.job_id]
+            job.future.cancel()  # no-op once running
+            self.counters['expired'] += 1
+
+    def _make_room(self):
+        self._expire(time.monotonic())
+        if len(self._jobs) < self.max_jobs:
+            return True
+        for job_id, job in self._jobs.items():
+            if job.future.done():
+                del self._jobs[job_id]
+                return True
+        return False
+
+    def _on_done(self, job, future):
+        job.finished = time.monotonic()
+        if future.cancelled():
+            return
+        with self._lock:
+            self.counters['failed' if future.exception() is not None else 'completed'] += 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs). Returns the job ID; raises JobStoreFull when at capacity."""
+        with self._lock:
+            if not self._make_room():
+                self.counters['rejected'] += 1
+                raise JobStoreFull(f"{self.max_jobs} jobs pending")
+            job = Job(uuid.uuid4().hex, self._executor.submit(fn, *args, **kwargs))
+            self._jobs[job.job_id] = job
+            self.counters['submitted'] += 1
+        job.future.add_done_callback(lambda future: self._on_done(job, future))
+        return job.job_id
+
+    def get(self, job_id):
+        """Returns the Job, or None if unknown / expired."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.future.done())
+            return {**self.counters, 'jobs': len(self._jobs), 'pending': pending,
+                    'max_jobs': self.max_jobs, 'ttl_seconds': self.ttl_seconds}
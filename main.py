@@ -1,17 +1,170 @@
 # main.py
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Match
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
 import uvicorn
-from test_core import analyze_xray  # your function
+try:
+    import fcntl  # POSIX only: worker slot locks
+except ImportError:
+    fcntl = None
+from admission import AdmissionController, Overloaded, DeadlineExceeded
+from batching import MicroBatcher
+from models import COMPILED_BATCH_SIZES, configure_threading
+from cache import ResultCache, cache_key
+from dedup import NearDuplicateIndex, perceptual_hash
+from jobs import JobStore, JobStoreFull
+from metrics import IN_FLIGHT, REQUESTS, register_collector, render as render_metrics, stage
+from delivery import CONTENT_TYPES, check_formats, iter_bytes, multipart_parts
+from preprocess import ImageContext
+from pipeline import (get_ensemble, prepare_input, probability_findings, gradcam_needed, heatmap_findings,
+                      heatmap_image, score_findings, inference_fingerprint, load_models, warmup)
+
+# ────────────────────────────────────────────────────────────────
+# Worker threading / pinning (see THREADING_CONFIG in models.py)
+# ────────────────────────────────────────────────────────────────
+# WEB_CONCURRENCY uvicorn workers share the host; each gets its share of the cores.
+NUM_WORKERS = int(os.getenv('WEB_CONCURRENCY', '1'))
+_slot_lock = None  # held for the worker's lifetime
+
+
+def claim_worker_slot(num_workers):
+    """
+    Uvicorn does not number its workers, so each one takes the first free slot lock
+    (released by the OS when the process exits). WORKER_INDEX overrides it.
+    Returns the slot index (0 if every slot is taken, or without fcntl, e.g. on Windows).
+    """
+    global _slot_lock
+    if os.getenv('WORKER_INDEX'):
+        return int(os.environ['WORKER_INDEX'])
+    if fcntl is None:
+        return 0
+    for slot in range(num_workers):
+        handle = open(os.path.join(tempfile.gettempdir(), f'pneumonia-api-worker-{slot}.lock'), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_lock = handle
+        return slot
+    return 0
+
+
+# Runs at import, before any model is built, so the TF pools are created with these sizes
+THREADING = configure_threading(worker_index=claim_worker_slot(NUM_WORKERS), num_workers=NUM_WORKERS)
+
+# ────────────────────────────────────────────────────────────────
+# Micro-batching config (tune throughput vs p99 latency via env vars)
+# ────────────────────────────────────────────────────────────────
+BATCHING_CONFIG = {
+    'max_batch_size': int(os.getenv('MAX_BATCH_SIZE', '16')),    # rows per ensemble call
+    'max_wait_ms': float(os.getenv('BATCH_WAIT_MS', '10')),      # how long the first request may wait
+}
+USE_TTA = False  # change to True if you want TTA on /analyze-xray
+WARMUP_RUNS = int(os.getenv('WARMUP_RUNS', '3'))  # dummy inferences per batch size before /ready turns green
+
+# Startup progress, reported by /ready
+READINESS = {'ready': False, 'stage': 'starting', 'error': None, 'load_seconds': None, 'warmup_seconds': None}
+
+
+def _load_and_warmup():
+    """Builds the ensemble + Grad-CAM sub-model once, then warms them up (runs in a thread)."""
+    READINESS['stage'] = 'loading models'
+    start = time.perf_counter()
+    # TFLite interpreters don't use the TF pools: hand them this worker's thread budget too
+    load_models(THREADING['intra_op_threads'])
+    READINESS['load_seconds'] = round(time.perf_counter() - start, 2)
+
+    READINESS['stage'] = 'warming up'
+    start = time.perf_counter()
+    # Trace every padded batch-size bucket the batcher can produce
+    max_batch = BATCHING_CONFIG['max_batch_size']
+    warmup(runs=WARMUP_RUNS, batch_sizes=sorted({b for b in COMPILED_BATCH_SIZES if b <= max_batch} | {1}))
+    READINESS['warmup_seconds'] = round(time.perf_counter() - start, 2)
+
+    READINESS['stage'] = 'ready'
+    READINESS['ready'] = True
+
+
+async def _startup():
+    try:
+        await asyncio.to_thread(_load_and_warmup)
+    except Exception as e:
+        READINESS['stage'] = 'failed'
+        READINESS['error'] = str(e)
+        print(f"Model loading failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load in the background so /health answers while models load; /ready gates traffic
+    startup_task = asyncio.create_task(_startup())
+    yield
+    startup_task.cancel()
+    await batcher.stop()
+    heatmap_jobs.shutdown()
+    admission.shutdown()
 
 app = FastAPI(
     title="Pediatric Pneumonia Detection API",
     description="API for analyzing chest X-ray images for pneumonia risk",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+def _route_path(scope):
+    """Route template ('/heatmap-jobs/{job_id}') so metric labels stay low-cardinality."""
+    for route in scope['app'].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    """
+    Request counter by endpoint + status, and in-flight gauge.
+    Plain ASGI rather than @app.middleware: a StreamingResponse body (multipart, bulk ZIP) is
+    sent after call_next returns, so the request only ends once its last chunk has gone out.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        endpoint = _route_path(scope)
+        status = 500
+
+        async def send_tracked(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        with IN_FLIGHT.track(endpoint=endpoint):
+            try:
+                await self.app(scope, receive, send_tracked)
+            finally:
+                REQUESTS.inc(endpoint=endpoint, status=status)
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
+
 # Allow frontend (e.g. React/Vue) to call this API
 app.add_middleware(
     CORSMiddleware,
@@ -21,11 +174,178 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ────────────────────────────────────────────────────────────────
+# Admission control: bounded pipeline concurrency + wait queue + deadlines (see admission.py)
+# ────────────────────────────────────────────────────────────────
+admission = AdmissionController.from_config(batch_size=BATCHING_CONFIG['max_batch_size'])
+
+
+async def _admitted(deadline, fn, *args, **kwargs):
+    """Runs `fn(*args, **kwargs)` (a coroutine function) inside a pipeline slot, cancelled at `deadline`."""
+    async with admission.admit(deadline):
+        return await admission.within(deadline, fn(*args, **kwargs))
+
+
+def _backpressure_error(e):
+    """Overloaded → 429, DeadlineExceeded → 503; both carry a Retry-After hint."""
+    status_code = 429 if isinstance(e, Overloaded) else 503
+    return HTTPException(status_code=status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+# Repeated uploads (retries, revisits) reuse probabilities + heatmap; scoring always reruns
+result_cache = ResultCache.from_config()
+_fingerprint = {}  # use_tta → inference fingerprint, computed once the ensemble is loaded
+
+
+def _cache_lookup(image_bytes, use_tta):
+    """Hashes the upload and checks the cache (runs in a thread: sha256 + optional disk read)."""
+    if use_tta not in _fingerprint:
+        fingerprint = inference_fingerprint(get_ensemble(), use_tta)
+        _fingerprint[use_tta] = (fingerprint, cache_key(b'', fingerprint))
+    fingerprint, _ = _fingerprint[use_tta]
+    key = cache_key(image_bytes, fingerprint)
+    return key, result_cache.get(key)
+
+
+# Re-encoded copies of an already scored radiograph (other JPEG quality / resolution) reuse
+# its findings when their perceptual hashes are within NEAR_DUP_MAX_DISTANCE bits. Opt-in:
+# radiographs are structurally alike, so different patients can hash close together; measure
+# the false-match rate first (benchmarks/near_dup_false_matches.py).
+near_duplicates = NearDuplicateIndex.from_config()
+
+
+def _prepare_and_match(image, use_tta, keep_original=True):
+    """
+    Decodes + preprocesses the upload (ImageContext, filled in place; the full-size decode is
+    kept only with keep_original=True, for an overlay), then looks for a
+    near-duplicate among scored images. Only the image-independent part of a match is reused
+    (probabilities + Grad-CAM matrix): its overlay was drawn on the other upload, so it is
+    dropped here and redrawn on this one. Reused findings carry "near_duplicate_distance", so
+    they stay marked as borrowed when served again from the exact cache.
+    Returns: (model_input, phash, findings or None)
+    """
+    _, model_input = prepare_input(image, use_tta=use_tta, keep_original=keep_original)
+    phash = perceptual_hash(image.tensor)
+    namespace = _fingerprint[use_tta][1]
+    original_key, distance = near_duplicates.lookup(phash, namespace)
+    findings = result_cache.get(original_key, count=False) if original_key is not None else None
+    if findings is None:
+        return model_input, phash, None
+    return model_input, phash, {**findings, "heatmap": None, "near_duplicate_distance": distance}
+
+
+def _reuse_fields(cached, findings):
+    """
+    How the image findings were obtained. An identical upload (cached) and findings borrowed
+    from a different, perceptually similar upload (near_duplicate, with the pHash distance in
+    bits) are reported separately, so a client can always tell the two apart.
+    """
+    distance = findings.get("near_duplicate_distance")
+    return {"cached": cached, "near_duplicate": distance is not None, "match_distance": distance}
+
+# Deferred Grad-CAM: async_heatmap=true answers with the scores + a job ID right away
+heatmap_jobs = JobStore.from_config()
+
+
+def _complete_findings(findings, image, key, phash):
+    """Heatmap job: renders Grad-CAM, then caches / indexes the now complete findings."""
+    heatmap = heatmap_findings(image)
+    result_cache.put(key, {**findings, **heatmap})
+    near_duplicates.add(phash, key, namespace=_fingerprint[USE_TTA][1])
+    return heatmap
+
+
+def _skipped_heatmap(findings, image, with_image):
+    """Grad-CAM for findings whose cascade early exit skipped it, now that a heatmap was asked for."""
+    if image.tensor is None:
+        prepare_input(image)
+    filled = {**findings, **heatmap_findings(image, with_image=with_image)}
+    filled.pop("heatmap_skipped", None)
+    return filled
+
+# All requests share one batcher → one ensemble forward pass per batch
+# (on its own thread, so preprocessing / Grad-CAM on the pipeline pool never delays it)
+batcher = MicroBatcher(
+    lambda batch: get_ensemble().predict_report(batch),
+    executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix='ensemble'),
+    **BATCHING_CONFIG
+)
+
+async def _analyze(image_bytes, async_heatmap=False, with_image=True, with_heatmap=True, force_gradcam=False,
+                   overlay=None):
+    """
+    Image findings for one upload: exact cache → near-duplicate → batched ensemble + Grad-CAM.
+    with_image=False skips the base64 overlay (binary / matrix responses render their own);
+    overlay says whether the caller draws one afterwards (default: with_image). Without one the
+    full-size decode is not held while the request waits for its batch.
+    with_heatmap=False skips Grad-CAM altogether (scores only; such findings are not cached).
+    Cascade early exits skip Grad-CAM too (pipeline.gradcam_needed) unless force_gradcam=True
+    (the heatmap endpoint), which also fills it in for such findings from the cache.
+    Returns: (findings, cached, heatmap job ID or None, ImageContext); cached is True for an
+             exact content-hash hit (see _reuse_fields for near-duplicates)
+    The ImageContext carries the decoded upload, so callers rendering the overlay afterwards
+    do not decode it again.
+    """
+    image = ImageContext(image_bytes)
+    overlay = with_image if overlay is None else overlay
+    key, findings = await admission.run(_cache_lookup, image_bytes, USE_TTA)
+    heatmap_job = None
+    cached = findings is not None
+    if findings is None:
+        # Preprocess off the event loop (+ near-duplicate lookup on the decoded image)
+        model_input, phash, findings = await admission.run(
+            _prepare_and_match, image, USE_TTA, overlay
+        )
+        if findings is None:
+            # Wait for a slot in the next ensemble batch
+            batch_probs, members_ran = await batcher.submit(model_input)
+            findings = probability_findings(batch_probs, members_ran=members_ran)
+            if not with_heatmap:
+                return findings, cached, None, image
+            if not force_gradcam and not gradcam_needed(findings):
+                # Cascade early exit: complete findings without a heatmap
+                findings["heatmap_skipped"] = True
+                near_duplicates.add(phash, key, namespace=_fingerprint[USE_TTA][1])
+                await admission.run(result_cache.put, key, findings)
+                return findings, cached, None, image
+
+            if async_heatmap:
+                try:
+                    heatmap_job = heatmap_jobs.submit(_complete_findings, findings, image, key, phash)
+                    # Queued jobs keep the encoded bytes only; the overlay decodes on demand
+                    image.release_pixels()
+                except JobStoreFull:
+                    heatmap_job = None  # job store saturated: render inline instead
+
+            if heatmap_job is None:
+                # Grad-CAM for this request only
+                findings.update(await admission.run(heatmap_findings, image, None, True, with_image))
+                near_duplicates.add(phash, key, namespace=_fingerprint[USE_TTA][1])
+                await admission.run(result_cache.put, key, findings)
+            return findings, cached, heatmap_job, image
+        # Near-duplicate: stored under this upload's key without the other upload's overlay
+        await admission.run(result_cache.put, key, findings)
+
+    if force_gradcam and findings.get("heatmap_skipped"):
+        findings = await admission.run(_skipped_heatmap, findings, image, with_image)
+        await admission.run(result_cache.put, key, findings)
+    # Near-duplicate, or cached from a binary / matrix response: draw the JSON overlay on this upload
+    if with_image and findings.get("heatmap") is None and findings.get("heatmap_matrix") is not None:
+        encoded = await admission.run(heatmap_image, findings, image)
+        findings = {**findings, "heatmap": base64.b64encode(encoded).decode('ascii') if encoded else None}
+        await admission.run(result_cache.put, key, findings)
+    return findings, cached, heatmap_job, image
+
+
 @app.post("/analyze-xray")
 async def analyze_xray_endpoint(
     image: UploadFile = File(...),
     symptoms: Optional[List[str]] = Form(default=[]),           # optional symptoms list
-    has_past_history: Optional[bool] = Form(default=False)      # optional history flag
+    has_past_history: Optional[bool] = Form(default=False),     # optional history flag
+    async_heatmap: Optional[bool] = Form(default=False),        # defer Grad-CAM to a background job
+    response_format: str = Form(default='json'),                # json | multipart | matrix
+    heatmap_format: str = Form(default='png'),                  # multipart image part: jpeg | png | webp
+    heatmap_quality: Optional[int] = Form(default=None),        # jpeg/webp 0-100, png compression 0-9
+    x_request_timeout: Optional[float] = Header(default=None)   # X-Request-Timeout: seconds until the client gives up
 ):
     """
     Upload an X-ray image and get pneumonia risk + heatmap.
@@ -33,34 +353,356 @@ async def analyze_xray_endpoint(
     - **image**: required file (jpeg/png)
     - **symptoms**: optional list of symptom strings
     - **has_past_history**: optional boolean (past pneumonia?)
+    - **async_heatmap**: optional boolean; return scores now and the heatmap via /heatmap-jobs
+    - **response_format**: 'json' (base64 JPEG heatmap inside the JSON, default),
+      'multipart' (JSON part + binary heatmap_format image part) or
+      'matrix' (JSON with the native-resolution uint8 Grad-CAM grid instead of an image)
 
-    Returns JSON with probabilities, risks, explanation, and base64 heatmap.
+    Returns JSON with probabilities, risks, explanation, and base64 heatmap
+    (or heatmap_job, the job ID to poll, when the heatmap is deferred). With the cascade, images
+    it settles before ResNet50 come back with heatmap null and heatmap_skipped=true; their
+    heatmap is rendered on demand by /analyze-xray/heatmap.
+    Under load: 429 + Retry-After when the wait queue is full, 503 + Retry-After when the
+    deadline (X-Request-Timeout header, default REQUEST_DEADLINE_S) cannot be met.
     """
+    if not READINESS['ready']:
+        raise HTTPException(status_code=503, detail=f"Models not ready ({READINESS['stage']})",
+                            headers={"Retry-After": "5"})
+
     try:
+        check_formats(response_format, heatmap_format, heatmap_quality)
+
         # Read uploaded image bytes
-        image_bytes = await image.read()
-
-        # Call your analyze function
-        result = analyze_xray(
-            image_input=image_bytes,
-            is_bytes=True,
-            use_tta=False,                     # change to True if you want TTA
-            matched_symptoms=symptoms,
-            has_past_history=has_past_history
+        with stage('upload_read'):
+            image_bytes = await image.read()
+
+        async def analyze():
+            findings, cached, heatmap_job, context = await _analyze(
+                image_bytes, async_heatmap, with_image=response_format == 'json',
+                overlay=response_format != 'matrix'
+            )
+            encoded = None
+            if response_format == 'multipart' and heatmap_job is None:
+                # Still inside the slot and the deadline: the encode is pipeline work too
+                encoded = await admission.run(heatmap_image, findings, context, False,
+                                              heatmap_format, heatmap_quality)
+            return findings, cached, heatmap_job, encoded
+
+        findings, cached, heatmap_job, encoded = await _admitted(
+            admission.deadline(x_request_timeout), analyze
         )
 
-        return JSONResponse(content=result)
+        # Symptoms / history are scored fresh on every request, cached or not
+        result = score_findings(findings, matched_symptoms=symptoms, has_past_history=has_past_history)
+        # Reused results say so, and say whether they came from this upload or a similar one
+        result.update(_reuse_fields(cached, findings))
+        if heatmap_job is not None:
+            result["heatmap_job"] = heatmap_job
+
+        if response_format == 'json':
+            with stage('serialize'):
+                return JSONResponse(content=result)
+
+        result["heatmap"] = None
+        if response_format == 'matrix':
+            result["heatmap_matrix"] = findings.get("heatmap_matrix")  # uint8 rows, e.g. 7×7 for ResNet50
+            with stage('serialize'):
+                return JSONResponse(content=result)
+
+        content_type, body = multipart_parts(result, encoded, heatmap_format)
+        return StreamingResponse(body, media_type=content_type)
 
+    except (Overloaded, DeadlineExceeded) as e:
+        raise _backpressure_error(e)
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
-# Health check endpoint (optional)
+@app.post("/analyze-xray/heatmap")
+async def heatmap_image_endpoint(
+    image: UploadFile = File(...),
+    heatmap_format: str = Form(default='png'),
+    heatmap_quality: Optional[int] = Form(default=None),
+    colorbar: Optional[bool] = Form(default=True),
+    x_request_timeout: Optional[float] = Header(default=None)
+):
+    """
+    Streams only the Grad-CAM overlay as a binary image (no JSON, no base64).
+    Reuses cached Grad-CAM matrices, so calling it after /analyze-xray skips the model
+    (and runs the Grad-CAM a cascade early exit skipped).
+    """
+    if not READINESS['ready']:
+        raise HTTPException(status_code=503, detail=f"Models not ready ({READINESS['stage']})",
+                            headers={"Retry-After": "5"})
+    try:
+        check_formats('multipart', heatmap_format, heatmap_quality)
+        with stage('upload_read'):
+            image_bytes = await image.read()
+
+        async def render():
+            findings, _, _, context = await _analyze(image_bytes, with_image=False, force_gradcam=True, overlay=True)
+            return await admission.run(heatmap_image, findings, context, False,
+                                       heatmap_format, heatmap_quality, colorbar)
+
+        encoded = await _admitted(admission.deadline(x_request_timeout), render)
+        if encoded is None:
+            raise HTTPException(status_code=500, detail="Heatmap could not be produced")
+        return StreamingResponse(iter_bytes(encoded), media_type=CONTENT_TYPES[heatmap_format],
+                                 headers={"Content-Length": str(len(encoded))})
+    except HTTPException:
+        raise
+    except (Overloaded, DeadlineExceeded) as e:
+        raise _backpressure_error(e)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+# ────────────────────────────────────────────────────────────────
+# Bulk endpoint (many files or one zip → NDJSON stream)
+# ────────────────────────────────────────────────────────────────
+BULK_CONFIG = {
+    'max_items': int(os.getenv('BULK_MAX_ITEMS', '500')),          # images per request
+    'concurrency': int(os.getenv('BULK_CONCURRENCY', '32')),       # items in flight (feeds the batcher)
+    'max_item_mb': float(os.getenv('BULK_MAX_ITEM_MB', '50')),     # uncompressed size per zip entry
+}
+BULK_HEATMAP_MODES = ('none', 'json', 'matrix')
+
+
+def _read_zip_entry(archive, info):
+    if info.file_size > BULK_CONFIG['max_item_mb'] * 2**20:
+        raise ValueError(f"Entry is {info.file_size / 2**20:.0f} MB uncompressed "
+                         f"(limit {BULK_CONFIG['max_item_mb']:.0f} MB)")
+    return archive.read(info)
+
+
+def _bulk_items(uploads):
+    """
+    Expands the uploads into (filename, loader) items: plain images as-is, zip archives
+    entry by entry (read lazily). Raises ValueError for a corrupt archive.
+    """
+    items = []
+    for filename, data in uploads:
+        if filename.lower().endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+            try:
+                archive = zipfile.ZipFile(io.BytesIO(data))
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"'{filename}' is not a valid zip archive ({e})")
+            for info in archive.infolist():
+                base = os.path.basename(info.filename)
+                if info.is_dir() or not base or base.startswith('.') or info.filename.startswith('__MACOSX/'):
+                    continue
+                items.append((info.filename, lambda archive=archive, info=info: _read_zip_entry(archive, info)))
+        else:
+            items.append((filename, lambda data=data: data))
+    return items
+
+
+def _item_metadata(metadata, index, filename):
+    """Per-item {'symptoms', 'has_past_history'}: metadata is a list (by position) or a dict (by filename)."""
+    if isinstance(metadata, list):
+        return metadata[index] if index < len(metadata) else {}
+    if isinstance(metadata, dict):
+        return metadata.get(filename) or metadata.get(os.path.basename(filename)) or {}
+    return {}
+
+
+async def _bulk_item(index, filename, load, meta, heatmap, semaphore):
+    """Analyzes one item; failures become error records instead of failing the stream."""
+    async with semaphore:
+        try:
+            image_bytes = await admission.run(load)
+            # Items wait for bulk's share of the queue instead of being rejected; the deadline
+            # starts once the item is queued
+            async with admission.admit_bulk() as deadline:
+                findings, cached, _, _ = await admission.within(
+                    deadline, _analyze(image_bytes, with_image=heatmap == 'json', with_heatmap=heatmap != 'none')
+                )
+            result = score_findings(findings, matched_symptoms=meta.get('symptoms') or [],
+                                    has_past_history=meta.get('has_past_history', False))
+            result.update(_reuse_fields(cached, findings))
+            if heatmap != 'json':
+                result["heatmap"] = None
+            if heatmap == 'matrix':
+                result["heatmap_matrix"] = findings.get("heatmap_matrix")
+            return {"index": index, "filename": filename, "status": "ok", "result": result}
+        except Exception as e:
+            return {"index": index, "filename": filename, "status": "error", "error": str(e)}
+
+
+@app.post("/analyze-xray/batch")
+async def analyze_xray_batch_endpoint(
+    images: List[UploadFile] = File(...),
+    metadata: Optional[str] = Form(default=None),   # JSON: list by position or {filename: {...}}
+    heatmap: str = Form(default='none')             # none | json | matrix
+):
+    """
+    Bulk analysis: many image files and/or zip archives in one request.
+
+    - **images**: image files and/or .zip archives of images
+    - **metadata**: optional JSON with per-image {"symptoms": [...], "has_past_history": bool},
+      either a list in upload order or an object keyed by filename
+    - **heatmap**: 'none' (scores only, default), 'json' (base64 heatmap) or 'matrix' (uint8 grid)
+
+    Streams application/x-ndjson: one record per image as soon as it finishes
+    ({"index", "filename", "status": "ok", "result"} or {"status": "error", "error"}),
+    then a final {"summary": ...} record. Items share the micro-batched ensemble.
+    """
+    if not READINESS['ready']:
+        raise HTTPException(status_code=503, detail=f"Models not ready ({READINESS['stage']})",
+                            headers={"Retry-After": "5"})
+    if heatmap not in BULK_HEATMAP_MODES:
+        raise HTTPException(status_code=400, detail=f"heatmap must be one of {BULK_HEATMAP_MODES}")
+    try:
+        meta = json.loads(metadata) if metadata else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"metadata is not valid JSON ({e})")
+
+    uploads = [(upload.filename or f'image-{i}', await upload.read()) for i, upload in enumerate(images)]
+    try:
+        items = await admission.run(_bulk_items, uploads)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in the request")
+    if len(items) > BULK_CONFIG['max_items']:
+        raise HTTPException(status_code=413, detail=f"{len(items)} images exceed the limit of {BULK_CONFIG['max_items']}")
+
+    async def records():
+        semaphore = asyncio.Semaphore(BULK_CONFIG['concurrency'])
+        tasks = [asyncio.create_task(_bulk_item(i, name, load, _item_metadata(meta, i, name), heatmap, semaphore))
+                 for i, (name, load) in enumerate(items)]
+        start = time.perf_counter()
+        errors = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                record = await next_done
+                errors += record["status"] == "error"
+                yield json.dumps(record) + "\n"
+            yield json.dumps({"summary": {"items": len(items), "errors": errors,
+                                          "seconds": round(time.perf_counter() - start, 3)}}) + "\n"
+        finally:
+            for task in tasks:  # client went away: drop the remaining work
+                task.cancel()
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+@app.get("/batching/stats")
+def batching_stats():
+    """Queue depth and batch-size distribution of the inference batcher (+ cascade exit stats)."""
+    stats = batcher.stats()
+    stats["threading"] = THREADING
+    if READINESS['ready']:
+        stats["ensemble"] = get_ensemble().cascade_stats()
+    return stats
+
+
+@app.get("/admission/stats")
+def admission_stats():
+    """Pipeline slots in use, wait-queue length, rejections and deadline drops."""
+    return admission.stats()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit / miss / eviction counters and size of the result cache and near-duplicate index."""
+    return {**result_cache.stats(), "near_duplicates": near_duplicates.stats()}
+
+
+@app.get("/heatmap-jobs/stats")
+def heatmap_jobs_stats():
+    """Submitted / completed / expired / rejected counters of the heatmap job store."""
+    return heatmap_jobs.stats()
+
+
+@app.get("/heatmap-jobs/{job_id}")
+def heatmap_job_status(job_id: str):
+    """Poll a deferred heatmap: status pending | running | done (with result.heatmap) | failed."""
+    job = heatmap_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired heatmap job")
+    return job.to_dict()
+
+
+@app.get("/heatmap-jobs")
+async def stream_heatmap_jobs(ids: str, timeout: float = 60.0):
+    """
+    Streams deferred heatmaps as NDJSON, one line per job in completion order.
+    - **ids**: comma-separated job IDs
+    - **timeout**: seconds to wait; unfinished jobs are reported with status 'timeout'
+    """
+    async def lines():
+        watched = {}
+        for job_id in [i for i in ids.split(',') if i]:
+            job = heatmap_jobs.get(job_id)
+            if job is None:
+                yield json.dumps({"job_id": job_id, "status": "unknown"}) + "\n"
+            else:
+                watched[asyncio.wrap_future(job.future)] = job
+
+        pending = set(watched)
+        deadline = time.monotonic() + timeout
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                yield json.dumps(watched[future].to_dict()) + "\n"
+        for future in pending:
+            yield json.dumps({"job_id": watched[future].job_id, "status": "timeout"}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@register_collector
+def _service_metrics():
+    """Queue / cache / job gauges sampled at scrape time."""
+    adm = admission.stats()
+    yield ('xray_admission_queue_length', 'gauge', 'Requests waiting for a pipeline slot', {(): adm['queue_length']})
+    yield ('xray_admission_bulk_waiting', 'gauge', 'Bulk items waiting for a place in the queue',
+           {(): adm['bulk_waiting']})
+    yield ('xray_admission_active', 'gauge', 'Requests holding a pipeline slot', {(): adm['active']})
+    yield ('xray_admission_abandoned', 'gauge', 'Slots held by pool work of requests that already ended',
+           {(): adm['abandoned']})
+    yield ('xray_admission_events_total', 'counter', 'Admission outcomes',
+           {(('outcome', k),): adm[k] for k in ('admitted', 'completed', 'rejected', 'deadline_dropped')})
+    yield ('xray_batcher_queue_depth', 'gauge', 'Requests waiting for the next ensemble batch',
+           {(): batcher.queue_depth()})
+    cache = result_cache.stats()
+    yield ('xray_cache_events_total', 'counter', 'Result cache lookups and evictions',
+           {(('event', k),): cache[k] for k in ('memory_hits', 'disk_hits', 'misses', 'evictions')})
+    jobs = heatmap_jobs.stats()
+    yield ('xray_heatmap_jobs_pending', 'gauge', 'Deferred heatmaps not finished yet', {(): jobs['pending']})
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: per-stage latency histograms, request counters, in-flight and queue gauges."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# Health check endpoint (liveness: the process is up, models may still be loading)
 @app.get("/health")
 def health():
     return {"status": "healthy", "message": "Pneumonia Detection API is running"}
 
+
+# Readiness probe: 200 only once models are loaded and warmed up
+@app.get("/ready")
+def ready():
+    status_code = 200 if READINESS['ready'] else 503
+    return JSONResponse(status_code=status_code, content=READINESS)
+
+# Development entry point. In production use serve.py (prefork workers sharing weight pages).
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    if NUM_WORKERS > 1:
+        if _slot_lock is not None:
+            _slot_lock.close()  # the supervisor serves no requests; leave slot 0 to a worker
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=NUM_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
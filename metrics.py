@@ -0,0 +1,185 @@
+# metrics.py - Lightweight Prometheus-format metrics (histograms, counters, gauges)
+# Pure stdlib so any module on the request path (preprocess, models, explainability, scoring)
+# can time its stages; one observation is a perf_counter pair plus a bisect under a lock,
+# cheap enough to leave on in production. Rendered by GET /metrics in main.py.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Seconds; spans sub-millisecond stages (resize, scoring) up to full ensemble batches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_REGISTRY = []
+_COLLECTORS = []
+
+
+def _label_str(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, '') for n in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_label_str(self.label_names, k)} {v}' for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """In-flight gauge: +1 for the duration of the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_label_str(self.label_names, k)} {v}' for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key → [bucket counts..., +Inf count], sum
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1])) for k, s in self._series.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _label_str(self.label_names + ('le',), key + (le,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            base = _label_str(self.label_names, key)
+            lines.append(f'{self.name}_sum{base} {total}')
+            lines.append(f'{self.name}_count{base} {cumulative}')
+        return lines
+
+
+# ────────────────────────────────────────────────────────────────
+# Pipeline metrics (shared by every module on the request path)
+# ────────────────────────────────────────────────────────────────
+STAGE_SECONDS = Histogram('xray_stage_seconds', 'Latency of each analyze pipeline stage', labels=('stage',))
+MEMBER_SECONDS = Histogram('xray_ensemble_member_seconds', 'Latency of one ensemble member call',
+                           labels=('member',))
+REQUESTS = Counter('xray_requests_total', 'Requests by endpoint and status code', labels=('endpoint', 'status'))
+IN_FLIGHT = Gauge('xray_requests_in_flight', 'Requests currently being served', labels=('endpoint',))
+
+
+def stage(name):
+    """`with stage('decode'):` — times one pipeline stage into xray_stage_seconds."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(fn):
+    """fn() → iterable of (name, kind, documentation, {labels tuple: value}); sampled at scrape time."""
+    _COLLECTORS.append(fn)
+    return fn
+
+
+def render():
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    for collector in _COLLECTORS:
+        for name, kind, documentation, samples in collector():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples.items():
+                label_str = '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else ''
+                lines.append(f'{name}{label_str} {value}')
+    return '\n'.join(lines) + '\n'
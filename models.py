@@ -1,10 +1,20 @@
 # models.py - Updated with Ensemble Support (ResNet50 + EfficientNetV2-S + ViT-Tiny)
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 import tensorflow as tf
 import numpy as np
-from tensorflow.keras.applications import ResNet50, EfficientNetV2S
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
+from tensorflow.keras.applications import ResNet50, EfficientNetV2S, MobileNetV2
+from tensorflow.keras.layers import BatchNormalization, Concatenate, Dense, GlobalAveragePooling2D
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
+from scoring import CONFIG as SCORING_CONFIG
+from metrics import MEMBER_SECONDS, stage
 
 # Optional: pip install vit-keras timm (if you want ViT)
 try:
@@ -13,12 +23,240 @@ except ImportError:
     vit = None
     print("vit-keras not installed — ViT will be skipped. Install with: pip install vit-keras")
 
-def build_resnet_model(learning_rate=0.001, seed=42,num_classes=2):
+# ────────────────────────────────────────────────────────────────
+# Threading / CPU affinity (one TF runtime per serving worker)
+# ────────────────────────────────────────────────────────────────
+# By default every TF runtime sizes its pools to all cores, so N workers on one host
+# oversubscribe the CPU. Set these per process, before the first TF op runs.
+THREADING_CONFIG = {
+    'intra_op_threads': int(os.getenv('TF_INTRA_OP_THREADS', '0')),  # 0 = this worker's share of the cores
+    'inter_op_threads': int(os.getenv('TF_INTER_OP_THREADS', '0')),  # 0 = TF default (single worker) / members
+    'cpu_affinity': os.getenv('CPU_AFFINITY', ''),  # '' = no pinning | 'auto' = split cores across workers
+                                                    # | explicit list such as '0-7,16-23'
+}
+
+
+def parse_cpu_list(spec):
+    """'0-3,8,10-11' → [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def available_cpus():
+    """Cores this process may run on (respects taskset / cgroup pinning)."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        return list(range(os.cpu_count() or 1))
+
+
+def worker_cpu_slice(worker_index, num_workers, cpus=None):
+    """Contiguous, non-overlapping share of `cpus` for worker `worker_index` of `num_workers`."""
+    cpus = available_cpus() if cpus is None else cpus
+    per_worker = max(1, len(cpus) // num_workers)
+    start = (worker_index % num_workers) * per_worker
+    return cpus[start:start + per_worker] or cpus
+
+
+def configure_threading(intra_op_threads=None, inter_op_threads=None, cpu_affinity=None,
+                        worker_index=0, num_workers=1):
+    """
+    Sizes the TF thread pools (and optionally pins the process) for one of `num_workers`
+    serving processes. Must run before the TF runtime initialises (first op / model build);
+    afterwards the pools are fixed and only the affinity is applied.
+    Arguments left as None come from THREADING_CONFIG.
+
+    Args:
+        intra_op_threads: threads per op (0 → cores assigned to this worker)
+        inter_op_threads: ops/graphs run concurrently (0 → TF default, or one per default member
+                          when several workers share the host)
+        cpu_affinity: '' | 'auto' | explicit cpu list ('0-7,16-23')
+        worker_index / num_workers: this worker's slot, used by 'auto' pinning and the defaults
+    Returns:
+        dict with the applied settings
     """
-    Builds ResNet50-based model (baseline).
+    intra = THREADING_CONFIG['intra_op_threads'] if intra_op_threads is None else intra_op_threads
+    inter = THREADING_CONFIG['inter_op_threads'] if inter_op_threads is None else inter_op_threads
+    affinity = THREADING_CONFIG['cpu_affinity'] if cpu_affinity is None else cpu_affinity
+
+    cpus = None
+    if affinity == 'auto':
+        cpus = worker_cpu_slice(worker_index, num_workers)
+    elif affinity:
+        cpus = parse_cpu_list(affinity)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)  # threads created from now on (TF pools) inherit it
+
+    share = len(cpus) if cpus else max(1, len(available_cpus()) // num_workers)
+    if not intra and num_workers > 1:
+        intra = share
+    if not inter and num_workers > 1:
+        inter = len(DEFAULT_MEMBERS)  # 'threads' mode runs every member graph at once
+
+    # oneDNN kernels run on the intra-op pool, so this also bounds them (OMP_NUM_THREADS would
+    # only take effect if exported before TensorFlow is imported)
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError:
+        print("Warning: TF runtime already initialised — thread pool sizes unchanged")
+
+    return {
+        'worker_index': worker_index,
+        'num_workers': num_workers,
+        'intra_op_threads': tf.config.threading.get_intra_op_parallelism_threads(),
+        'inter_op_threads': tf.config.threading.get_inter_op_parallelism_threads(),
+        'cpus': cpus or available_cpus(),
+    }
+
+
+def _size_member_pools(n, threads_per_member=None):
+    """
+    Sizes the TF pools for `n` member graphs running side by side ('threads' mode): an inter-op
+    pool of at least `n`, and an intra-op pool of `threads_per_member` (default: cores // n), so
+    the concurrent members split the cores instead of each fanning its ops out over all of them.
+    The intra-op pool is still one per process; only 'processes' mode gives each member its own.
+    Sizes set explicitly beforehand (configure_threading) are kept, except a too small inter-op pool.
+    Returns: (intra_op_threads, inter_op_threads) in effect (0 = TF default, one per core)
+    """
+    try:
+        inter = tf.config.threading.get_inter_op_parallelism_threads() or len(available_cpus())  # 0 = one per core
+        if inter < n:
+            tf.config.threading.set_inter_op_parallelism_threads(n)
+        if tf.config.threading.get_intra_op_parallelism_threads() == 0:
+            intra = threads_per_member or max(1, len(available_cpus()) // n)
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+    except RuntimeError:
+        print("Warning: TF runtime already initialised — member thread pools unchanged")
+    return (tf.config.threading.get_intra_op_parallelism_threads(),
+            tf.config.threading.get_inter_op_parallelism_threads())
+
+# ────────────────────────────────────────────────────────────────
+# In-graph input normalization
+# Every member takes the same uint8 (N, 224, 224, C) tensor and applies the preprocessing
+# its backbone was pretrained with as its first layer, so the host never builds a float copy
+# (4× the pixels) and all members can share one input buffer.
+# C = 3 (RGB) or 1: grayscale-native variants, whose first conv has the ImageNet RGB kernels
+# folded into one input channel (see fold_rgb_weights) — a third of the decode, resize and
+# input memory for what are single-channel radiographs anyway.
+# ────────────────────────────────────────────────────────────────
+INPUT_SIZE = (224, 224)
+IMAGE_SHAPE = INPUT_SIZE + (3,)
+_CAFFE_MEAN_BGR = (103.939, 116.779, 123.68)
+
+@tf.keras.utils.register_keras_serializable(package='mitb')
+class PixelNormalization(tf.keras.layers.Layer):
+    """
+    uint8 RGB pixels → the float input a backbone expects:
+      - 'caffe': RGB → BGR, minus the ImageNet channel means (ResNet50); a 1-channel
+                 input has the average of the three means subtracted
+      - 'raw':   float 0-255 (EfficientNetV2 rescales inside the network)
+      - 'tf':    x / 127.5 - 1, i.e. [-1, 1] (ViT, MobileNetV2)
+    """
+    MODES = ('caffe', 'raw', 'tf')
+
+    def __init__(self, mode='caffe', **kwargs):
+        super().__init__(**kwargs)
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got '{mode}'")
+        self.mode = mode
+
+    def call(self, inputs):
+        x = tf.cast(inputs, tf.float32)
+        if self.mode == 'caffe' and inputs.shape[-1] == 1:
+            return x - float(np.mean(_CAFFE_MEAN_BGR))
+        if self.mode == 'caffe':
+            return x[..., ::-1] - tf.constant(_CAFFE_MEAN_BGR, dtype=tf.float32)
+        if self.mode == 'tf':
+            return x / 127.5 - 1.0
+        return x
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'mode': self.mode})
+        return config
+
+def image_input(mode, channels=3):
+    """uint8 (224, 224, channels) model input. Returns (input tensor, normalized float tensor)."""
+    inputs = tf.keras.Input(shape=INPUT_SIZE + (channels,), dtype=tf.uint8, name='pixels')
+    return inputs, PixelNormalization(mode, name=f'{mode}_normalization')(inputs)
+
+def fold_rgb_weights(rgb_model, gray_model, mode):
+    """
+    Copies the weights of an RGB backbone into the same architecture built on a 1-channel input.
+
+    A gray pixel feeds all three input channels identically, so the first conv's kernel is
+    summed over its input channels. Caffe normalization subtracts a different mean per channel
+    while the 1-channel input subtracts their average; the difference is a constant per output
+    channel, added to the conv bias (ResNet50) or, for a bias-free conv, taken out of the next
+    BatchNormalization's moving mean. Exact, except where the kernel overlaps zero padding.
+    """
+    mean = np.asarray(_CAFFE_MEAN_BGR)
+    offsets = mean.mean() - mean if mode == 'caffe' else np.zeros(3)
+    rgb_layers = [layer for layer in rgb_model.layers if layer.weights]
+    gray_layers = [layer for layer in gray_model.layers if layer.weights]
+
+    shift = None
+    for src, dst in zip(rgb_layers, gray_layers):
+        weights = src.get_weights()
+        if shift is not None and isinstance(dst, BatchNormalization):
+            weights[-2] = weights[-2] - shift  # moving_mean
+            shift = None
+        elif weights[0].shape != dst.get_weights()[0].shape:
+            kernel = weights[0]                                     # (kh, kw, 3, out)
+            weights[0] = kernel.sum(axis=2, keepdims=True)          # (kh, kw, 1, out)
+            folded_shift = np.einsum('hwco,c->o', kernel, offsets)  # RGB output - folded output
+            if len(weights) > 1:
+                weights[1] = weights[1] + folded_shift
+            elif folded_shift.any():
+                shift = -folded_shift
+        dst.set_weights(weights)
+
+def _backbone(application, mode, channels, pretrained):
+    """
+    Keras application (ResNet50, EfficientNetV2S, ...) without top on a uint8 input with `mode`
+    normalization in-graph. channels=1 + pretrained folds the ImageNet RGB weights in.
+    """
+    _, normalized = image_input(mode, channels)
+    if channels == 3:
+        return application(weights='imagenet' if pretrained else None, include_top=False, input_tensor=normalized)
+    base_model = application(weights=None, include_top=False, input_tensor=normalized)
+    if pretrained:
+        rgb_model = application(weights='imagenet', include_top=False, input_shape=IMAGE_SHAPE)
+        fold_rgb_weights(rgb_model, base_model, mode)
+    return base_model
+
+def require_uint8_input(dtype, source):
+    """
+    Artifacts exported before in-graph normalization take float input that was normalized on
+    the host; fed raw uint8 pixels they return confident garbage, so they are refused at load.
+    Raises: ValueError naming the artifact and how to re-export it.
+    """
+    dtype = tf.as_dtype(dtype)
+    if dtype != tf.uint8:
+        raise ValueError(f"'{source}' expects {dtype.name} input, not uint8 pixels (exported before in-graph "
+                         f"normalization). Re-export it: retrain or re-prune with train.py, "
+                         f"`python models.py --export-fast-weights` / `--export-fused`, then re-run quantize.py")
+
+def build_resnet_model(learning_rate=0.001, seed=42,num_classes=2, pretrained=True, channels=3):
+    """
+    Builds ResNet50-based model (baseline), uint8 input with caffe preprocessing in-graph.
+    pretrained=False skips the ImageNet download (used when restoring trained weights).
+    channels=1 builds the grayscale-native variant.
     """
     tf.random.set_seed(seed)
-    base_model = ResNet50(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+    base_model = _backbone(ResNet50, 'caffe', channels, pretrained)
     x = GlobalAveragePooling2D()(base_model.output)
     x = Dense(128, activation='relu')(x)
     output = Dense(num_classes, activation='softmax')(x) # 0-Normal, 1-Bacterial, 2-Viral
@@ -32,12 +270,15 @@ def build_resnet_model(learning_rate=0.001, seed=42,num_classes=2):
                   metrics=['accuracy', 'Recall'])
     return model
 
-def build_efficientnet_model(learning_rate=0.001, seed=43, num_classes=2):
+def build_efficientnet_model(learning_rate=0.001, seed=43, num_classes=2, pretrained=True, channels=3):
     """
-    Builds EfficientNetV2-S model (stronger & more efficient).
+    Builds EfficientNetV2-S model (stronger & more efficient), uint8 input; the network's own
+    rescaling layers take raw 0-255 pixels.
+    pretrained=False skips the ImageNet download (used when restoring trained weights).
+    channels=1 builds the grayscale-native variant.
     """
     tf.random.set_seed(seed)
-    base_model = EfficientNetV2S(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+    base_model = _backbone(EfficientNetV2S, 'raw', channels, pretrained)
     x = GlobalAveragePooling2D()(base_model.output)
     x = Dense(128, activation='relu')(x)
     output = Dense(num_classes, activation='softmax')(x)   # ← changed from 3 to num_classes
@@ -51,60 +292,854 @@ def build_efficientnet_model(learning_rate=0.001, seed=43, num_classes=2):
                   metrics=['accuracy', 'Recall'])
     return model
 
-def build_vit_tiny_model(learning_rate=0.0005, seed=44,num_classes=2):
+def build_vit_tiny_model(learning_rate=0.0005, seed=44,num_classes=2, pretrained=True, channels=3):
     """
-    Builds lightweight ViT-Tiny (if vit-keras installed).
+    Builds lightweight ViT-Tiny (if vit-keras installed), uint8 input scaled to [-1, 1] in-graph
+    (vit-keras builds its own input layer, so the backbone is wrapped as a nested model).
+    pretrained=False skips the ImageNet download (used when restoring trained weights).
+    channels=1 takes grayscale input; vit-keras fixes the backbone at 3 channels, so the
+    normalized channel is repeated in-graph instead of folding the patch embedding.
     """
     if vit is None:
         print("ViT-Tiny skipped — install vit-keras")
         return None
 
     tf.random.set_seed(seed)
-    model = vit.vit_tiny(
+    backbone = vit.vit_tiny(
         image_size=224,
         patch_size=16,
         num_classes=num_classes,
         activation='softmax',
-        pretrained=True,
+        pretrained=pretrained,
         include_top=True,
         pretrained_top=False  # We add our own head
     )
+    inputs, normalized = image_input('tf', channels)
+    if channels == 1:
+        normalized = Concatenate(name='gray_to_rgb')([normalized] * 3)
+    model = Model(inputs=inputs, outputs=backbone(normalized), name='vit_tiny')
     model.compile(optimizer=Adam(learning_rate=learning_rate),
                   loss='categorical_crossentropy',
                   metrics=['accuracy', 'Recall'])
     return model
 
+def build_student_model(learning_rate=0.001, seed=45, num_classes=2, pretrained=True, channels=3):
+    """
+    Builds the compact distillation student (MobileNetV2, same 224x224 input).
+    Trained from ensemble soft-vote targets by distill.py; fully trainable. uint8 input scaled
+    to [-1, 1] in-graph.
+    pretrained=False skips the ImageNet download (used when restoring trained weights).
+    channels=1 builds the grayscale-native variant.
+    """
+    tf.random.set_seed(seed)
+    base_model = _backbone(MobileNetV2, 'tf', channels, pretrained)
+    x = GlobalAveragePooling2D()(base_model.output)
+    x = Dense(128, activation='relu')(x)
+    output = Dense(num_classes, activation='softmax')(x)
+    model = Model(inputs=base_model.input, outputs=output)
+
+    model.compile(optimizer=Adam(learning_rate=learning_rate),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy', 'Recall'])
+    return model
+
+# Batch sizes the compiled path traces a fixed signature for (inputs are padded up to the next one)
+COMPILED_BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+
+class CompiledPredictor:
+    """
+    tf.function inference path with fixed input signatures, replacing model.predict().
+
+    model.predict() builds a data adapter and a full predict loop on every call, which
+    costs more than the compute itself for small batches. Here each batch is zero-padded
+    up to the next size in `batch_sizes` and run through one concrete function per size,
+    so at most len(batch_sizes) graphs are ever traced. Larger batches are split into
+    chunks of the largest size.
+
+    `fn` maps an input tensor to an output tensor (or a tuple of tensors); build it with
+    CompiledPredictor.for_model() for a single Keras model.
+    """
+    def __init__(self, fn, input_shape, input_dtype=tf.float32, batch_sizes=COMPILED_BATCH_SIZES,
+                 jit_compile=False):
+        self.input_shape = tuple(input_shape)
+        self.input_dtype = tf.as_dtype(input_dtype)
+        self.batch_sizes = sorted(batch_sizes)
+        self.jit_compile = jit_compile
+        self._fn = tf.function(fn, jit_compile=jit_compile)
+        self._concrete = {}  # batch size → traced concrete function
+
+    @classmethod
+    def for_model(cls, model, **kwargs):
+        return cls(lambda x: model(x, training=False), model.input_shape[1:],
+                   input_dtype=model.inputs[0].dtype, **kwargs)
+
+    def concrete_function(self, batch_size):
+        """Traces (once) and returns the concrete function for one padded batch size."""
+        if batch_size not in self._concrete:
+            spec = tf.TensorSpec((batch_size,) + self.input_shape, self.input_dtype)
+            self._concrete[batch_size] = self._fn.get_concrete_function(spec)
+        return self._concrete[batch_size]
+
+    def _run_padded(self, chunk):
+        n = len(chunk)
+        bucket = next(b for b in self.batch_sizes if b >= n)
+        if bucket > n:
+            pad = np.zeros((bucket - n,) + chunk.shape[1:], dtype=chunk.dtype)
+            chunk = np.concatenate([chunk, pad])
+        out = self.concrete_function(bucket)(tf.convert_to_tensor(chunk, dtype=self.input_dtype))
+        if isinstance(out, (tuple, list)):
+            return tuple(o.numpy()[..., :n, :] for o in out)
+        return out.numpy()[:n]
+
+    def __call__(self, batch):
+        batch = np.asarray(batch)
+        largest = self.batch_sizes[-1]
+        if len(batch) <= largest:
+            return self._run_padded(batch)
+
+        outs = [self._run_padded(batch[i:i + largest]) for i in range(0, len(batch), largest)]
+        if isinstance(outs[0], tuple):
+            return tuple(np.concatenate(parts, axis=-2) for parts in zip(*outs))
+        return np.concatenate(outs)
+
+# ────────────────────────────────────────────────────────────────
+# Fused single-graph ensemble (shared input → member branches → in-graph soft vote)
+# ────────────────────────────────────────────────────────────────
+DEFAULT_FUSED_PATH = 'pneumonia_ensemble_fused.keras'
+
+@tf.keras.utils.register_keras_serializable(package='mitb')
+class WeightedAverage(tf.keras.layers.Layer):
+    """
+    In-graph weighted soft vote over member outputs (same maths as np.average in predict()).
+    Also records which member name each branch belongs to, so a saved fused model
+    can be turned back into a PneumoniaEnsemble.
+    """
+    def __init__(self, member_weights, member_names=None, member_layers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.member_weights = [float(w) for w in member_weights]
+        self.member_names = list(member_names or [])
+        self.member_layers = list(member_layers or [])
+
+    def call(self, inputs):
+        weights = tf.constant(self.member_weights, dtype=tf.float32) / sum(self.member_weights)
+        stacked = tf.stack([tf.cast(x, tf.float32) for x in inputs], axis=0)  # (M, N, C)
+        return tf.tensordot(weights, stacked, axes=1)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            'member_weights': self.member_weights,
+            'member_names': self.member_names,
+            'member_layers': self.member_layers,
+        })
+        return config
+
+def build_fused_ensemble(models, weights, member_names, name='pneumonia_ensemble'):
+    """
+    Exports the ensemble as ONE Keras graph: a shared input feeding every member as a
+    branch, with the weighted average as an in-graph layer, so the runtime can schedule
+    and optimise the whole ensemble as a unit.
+
+    Outputs: [ensemble_probs (N, C), member_1_probs, ..., member_M_probs]
+    """
+    inputs = tf.keras.Input(shape=models[0].input_shape[1:], dtype=models[0].inputs[0].dtype, name='image')
+    branches = [model(inputs) for model in models]
+    soft_vote = WeightedAverage(weights, member_names=member_names,
+                                member_layers=[model.name for model in models], name='soft_vote')(branches)
+    return Model(inputs, [soft_vote] + branches, name=name)
+
+def save_fused_ensemble(fused_model, path=DEFAULT_FUSED_PATH):
+    """Saves the fused ensemble as a single artifact ('.keras' file or SavedModel directory)."""
+    fused_model.save(path)
+    return path
+
+def load_fused_ensemble(path=DEFAULT_FUSED_PATH):
+    """
+    Loads a fused ensemble artifact.
+    Returns: (fused_model, member_names, member_weights, member_models)
+    """
+    fused = tf.keras.models.load_model(path, compile=False)
+    soft_vote = fused.get_layer('soft_vote')
+    members = [fused.get_layer(layer_name) for layer_name in soft_vote.member_layers]
+    return fused, list(soft_vote.member_names), list(soft_vote.member_weights), members
+
+# ────────────────────────────────────────────────────────────────
+# TFLite backend (int8 / float16 artifacts written by quantize.py)
+# ────────────────────────────────────────────────────────────────
+DEFAULT_TFLITE_DIR = 'tflite'
+TFLITE_QUANTIZATIONS = ('int8', 'float16')
+
+def tflite_path(name, quantization='int8', tflite_dir=DEFAULT_TFLITE_DIR, channels=3):
+    """'resnet50', 'int8' → 'tflite/resnet50_int8.tflite' ('tflite/resnet50_gray_int8.tflite' for channels=1)."""
+    name = name if channels == 3 else f'{name}_gray'
+    return os.path.join(tflite_dir, f'{name}_{quantization}.tflite')
+
+class TFLiteMember:
+    """
+    Runs one quantized ensemble member through the TFLite interpreter.
+    Behaves like a compiled member: __call__((N, H, W, 3)) → (N, num_classes) float32.
+    The interpreter memory-maps the .tflite file, so its weights are shared page cache.
+    """
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        self._lock = threading.Lock()  # an interpreter is not thread-safe
+
+    def _quantize(self, batch):
+        scale, zero_point = self._input['quantization']
+        if self._input['dtype'] in (np.int8, np.uint8) and scale:
+            info = np.iinfo(self._input['dtype'])
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        return batch.astype(self._input['dtype'])
+
+    def _dequantize(self, out):
+        scale, zero_point = self._output['quantization']
+        if self._output['dtype'] in (np.int8, np.uint8) and scale:
+            return (out.astype(np.float32) - zero_point) * scale
+        return out.astype(np.float32)
+
+    def __call__(self, batch):
+        batch = np.asarray(batch)
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], [len(batch)] + list(batch.shape[1:]))
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input['index'], self._quantize(batch))
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self._output['index']))
+
+def load_tflite_member(name, quantization='int8', tflite_dir=DEFAULT_TFLITE_DIR, num_threads=None, channels=3):
+    """
+    Loads a member's TFLite artifact, falling back to float16 when the int8 file is missing.
+    Raises ValueError for artifacts converted from float-input members (see require_uint8_input).
+    Returns: (TFLiteMember or None, seconds, path or None)
+    """
+    start = time.perf_counter()
+    for quant in [quantization] + [q for q in TFLITE_QUANTIZATIONS if q != quantization]:
+        path = tflite_path(name, quant, tflite_dir, channels)
+        if os.path.isfile(path):
+            member = TFLiteMember(path, num_threads=num_threads)
+            require_uint8_input(member._input['dtype'], path)
+            return member, time.perf_counter() - start, path
+    return None, 0.0, None
+
+# Registry of ensemble members (name → builder)
+MEMBER_BUILDERS = {
+    'resnet50': build_resnet_model,
+    'efficientnetv2s': build_efficientnet_model,
+    'vit_tiny': build_vit_tiny_model,
+    'student': build_student_model,
+}
+DEFAULT_MEMBERS = ['resnet50', 'efficientnetv2s', 'vit_tiny']  # default soft-vote order
+DEFAULT_WEIGHTS = {'resnet50': 0.4, 'efficientnetv2s': 0.4, 'vit_tiny': 0.2, 'student': 1.0}
+
+# Trained artifacts saved by train.py. load_member() prefers the fast '<name>.weights/'
+# directory next to each .h5 (written by train.py / `python models.py --export-fast-weights`).
+DEFAULT_WEIGHT_PATHS = {
+    'resnet50': 'resnet50_trained_final.h5',
+    'efficientnetv2s': 'efficientnetv2s_trained_final.h5',
+    'vit_tiny': 'vit_tiny_trained_final.h5',
+    'student': 'student_distilled.h5',
+}
+FAST_WEIGHTS_FORMAT = 'mitb-fast-weights-v1'
+
+def grayscale_path(path):
+    """'resnet50_trained_final.h5' → 'resnet50_trained_final_gray.h5' (grayscale-native artifact)."""
+    stem, ext = os.path.splitext(path)
+    return f'{stem}_gray{ext}'
+
+def member_weight_path(name, channels=3):
+    """Default trained artifact for a member and input channel count."""
+    path = DEFAULT_WEIGHT_PATHS[name]
+    return path if channels == 3 else grayscale_path(path)
+
+# Cascade order: cheapest member first (approx. GFLOPs at 224x224: ViT-Tiny ~1.3, EffNetV2-S ~3, ResNet50 ~4.1)
+DEFAULT_CASCADE_ORDER = ['vit_tiny', 'efficientnetv2s', 'resnet50']
+
+# Grad-CAM target layer per member: the last conv block (7×7 at 224×224)
+GRADCAM_LAYERS = {'resnet50': 'conv5_block3_out', 'student': 'out_relu'}
+
+def fast_weights_path(path):
+    """'resnet50_trained_final.h5' → 'resnet50_trained_final.weights' (directory)."""
+    return path if path.endswith('.weights') else os.path.splitext(path)[0] + '.weights'
+
+def export_fast_weights(model, out_dir, include_architecture=False):
+    """
+    Saves model weights in the fast format: one raw blob (weights.bin, arrays 64-byte
+    aligned in model.get_weights() order) + manifest.json with dtype/shape/offset.
+    The blob is memory-mapped at load time, so there is no HDF5 parsing and worker
+    processes loading the same file share its page-cache pages.
+
+    include_architecture=True also stores model.to_json(), for models whose architecture
+    differs from the member builder (e.g. channel-pruned models from pruning.py).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    entries = []
+    offset = 0
+    with open(os.path.join(out_dir, 'weights.bin'), 'wb') as f:
+        for w in model.get_weights():
+            arr = np.ascontiguousarray(w)
+            pad = (-offset) % 64
+            f.write(b'\0' * pad)
+            offset += pad
+            f.write(arr.tobytes())
+            entries.append({'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset})
+            offset += arr.nbytes
+
+    manifest = {'format': FAST_WEIGHTS_FORMAT, 'arrays': entries}
+    if include_architecture:
+        manifest['architecture'] = model.to_json()
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    return out_dir
+
+def _fast_weights_architecture(weights_dir):
+    """Model JSON stored by export_fast_weights(include_architecture=True), else None."""
+    with open(os.path.join(weights_dir, 'manifest.json')) as f:
+        return json.load(f).get('architecture')
+
+def load_fast_weights(weights_dir):
+    """
+    Memory-maps a fast-format weights directory.
+    Returns: list of read-only arrays (views into the mapped file), in get_weights() order.
+    """
+    with open(os.path.join(weights_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FAST_WEIGHTS_FORMAT:
+        raise ValueError(f"Unsupported weights format in '{weights_dir}': {manifest.get('format')}")
+
+    blob = np.memmap(os.path.join(weights_dir, 'weights.bin'), dtype=np.uint8, mode='r')
+    arrays = []
+    for entry in manifest['arrays']:
+        shape = tuple(entry['shape'])
+        count = int(np.prod(shape)) if shape else 1
+        arr = np.frombuffer(blob, dtype=np.dtype(entry['dtype']), count=count, offset=entry['offset'])
+        arrays.append(arr.reshape(shape))
+    return arrays
+
+def load_member(name, path=None, channels=3, allow_untrained=False):
+    """
+    Builds a member architecture WITHOUT downloading pretrained weights and restores
+    trained weights from a local artifact.
+
+    Lookup order: '<path stem>.weights/' (fast, memory-mapped) → '<path>' (.h5 from train.py).
+    If neither exists a FileNotFoundError is raised: an untrained member gives meaningless
+    scores. allow_untrained=True (debug scripts, latency benchmarks) keeps the random
+    initialisation instead, with a warning.
+    A fast artifact that stores its own architecture (pruned models) is rebuilt from it
+    instead of the member builder. channels=1 builds the grayscale-native architecture.
+
+    Returns: (model or None, load_seconds, source_path or None)
+    """
+    start = time.perf_counter()
+    path = path or member_weight_path(name, channels)
+    fast_dir = fast_weights_path(path)
+
+    architecture = _fast_weights_architecture(fast_dir) if os.path.isdir(fast_dir) else None
+    if architecture is not None:
+        model = tf.keras.models.model_from_json(architecture)
+        require_uint8_input(model.inputs[0].dtype, fast_dir)
+    else:
+        model = MEMBER_BUILDERS[name](pretrained=False, channels=channels)
+    if model is None:
+        return None, 0.0, None
+
+    if os.path.isdir(fast_dir):
+        model.set_weights(load_fast_weights(fast_dir))
+        source = fast_dir
+    elif os.path.isfile(path):
+        model.load_weights(path)
+        source = path
+    elif allow_untrained:
+        print(f"No trained weights for {name} at '{path}' — using untrained architecture")
+        source = None
+    else:
+        raise FileNotFoundError(f"No trained weights for {name}: neither '{fast_dir}' nor '{path}' exists "
+                                f"(train it with train.py, or pass allow_untrained=True for debugging)")
+
+    return model, time.perf_counter() - start, source
+
+def _member_worker_main(conn, name, intra_op_threads, weights_path=None, inference_mode='keras', jit_compile=False,
+                        channels=3, allow_untrained=False):
+    """
+    Entry point of a member worker process ('processes' execution mode).
+    Keeps one model resident with its own intra-op pool and serves batches over a pipe.
+    """
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    try:
+        model, load_seconds, _ = load_member(name, weights_path, channels, allow_untrained)
+    except Exception as e:
+        conn.send(('error', False, str(e)))
+        conn.close()
+        return
+    conn.send(('ready', model is not None, load_seconds))
+    if model is not None and inference_mode == 'compiled':
+        run = CompiledPredictor.for_model(model, jit_compile=jit_compile)
+    else:
+        run = lambda batch: model.predict(batch, verbose=0)  # noqa: E731
+
+    while True:
+        batch = conn.recv()
+        if batch is None:  # shutdown signal
+            break
+        try:
+            conn.send(('ok', run(batch)))
+        except Exception as e:
+            conn.send(('error', f"{name}: {e}"))
+    conn.close()
+
 class PneumoniaEnsemble:
     """
     Soft-voting ensemble of ResNet50 + EfficientNetV2-S + ViT-Tiny.
+    `members` selects other registry entries, e.g. members=['student'] serves the
+    distilled student (distill.py) through the same interface.
+
+    Members are restored from trained artifacts (resnet_path / effnet_path / vit_path,
+    default: the files train.py saves) without any ImageNet download; per-member load
+    times are kept in self.load_times.
+
+    execution_mode:
+      - 'sequential': members run one after another (default, lowest memory)
+      - 'threads':    members run concurrently on a thread pool in this process; the
+                      inter-op pool fits every member graph and the (process-wide) intra-op
+                      pool is cut to threads_per_member (default cores // members), see
+                      _size_member_pools
+      - 'processes':  one worker process per member, each keeping its model resident
+                      with its own intra-op pool (cores split evenly between members)
+    In every mode the soft vote runs once all members have returned.
+
+    inference_mode:
+      - 'keras':    Keras model.predict() per call
+      - 'compiled': CompiledPredictor per member (fixed signatures per batch-size bucket,
+                    optional XLA jit_compile); in 'sequential' mode the whole weighted
+                    ensemble runs as one compiled function
+      - 'fused':    the single-graph ensemble from build_fused_ensemble(), loaded from
+                    `fused_path` if that artifact exists (sequential execution only)
+      - 'tflite':   quantized TFLite members from quantize.py (`tflite_quantization`
+                    'int8' or 'float16', artifacts in `tflite_dir`), each interpreter on
+                    threads_per_member threads (None = TFLite default); Grad-CAM still uses a
+                    float32 Keras ResNet50, loaded on first use
+    input_channels=1 serves the grayscale-native variants ('<artifact>_gray' files, input
+    (N, 224, 224, 1)); the default 3 takes RGB.
+    A member without trained weights raises FileNotFoundError (see load_member);
+    allow_untrained=True builds it randomly initialised, for debugging and latency benchmarks only.
+    cascade=True enables early exit (see predict_cascade): members run in `cascade_order`
+    and an image stops as soon as its running soft vote leaves the uncertain band
+    (low_conf_thresh, high_conf_thresh) — the same band calculate_final_score uses.
     """
-    def __init__(self, weights=None):
+    EXECUTION_MODES = ('sequential', 'threads', 'processes')
+    INFERENCE_MODES = ('keras', 'compiled', 'fused', 'tflite')
+
+    def __init__(self, weights=None, resnet_path=None, effnet_path=None, vit_path=None,
+                 members=None, weight_paths=None,
+                 execution_mode='sequential', threads_per_member=None,
+                 inference_mode='keras', jit_compile=False, fused_path=None,
+                 tflite_quantization='int8', tflite_dir=DEFAULT_TFLITE_DIR,
+                 cascade=False, cascade_order=None, high_conf_thresh=None, low_conf_thresh=None,
+                 input_channels=3, allow_untrained=False):
+        if execution_mode not in self.EXECUTION_MODES:
+            raise ValueError(f"execution_mode must be one of {self.EXECUTION_MODES}, got '{execution_mode}'")
+        if inference_mode not in self.INFERENCE_MODES:
+            raise ValueError(f"inference_mode must be one of {self.INFERENCE_MODES}, got '{inference_mode}'")
+        if inference_mode == 'fused' and execution_mode != 'sequential':
+            raise ValueError("inference_mode='fused' runs the whole ensemble as one graph; use execution_mode='sequential'")
+        if inference_mode == 'tflite' and execution_mode == 'processes':
+            raise ValueError("inference_mode='tflite' runs in-process; use execution_mode='sequential' or 'threads'")
+
+        self.execution_mode = execution_mode
+        self.inference_mode = inference_mode
+        self.allow_untrained = allow_untrained
+        self.jit_compile = jit_compile
+        self._compiled_members = []
+        self._compiled_ensemble = None
+        self._fused_predictor = None
+        self.fused_model = None
         self.models = []
-        self.weights = weights or [0.4, 0.4, 0.2]  # ResNet, EfficientNet, ViT
-
-        # Load models (you can train them separately first)
-        self.models.append(build_resnet_model())
-        self.models.append(build_efficientnet_model())
-        vit_model = build_vit_tiny_model()
-        if vit_model is not None:
-            self.models.append(vit_model)
-        else:
-            self.weights = self.weights[:2]  # Drop ViT weight if skipped
-
-    def predict(self, img_array):
-        """Ensemble prediction (soft voting)"""
-        probs = []
-        for model in self.models:
-            pred = model.predict(img_array, verbose=0)[0]
-            probs.append(pred)
-        probs = np.array(probs)
-        ensemble_prob = np.average(probs, axis=0, weights=self.weights)
-        return ensemble_prob
+        self.member_names = []
+        self._local_members = {}  # in-process copies used by Grad-CAM in 'processes' mode
+        self._executor = None
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+        self.input_channels = input_channels
+        self.weight_paths = {name: member_weight_path(name, input_channels) for name in DEFAULT_WEIGHT_PATHS}
+        self.weight_paths.update(weight_paths or {})
+        self.weight_paths['resnet50'] = resnet_path or self.weight_paths['resnet50']
+        self.weight_paths['efficientnetv2s'] = effnet_path or self.weight_paths['efficientnetv2s']
+        self.weight_paths['vit_tiny'] = vit_path or self.weight_paths['vit_tiny']
+        self.load_times = {}    # member → seconds to build + restore weights
+        self.weight_sources = {}  # member → artifact the weights came from (None = untrained)
+
+        self.cascade = cascade
+        self.cascade_order = list(cascade_order or DEFAULT_CASCADE_ORDER)
+        self.high_conf_thresh = SCORING_CONFIG['high_conf_thresh'] if high_conf_thresh is None else high_conf_thresh
+        self.low_conf_thresh = SCORING_CONFIG['low_conf_thresh'] if low_conf_thresh is None else low_conf_thresh
+        self.images_seen = 0
+        self.member_runs = Counter()  # images each member actually ran on
+
+        members = list(members or DEFAULT_MEMBERS)
+        default_weights = weights or [DEFAULT_WEIGHTS[name] for name in members]  # ResNet, EfficientNet, ViT
+        candidates = list(zip(members, default_weights))
+
+        if inference_mode == 'tflite':
+            self._load_tflite_members(candidates, tflite_quantization, tflite_dir, threads_per_member)
+            if execution_mode == 'threads':
+                self._executor = ThreadPoolExecutor(max_workers=len(self.member_names),
+                                                    thread_name_prefix='ensemble-member')
+            return
+
+        if vit is None:
+            print("ViT-Tiny skipped — install vit-keras")
+            candidates = [(name, w) for name, w in candidates if name != 'vit_tiny']  # Drop ViT weight if skipped
+
+        if execution_mode == 'threads':
+            # Before any model is built: TF fixes its pool sizes when the runtime starts
+            _size_member_pools(len(candidates), threads_per_member)
+
+        if execution_mode == 'processes':
+            self._start_workers([name for name, _ in candidates], threads_per_member)
+            self.member_names = [name for name, _ in candidates]
+            self.weights = [w for _, w in candidates]
+            return
+
+        fused_path = fused_path or (DEFAULT_FUSED_PATH if input_channels == 3 else grayscale_path(DEFAULT_FUSED_PATH))
+        if inference_mode == 'fused' and os.path.exists(fused_path):
+            start = time.perf_counter()
+            self.fused_model, self.member_names, self.weights, self.models = load_fused_ensemble(fused_path)
+            require_uint8_input(self.fused_model.inputs[0].dtype, fused_path)
+            self.load_times['fused'] = time.perf_counter() - start
+            self.weight_sources = {name: fused_path for name in self.member_names}
+            print(f"Loaded fused ensemble in {self.load_times['fused']:.2f}s from {fused_path}")
+            candidates = []
+
+        # Load trained models (train them first with train.py)
+        if candidates:
+            self.weights = []
+        for name, w in candidates:
+            model, load_seconds, source = load_member(name, self.weight_paths[name], input_channels, allow_untrained)
+            if model is None:
+                continue
+            self.load_times[name] = load_seconds
+            self.weight_sources[name] = source
+            print(f"Loaded {name} in {load_seconds:.2f}s from {source or 'scratch (untrained)'}")
+            self.models.append(model)
+            self.member_names.append(name)
+            self.weights.append(w)
+
+        if inference_mode in ('compiled', 'fused') and self.models:
+            self._compiled_members = [CompiledPredictor.for_model(m, jit_compile=jit_compile) for m in self.models]
+        if inference_mode == 'compiled' and self.models:
+            self._compiled_ensemble = self._build_compiled_ensemble()
+        if inference_mode == 'fused' and self.models:
+            if self.fused_model is None:
+                self.fused_model = build_fused_ensemble(self.models, self.weights, self.member_names)
+            self._fused_predictor = CompiledPredictor.for_model(self.fused_model, jit_compile=jit_compile)
+
+        if execution_mode == 'threads':
+            self._executor = ThreadPoolExecutor(max_workers=len(self.models), thread_name_prefix='ensemble-member')
+
+    def _load_tflite_members(self, candidates, quantization, tflite_dir, num_threads=None):
+        """Loads the quantized member artifacts (members without one are skipped)."""
+        self.weights = []
+        for name, w in candidates:
+            member, load_seconds, path = load_tflite_member(name, quantization, tflite_dir, num_threads,
+                                                            self.input_channels)
+            if member is None:
+                print(f"No TFLite artifact for {name} in '{tflite_dir}' — skipped (run quantize.py)")
+                continue
+            self._compiled_members.append(member)
+            self.member_names.append(name)
+            self.weights.append(w)
+            self.load_times[name] = load_seconds
+            self.weight_sources[name] = path
+            print(f"Loaded {name} in {load_seconds:.2f}s from {path}")
+        if not self.member_names:
+            raise FileNotFoundError(f"No TFLite artifacts found in '{tflite_dir}'")
+
+    def _start_workers(self, names, threads_per_member=None):
+        """Spawns one resident worker process per member and waits until each model is built."""
+        ctx = mp.get_context('spawn')  # TF is not fork-safe
+        threads = threads_per_member or max(1, len(available_cpus()) // len(names))
+        for name in names:
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_member_worker_main,
+                               args=(child_conn, name, threads, self.weight_paths[name],
+                                     self.inference_mode, self.jit_compile, self.input_channels,
+                                     self.allow_untrained),
+                               name=f'ensemble-{name}', daemon=True)
+            proc.start()
+            child_conn.close()
+            self._workers.append((name, proc, parent_conn))
+
+        for name, _, conn in self._workers:
+            status, ok, payload = conn.recv()
+            if not ok:
+                self.close()
+                reason = f": {payload}" if status == 'error' else ""
+                raise RuntimeError(f"Worker for '{name}' failed to build its model{reason}")
+            load_seconds = payload
+            self.load_times[name] = load_seconds
+
+    def _run_member(self, index, img_array):
+        """Runs a single member (by position) on the batch. Returns (N, num_classes)."""
+        with MEMBER_SECONDS.time(member=self.member_names[index]):
+            if self.execution_mode == 'processes':
+                _, _, conn = self._workers[index]
+                with self._workers_lock:
+                    conn.send(img_array)
+                    status, payload = conn.recv()
+                if status != 'ok':
+                    raise RuntimeError(payload)
+                return payload
+            if self._compiled_members:
+                return self._compiled_members[index](img_array)
+            return self.models[index].predict(img_array, verbose=0)
+
+    def _build_compiled_ensemble(self):
+        """One compiled function for all members + the weighted soft vote (returns both)."""
+        models = list(self.models)
+        weights = tf.constant(np.asarray(self.weights) / np.sum(self.weights), dtype=tf.float32)
+
+        def ensemble_fn(x):
+            member_probs = tf.stack([tf.cast(m(x, training=False), tf.float32) for m in models])  # (M, N, C)
+            ensemble_probs = tf.tensordot(weights, member_probs, axes=1)                          # (N, C)
+            return ensemble_probs, member_probs
+
+        return CompiledPredictor(ensemble_fn, models[0].input_shape[1:], input_dtype=models[0].inputs[0].dtype,
+                                 jit_compile=self.jit_compile)
+
+    def _member_probs(self, img_array):
+        """Runs every member on the batch. Returns list of (N, num_classes) arrays in member order."""
+        if self.execution_mode == 'processes':
+            with self._workers_lock:  # one batch in flight per worker pipe
+                for _, _, conn in self._workers:
+                    conn.send(img_array)
+                results = [conn.recv() for _, _, conn in self._workers]
+            for status, payload in results:
+                if status != 'ok':
+                    raise RuntimeError(payload)
+            return [payload for _, payload in results]
+
+        if self.execution_mode == 'threads':
+            return list(self._executor.map(lambda i: self._run_member(i, img_array), range(len(self))))
+
+        return [self._run_member(i, img_array) for i in range(len(self))]
+
+    @property
+    def gradcam_member(self):
+        """
+        Member Grad-CAM runs on: ResNet50, or the distilled student when it is served without it
+        (members=['student']), so a student deployment never loads a float32 ResNet50 for heatmaps.
+        """
+        if 'resnet50' not in self.member_names and 'student' in self.member_names:
+            return 'student'
+        return 'resnet50'
+
+    def get_member(self, name):
+        """
+        Returns the in-process Keras model for a member (e.g. 'resnet50' for Grad-CAM).
+        In 'processes' / 'tflite' mode there is no in-process Keras member, so a local copy
+        is built on first use.
+        """
+        if name in self.member_names and self.models:
+            return self.models[self.member_names.index(name)]
+        if name not in self._local_members:
+            self._local_members[name], _, _ = load_member(name, self.weight_paths[name], self.input_channels,
+                                                          self.allow_untrained)
+        return self._local_members[name]
+
+    def close(self):
+        """Stops the member thread pool / worker processes (no-op in 'sequential' mode)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for _, proc, conn in self._workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+        self._workers = []
+
+    def predict(self, img_array, return_members=False):
+        """
+        Batched ensemble prediction (weighted soft voting).
+
+        Args:
+            img_array: (N, H, W, 3) uint8 batch from preprocess; a single (H, W, 3) image is treated as N=1
+            return_members: also return each member's probabilities
+
+        Returns:
+            np.ndarray (N, num_classes) of ensemble probabilities,
+            plus np.ndarray (M, N, num_classes) of member probabilities if return_members=True
+        """
+        img_array = np.asarray(img_array)
+        if img_array.ndim == 3:
+            img_array = img_array[np.newaxis]
+
+        # Single-graph paths (fused / compiled sequential) only report the 'ensemble' stage;
+        # per-member latency is recorded wherever members run as separate calls
+        with stage('ensemble'):
+            if self._fused_predictor is not None:
+                outputs = self._fused_predictor(img_array)
+                ensemble_probs, member_probs = outputs[0], np.stack(outputs[1:])
+            elif self._compiled_ensemble is not None and self.execution_mode == 'sequential':
+                ensemble_probs, member_probs = self._compiled_ensemble(img_array)
+            else:
+                member_probs = np.stack(self._member_probs(img_array))
+                ensemble_probs = np.average(member_probs, axis=0, weights=self.weights)
+
+        if return_members:
+            return ensemble_probs, member_probs
+        return ensemble_probs
+
+    def predict_chunks(self, chunks, return_members=False):
+        """
+        Streams predictions over an iterable of (n, H, W, 3) chunks, so a large cohort
+        never has to be held in memory at once.
+        Yields: predict() output for each chunk, in order.
+        """
+        for chunk in chunks:
+            yield self.predict(chunk, return_members=return_members)
+
+    def predict_cascade(self, img_array, order=None, high_conf_thresh=None, low_conf_thresh=None):
+        """
+        Early-exit prediction: runs members one at a time (cheapest first) and only sends
+        an image to the next member while its running soft vote is in the uncertain band.
+
+        Args:
+            img_array: (N, H, W, 3) uint8 batch from preprocess
+            order: member names to try, in order (default: self.cascade_order)
+            high_conf_thresh / low_conf_thresh: exit thresholds on P(pneumonia)
+                (default: the ensemble's thresholds, taken from scoring.CONFIG)
+
+        Returns:
+            (np.ndarray (N, num_classes) soft vote over the members that ran,
+             list of N lists with the names of the members that ran for each image)
+        """
+        img_array = np.asarray(img_array)
+        if img_array.ndim == 3:
+            img_array = img_array[np.newaxis]
+        high = self.high_conf_thresh if high_conf_thresh is None else high_conf_thresh
+        low = self.low_conf_thresh if low_conf_thresh is None else low_conf_thresh
+
+        order = [name for name in (order or self.cascade_order) if name in self.member_names]
+        order += [name for name in self.member_names if name not in order]  # unlisted members go last
+
+        n = len(img_array)
+        vote_sum = None
+        weight_sum = np.zeros(n)
+        members_ran = [[] for _ in range(n)]
+        active = np.arange(n)
+
+        for name in order:
+            index = self.member_names.index(name)
+            weight = self.weights[index]
+            probs = self._run_member(index, img_array[active])
+
+            if vote_sum is None:
+                vote_sum = np.zeros((n, probs.shape[1]))
+            vote_sum[active] += weight * probs
+            weight_sum[active] += weight
+            for i in active:
+                members_ran[i].append(name)
+            self.member_runs[name] += len(active)
+
+            running = vote_sum[active] / weight_sum[active, np.newaxis]
+            pneumonia_prob = running[:, 1:].sum(axis=1)
+            uncertain = (pneumonia_prob > low) & (pneumonia_prob < high)
+            active = active[uncertain]
+            if active.size == 0:
+                break
+
+        self.images_seen += n
+        return vote_sum / weight_sum[:, np.newaxis], members_ran
+
+    def predict_report(self, img_array):
+        """
+        Serving entry point: cascade or full soft vote depending on self.cascade.
+        Returns: (np.ndarray (N, num_classes), list of N lists of member names that ran)
+        """
+        if self.cascade:
+            with stage('ensemble'):
+                return self.predict_cascade(img_array)
+
+        probs = self.predict(img_array)
+        self.images_seen += len(probs)
+        for name in self.member_names:
+            self.member_runs[name] += len(probs)
+        return probs, [list(self.member_names) for _ in range(len(probs))]
+
+    def cascade_stats(self):
+        """Average number of members run per image (full ensemble = len(self))."""
+        total_runs = sum(self.member_runs.values())
+        return {
+            "cascade": self.cascade,
+            "cascade_order": self.cascade_order,
+            "images_seen": self.images_seen,
+            "member_runs": dict(self.member_runs),
+            "avg_members_per_image": round(total_runs / self.images_seen, 3) if self.images_seen else 0.0,
+        }
 
     def __len__(self):
-        return len(self.models)
+        return len(self.member_names)
+
+def iter_chunks(images, chunk_size=32):
+    """
+    Groups an iterable of single preprocessed images ((H, W, 3) or (1, H, W, 3))
+    into (n <= chunk_size, H, W, 3) arrays for PneumoniaEnsemble.predict_chunks().
+    """
+    chunk = []
+    for img in images:
+        img = np.asarray(img)
+        chunk.append(img[0] if img.ndim == 4 else img)
+        if len(chunk) == chunk_size:
+            yield np.stack(chunk)
+            chunk = []
+    if chunk:
+        yield np.stack(chunk)
 
 # Example usage (for testing)
+#   python models.py                        → load the ensemble and print per-member load times
+#   python models.py --export-fast-weights  → convert train.py's .h5 files to the fast format
+#   python models.py --export-fused         → save the ensemble as one graph (DEFAULT_FUSED_PATH)
+#   add --grayscale to use / write the 1-channel '_gray' artifacts
 if __name__ == "__main__":
-    ensemble = PneumoniaEnsemble()
-    print(f"Ensemble has {len(ensemble)} models")
+    import sys
+
+    channels = 1 if '--grayscale' in sys.argv else 3
+    if '--export-fast-weights' in sys.argv:
+        for name in DEFAULT_WEIGHT_PATHS:
+            path = member_weight_path(name, channels)
+            if not os.path.isfile(path):
+                print(f"Skipping {name}: '{path}' not found")
+                continue
+            model = MEMBER_BUILDERS[name](pretrained=False, channels=channels)
+            if model is None:
+                continue
+            model.load_weights(path)
+            print(f"{name}: {path} → {export_fast_weights(model, fast_weights_path(path))}")
+    elif '--export-fused' in sys.argv:
+        # Build the fused single-graph ensemble from the trained members, check parity, save
+        ensemble = PneumoniaEnsemble(input_channels=channels)
+        fused = build_fused_ensemble(ensemble.models, ensemble.weights, ensemble.member_names)
+        probe = np.random.randint(0, 256, (4,) + INPUT_SIZE + (channels,), dtype=np.uint8)
+        diff = np.abs(fused.predict(probe, verbose=0)[0] - ensemble.predict(probe)).max()
+        print(f"Max |fused - predict()| difference: {diff:.2e}")
+        path = DEFAULT_FUSED_PATH if channels == 3 else grayscale_path(DEFAULT_FUSED_PATH)
+        print(f"Saved fused ensemble → {save_fused_ensemble(fused, path)}")
+    else:
+        ensemble = PneumoniaEnsemble(input_channels=channels)
+        print(f"Ensemble has {len(ensemble)} models")
+        for name, seconds in ensemble.load_times.items():
+            print(f"  {name:<16} {seconds:6.2f}s  ({ensemble.weight_sources.get(name) or 'untrained'})")
@@ -0,0 +1,364 @@
+# pipeline.py - End-to-end X-ray analysis (preprocess → ensemble → Grad-CAM → scoring)
+# Split into stages so the API can batch the ensemble step across concurrent requests.
+
+import os
+import time
+
+import cv2
+import numpy as np
+from cache import cache_key
+from models import DEFAULT_MEMBERS, GRADCAM_LAYERS, PneumoniaEnsemble, fast_weights_path
+from preprocess import ImageContext, load_image_context
+from delivery import encode_image, encode_image_base64, quantize_heatmap, dequantize_heatmap
+from metrics import stage, timed
+from explainability import build_gradcam_model, compute_gradcam_heatmap, overlay_heatmap_on_image
+from scoring import calculate_symptom_score, past_record_score, calculate_final_score
+
+# ────────────────────────────────────────────────────────────────
+# TTA options (same variants as test_core.py)
+# ────────────────────────────────────────────────────────────────
+TTA_FLIPS = True              # Horizontal flip
+TTA_ROTATIONS = [0, 5, -5]    # Small rotations in degrees
+TTA_BORDER_RGB = (124, 117, 104)  # ImageNet mean: rotated-in corners stay neutral for every member
+
+# Members to serve (comma-separated registry names, e.g. 'student'); default: the 3-model ensemble
+MEMBERS = [name for name in os.getenv('ENSEMBLE_MEMBERS', '').split(',') if name] or None
+# How ensemble members run: 'sequential' | 'threads' | 'processes' (see models.py)
+EXECUTION_MODE = os.getenv('ENSEMBLE_EXECUTION_MODE', 'sequential')
+# Serving path: 'compiled' (fixed-signature tf.function, default), 'keras' (model.predict per call),
+# 'fused' (single-graph ensemble, loaded from ENSEMBLE_FUSED_PATH when that file exists)
+# or 'tflite' (quantized artifacts from quantize.py, ENSEMBLE_TFLITE_QUANTIZATION = int8 | float16)
+INFERENCE_MODE = os.getenv('ENSEMBLE_INFERENCE_MODE', 'compiled')
+FUSED_PATH = os.getenv('ENSEMBLE_FUSED_PATH') or None
+TFLITE_QUANTIZATION = os.getenv('ENSEMBLE_TFLITE_QUANTIZATION', 'int8')
+JIT_COMPILE = os.getenv('ENSEMBLE_JIT_COMPILE', '0') == '1'  # XLA for the compiled path
+# 1 = grayscale-native members ('_gray' artifacts, (N, 224, 224, 1) input); 3 = RGB
+INPUT_CHANNELS = int(os.getenv('ENSEMBLE_INPUT_CHANNELS', '3'))
+# Early-exit cascade (cheapest member first); order is a comma-separated list of member names
+USE_CASCADE = os.getenv('ENSEMBLE_CASCADE', '0') == '1'
+CASCADE_ORDER = [name for name in os.getenv('ENSEMBLE_CASCADE_ORDER', '').split(',') if name] or None
+# Grad-CAM runs on ResNet50 (the student when served alone), which the cascade puts last: images that exit before it skip Grad-CAM
+# (rendered only when a heatmap is explicitly asked for). 1 = always run it, as without the cascade
+CASCADE_GRADCAM = os.getenv('ENSEMBLE_CASCADE_GRADCAM', '0') == '1'
+
+_ensemble = None
+_gradcam_model = None
+
+
+def member_threads(thread_budget):
+    """
+    Threads per member for a process allowed `thread_budget` CPU threads (None / 0 = no limit):
+    the whole budget when members run one after another, an even share when they run concurrently.
+    """
+    if not thread_budget:
+        return None
+    if EXECUTION_MODE == 'sequential':
+        return thread_budget
+    return max(1, thread_budget // len(MEMBERS or DEFAULT_MEMBERS))
+
+
+def get_ensemble(thread_budget=None):
+    """
+    Returns the process-wide ensemble, building it on first use.
+    thread_budget: CPU threads this process may use (the worker's intra-op size from
+    configure_threading). configure_threading only sizes the TF pools; TFLite interpreters and
+    member worker processes run their own threads, so they get the budget as threads_per_member.
+    """
+    global _ensemble
+    if _ensemble is None:
+        _ensemble = PneumoniaEnsemble(members=MEMBERS, execution_mode=EXECUTION_MODE, inference_mode=INFERENCE_MODE,
+                                      threads_per_member=member_threads(thread_budget),
+                                      jit_compile=JIT_COMPILE, fused_path=FUSED_PATH,
+                                      tflite_quantization=TFLITE_QUANTIZATION, cascade=USE_CASCADE,
+                                      cascade_order=CASCADE_ORDER, input_channels=INPUT_CHANNELS)
+    return _ensemble
+
+
+def get_gradcam_model():
+    """Returns the process-wide Grad-CAM sub-model of the ensemble's Grad-CAM member, built once."""
+    global _gradcam_model
+    if _gradcam_model is None:
+        ensemble = get_ensemble()
+        member = ensemble.gradcam_member
+        _gradcam_model = build_gradcam_model(ensemble.get_member(member), GRADCAM_LAYERS[member])
+    return _gradcam_model
+
+
+def load_models(thread_budget=None):
+    """Builds the ensemble (see get_ensemble) and the Grad-CAM sub-model (call once at startup)."""
+    return get_ensemble(thread_budget), get_gradcam_model()
+
+
+def warmup(runs=3, batch_sizes=(1,)):
+    """
+    Runs dummy inferences so graph tracing and kernel selection happen before real
+    traffic: `runs` passes through the ensemble for each batch size, plus Grad-CAM.
+    Returns: seconds spent per batch size (first pass is the expensive one).
+    """
+    ensemble, grad_model = load_models()
+    timings = {}
+    for batch_size in batch_sizes:
+        dummy = np.zeros((batch_size, 224, 224, ensemble.input_channels), dtype=np.uint8)
+        start = time.perf_counter()
+        for _ in range(runs):
+            ensemble.predict_report(dummy)
+        timings[batch_size] = time.perf_counter() - start
+    ensemble.images_seen = 0  # keep warmup out of the cascade stats
+    ensemble.member_runs.clear()
+
+    if runs > 0:
+        compute_gradcam_heatmap(np.zeros((1, 224, 224, ensemble.input_channels), dtype=np.uint8), None,
+                                grad_model=grad_model)
+    return timings
+
+
+def build_tta_batch(img_array, flips=TTA_FLIPS, rotations=TTA_ROTATIONS):
+    """
+    Stacks the TTA variants of a preprocessed uint8 (1, H, W, C) image into one
+    (V, H, W, C) batch, so all variants go through the ensemble in a single call.
+    """
+    img = img_array[0]
+    variants = [img]
+
+    if flips:
+        variants.append(np.flip(img, axis=1))  # flip width axis
+
+    rows, cols = img.shape[:2]
+    for angle in rotations:
+        if angle == 0:
+            continue
+        M = cv2.getRotationMatrix2D((cols / 2, rows / 2), angle, 1.0)
+        # warpAffine drops a trailing single channel; reshape keeps (H, W, 1) for grayscale input
+        variants.append(cv2.warpAffine(img, M, (cols, rows), borderValue=TTA_BORDER_RGB).reshape(img.shape))
+
+    return np.stack(variants)
+
+
+def prepare_input(image_input, is_bytes=False, use_tta=False, channels=INPUT_CHANNELS, keep_original=True):
+    """
+    Stage 1: preprocess the image (channels: the ensemble's input_channels, 3 = RGB, 1 = gray).
+    image_input: file path, bytes, or an ImageContext whose bytes were already read.
+    keep_original=False when no overlay will be drawn (the full-size decode is not kept).
+    Returns: (context, model_input) where context is the ImageContext carried on to Grad-CAM
+             (context.tensor, (1, H, W, C)) and the overlay (context.original), and model_input
+             is what goes to the ensemble ((1, H, W, C), or (V, H, W, C) with TTA).
+    """
+    context = load_image_context(image_input, is_bytes=is_bytes, channels=channels, keep_original=keep_original)
+    if context is None:
+        raise ValueError("Failed to load image (file missing, corrupted or unsupported format)")
+
+    if use_tta:
+        with stage('tta'):
+            model_input = build_tta_batch(context.tensor)
+    else:
+        model_input = context.tensor
+    return context, model_input
+
+
+def compute_heatmap(img_array, ensemble=None):
+    """
+    Grad-CAM on the ensemble's Grad-CAM member (ResNet50, or the student served alone):
+    (7, 7) float32 matrix in [0, 1], or None on failure.
+    """
+    ensemble = ensemble or get_ensemble()
+    grad_model = get_gradcam_model() if ensemble is _ensemble else None
+    member = ensemble.gradcam_member
+    heatmap, _ = compute_gradcam_heatmap(img_array, ensemble.get_member(member), GRADCAM_LAYERS[member],
+                                         grad_model=grad_model)
+    return heatmap
+
+
+def render_overlay(heatmap, context, add_colorbar=True):
+    """
+    Overlays a Grad-CAM matrix on the original upload at its own resolution (RGB uint8).
+    context: the image's ImageContext; its decoded original is reused (uploads never touch disk).
+    """
+    if heatmap is None:
+        return None
+    return overlay_heatmap_on_image(heatmap, context, alpha=0.45, add_colorbar=add_colorbar)
+
+
+def heatmap_image(findings, image_input, is_bytes=False, fmt='jpeg', quality=None, add_colorbar=True):
+    """
+    Encoded overlay (jpeg / png / webp bytes) rebuilt from the findings' heatmap matrix.
+    image_input: ImageContext from prepare_input (no second decode), file path or bytes.
+    """
+    if findings.get("heatmap_matrix") is None:
+        return None
+    context = ImageContext.from_input(image_input, is_bytes)
+    overlaid = render_overlay(dequantize_heatmap(findings["heatmap_matrix"]), context, add_colorbar)
+    return encode_image(overlaid, fmt, quality) if overlaid is not None else None
+
+
+def artifact_stamp(path):
+    """
+    [path, [[file, mtime_ns, size], ...]] for a weight artifact. Directories ('.weights/', SavedModel)
+    list the files inside: export_fast_weights rewrites weights.bin / manifest.json in place,
+    which leaves the directory's own mtime unchanged.
+    """
+    if not path or not os.path.exists(path):
+        return [path, None]
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+    stats = [(f, os.stat(f)) for f in files]
+    return [path, [[os.path.relpath(f, path) if f != path else '', st.st_mtime_ns, st.st_size] for f, st in stats]]
+
+
+def inference_fingerprint(ensemble=None, use_tta=False):
+    """
+    Everything besides the image bytes that changes the ensemble output or heatmap:
+    serving path, members + weights, the weight artifacts (files, mtime + size), TTA and input channels.
+    Part of the result cache key, so retraining or reconfiguring invalidates old entries.
+    """
+    ensemble = ensemble or get_ensemble()
+    artifacts = {}
+    for name in ensemble.member_names:
+        artifacts[name] = artifact_stamp(ensemble.weight_sources.get(name))
+    gradcam_member = ensemble.gradcam_member
+    if gradcam_member not in ensemble.member_names or not ensemble.models:
+        # Grad-CAM runs on a separately loaded Keras member (tflite / processes / other members)
+        gradcam_path = ensemble.weight_paths[gradcam_member]
+        artifacts['gradcam'] = [gradcam_member, artifact_stamp(fast_weights_path(gradcam_path)),
+                                artifact_stamp(gradcam_path)]
+    return {
+        'inference_mode': ensemble.inference_mode,
+        'members': list(ensemble.member_names),
+        'weights': [float(w) for w in ensemble.weights],
+        'artifacts': artifacts,
+        'cascade': [ensemble.cascade, ensemble.cascade_order, ensemble.high_conf_thresh, ensemble.low_conf_thresh],
+        'tta': [TTA_FLIPS, TTA_ROTATIONS] if use_tta else None,
+        'input_channels': ensemble.input_channels,
+    }
+
+
+def probability_findings(batch_probs, ensemble=None, members_ran=None):
+    """
+    Stage 3a: ensemble probabilities for one image (TTA variants averaged).
+
+    Args:
+        batch_probs: (V, num_classes) ensemble output for this image's rows
+                     (V > 1 with TTA)
+        members_ran: per-row member names from ensemble.predict_report()
+
+    Returns: JSON-serialisable dict (heatmap still None)
+    """
+    ensemble = ensemble or get_ensemble()
+    probs = np.mean(batch_probs, axis=0)
+    members_used = [name for name in ensemble.member_names
+                    if any(name in row for row in (members_ran or [ensemble.member_names]))]
+    return {
+        "probabilities": [float(p) for p in probs],
+        "tta_variants": int(len(batch_probs)),
+        "members_used": members_used,
+        "heatmap_matrix": None,
+        "heatmap": None,
+    }
+
+
+def gradcam_needed(findings, ensemble=None):
+    """
+    False for cascade early exits: the Grad-CAM member (ResNet50) never ran on the image, and a
+    Grad-CAM pass would cost more than the members the cascade saved.
+    """
+    ensemble = ensemble or get_ensemble()
+    return not ensemble.cascade or CASCADE_GRADCAM or ensemble.gradcam_member in findings["members_used"]
+
+
+def heatmap_findings(context, ensemble=None, add_colorbar=True, with_image=True):
+    """
+    Stage 3b: Grad-CAM on context.tensor, overlaid on context.original (ImageContext from prepare_input).
+    Returns {"heatmap_matrix": native-resolution uint8 grid,
+    "heatmap": base64 JPEG overlay (None when with_image=False or on failure)}.
+    """
+    heatmap = compute_heatmap(context.tensor, ensemble)
+    if heatmap is None:
+        return {"heatmap_matrix": None, "heatmap": None}
+    overlaid = render_overlay(heatmap, context, add_colorbar) if with_image else None
+    return {
+        "heatmap_matrix": quantize_heatmap(heatmap),
+        "heatmap": encode_image_base64(overlaid) if overlaid is not None else None,
+    }
+
+
+def image_findings(context, batch_probs, ensemble=None, add_colorbar=True, members_ran=None):
+    """
+    Everything derived from the image alone: probabilities (3a) + Grad-CAM heatmap (3b).
+    This is the part the result cache stores. Cascade early exits skip 3b ("heatmap_skipped").
+
+    Args:
+        context: ImageContext of the preprocessed image (from prepare_input)
+        batch_probs / members_ran: see probability_findings()
+
+    Returns: JSON-serialisable dict
+    """
+    findings = probability_findings(batch_probs, ensemble, members_ran)
+    if gradcam_needed(findings, ensemble):
+        findings.update(heatmap_findings(context, ensemble, add_colorbar))
+    else:
+        findings["heatmap_skipped"] = True
+    return findings
+
+
+@timed('scoring')
+def score_findings(findings, matched_symptoms=None, has_past_history=False):
+    """
+    Stage 4: clinical scoring (symptoms + history) on top of the image findings.
+    Always runs fresh, also for cached findings.
+    Returns: JSON-serialisable dict
+    """
+    matched_symptoms = matched_symptoms or []
+    probs = np.asarray(findings["probabilities"])
+
+    symptom_score = calculate_symptom_score(matched_symptoms)
+    past_score = past_record_score(has_past_history)
+    final_score, explanation = calculate_final_score(probs, symptom_score, past_score)
+
+    return {
+        "probabilities": findings["probabilities"],
+        "pneumonia_probability": float(np.sum(probs[1:])),
+        "symptom_score": float(symptom_score),
+        "past_score": float(past_score),
+        "final_score": float(final_score),
+        "explanation": explanation,
+        "tta_variants": findings["tta_variants"],
+        "members_used": findings["members_used"],
+        "heatmap": findings["heatmap"],
+        "heatmap_skipped": findings.get("heatmap_skipped", False),
+    }
+
+
+def finalize_result(context, batch_probs, matched_symptoms=None, has_past_history=False,
+                    ensemble=None, add_colorbar=True, members_ran=None):
+    """
+    Stages 3 + 4: Grad-CAM heatmap + clinical scoring on top of the ensemble output
+    (image_findings + score_findings).
+    Returns: JSON-serialisable dict
+    """
+    findings = image_findings(context, batch_probs, ensemble=ensemble, add_colorbar=add_colorbar,
+                              members_ran=members_ran)
+    return score_findings(findings, matched_symptoms, has_past_history)
+
+
+def analyze_xray(image_input, is_bytes=False, use_tta=False, matched_symptoms=None,
+                 has_past_history=False, ensemble=None, cache=None):
+    """
+    Full analysis of one X-ray, run synchronously (scripts / notebooks).
+    The API runs the same stages but batches the ensemble step (see batching.py).
+    With a ResultCache (cache.py), repeated images skip the ensemble and Grad-CAM.
+    """
+    ensemble = ensemble or get_ensemble()
+    # The file is read once: the same bytes feed the cache key, preprocessing and the overlay
+    image = ImageContext.from_input(image_input, is_bytes)
+    key = None
+    if cache is not None:
+        key = cache_key(image.data, inference_fingerprint(ensemble, use_tta))
+        findings = cache.get(key)
+        if findings is not None:
+            return score_findings(findings, matched_symptoms, has_past_history)
+
+    context, model_input = prepare_input(image, use_tta=use_tta, channels=ensemble.input_channels)
+    batch_probs, members_ran = ensemble.predict_report(model_input)
+    findings = image_findings(context, batch_probs, ensemble=ensemble, members_ran=members_ran)
+    if key is not None:
+        cache.put(key, findings)
+    return score_findings(findings, matched_symptoms, has_past_history)
@@ -1,25 +1,246 @@
 # preprocess.py
 # Handles image preprocessing for inference (file path) and Hugging Face dataset (bytes)
 
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-import tensorflow as tf
+from metrics import stage
+
+# ────────────────────────────────────────────────────────────────
+# Output: uint8 RGB pixels, or one gray channel for the grayscale-native models (channels=1).
+# Each ensemble member normalizes its own input in-graph (models.PixelNormalization: caffe for
+# ResNet50, raw 0-255 for EfficientNetV2, [-1, 1] for ViT / MobileNetV2), so the host hands one
+# 1-byte-per-channel buffer to every member.
+# ────────────────────────────────────────────────────────────────
+PREPROCESS_CONFIG = {
+    'threads': int(os.getenv('PREPROCESS_THREADS', '0')) or None,  # decode/resize pool (None → CPU count)
+    'reduced_decode': os.getenv('REDUCED_DECODE', '1') == '1',      # DCT-scaled JPEG decode for large sources
+}
+
+
+# ────────────────────────────────────────────────────────────────
+# Decoding
+# Radiographs are typically 2000-3000 px per side and stored as single-channel images. libjpeg
+# can decode at 1/2, 1/4 or 1/8 scale in the DCT domain (IMREAD_REDUCED_*), which skips most of
+# the IDCT work and never materialises the full-size bitmap; we pick the largest factor that
+# still leaves the image at least target_size, so INTER_AREA always has real pixels to average.
+# Grayscale sources are decoded as one channel and only expanded to 3 after the resize.
+# ────────────────────────────────────────────────────────────────
+_REDUCED_FLAGS = {
+    # factor: (color flag, grayscale flag)
+    8: (cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    4: (cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    2: (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    1: (cv2.IMREAD_COLOR, cv2.IMREAD_GRAYSCALE),
+}
+# JPEG start-of-frame markers (baseline, progressive, lossless...); C4/C8/CC are not frames
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe_image(data):
+    """
+    Reads format, size and channel count from the image header without decoding.
+
+    Returns:
+        (format, width, height, channels) with format 'jpeg' or 'png',
+        or None for other / truncated files
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 26:
+        width, height, _, color_type = struct.unpack('>IIBB', data[16:26])
+        return 'png', width, height, 1 if color_type in (0, 4) else 3  # gray, gray + alpha
+
+    if data[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0x01, *range(0xD0, 0xD8)):  # standalone markers carry no length
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in _SOF_MARKERS:
+            if pos + 10 > len(data):
+                return None
+            height, width, channels = struct.unpack('>HHB', data[pos + 5:pos + 10])
+            return 'jpeg', width, height, channels
+        pos += 2 + length
+    return None
+
+
+def reduction_factor(width, height, target_size):
+    """Largest JPEG DCT scale (8, 4, 2 or 1) that keeps both sides ≥ the target's longer side."""
+    # Orientation-agnostic: EXIF rotation is applied after decoding, so compare the short side
+    needed = max(target_size)
+    for factor in (8, 4, 2):
+        if min(width, height) // factor >= needed:
+            return factor
+    return 1
+
+
+def _decode(data, info, target_size, grayscale):
+    """decode_image() with a precomputed probe_image() header. Returns (img, full_size)."""
+    nparr = np.frombuffer(data, np.uint8)
+    if info is None:
+        return cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR), not grayscale
+
+    fmt, width, height, channels = info
+    # Reduced modes only save work for JPEG; other formats are decoded in full and resized inside OpenCV
+    factor = reduction_factor(width, height, target_size) \
+        if fmt == 'jpeg' and PREPROCESS_CONFIG['reduced_decode'] else 1
+    color_flag, gray_flag = _REDUCED_FLAGS[factor]
+    img = cv2.imdecode(nparr, gray_flag if grayscale or channels == 1 else color_flag)
+    # full_size: the decoded pixels are the original image (no DCT scaling, no colour dropped)
+    return img, factor == 1 and (channels == 1 or not grayscale)
+
+
+def decode_image(data, target_size=(224, 224), grayscale=False):
+    """
+    Decodes encoded image bytes at the cheapest resolution that still covers target_size.
+    grayscale=True decodes every source as one channel (JPEG: the luma plane, no colour conversion).
+
+    Returns:
+        np.ndarray, BGR (H, W, 3) or grayscale (H, W) for single-channel sources / grayscale=True;
+        None if the bytes cannot be decoded
+    """
+    return _decode(data, probe_image(data), target_size, grayscale)[0]
+
+
+def to_rgb(img, dst=None):
+    """BGR or single-channel uint8 image → RGB (3 channels)."""
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB if img.ndim == 2 else cv2.COLOR_BGR2RGB, dst=dst)
 
 # ────────────────────────────────────────────────────────────────
-# Choose preprocessing function that matches your base model
-# ResNet50 is the safest default for most medical imaging tasks
+# Image context
+# One upload is read and decoded once for everything downstream: the model tensor for inference
+# and Grad-CAM, and the original-resolution pixels for the heatmap overlay (which used to re-read
+# the file with cv2.imread, and needed a temp file for in-memory uploads).
 # ────────────────────────────────────────────────────────────────
-from tensorflow.keras.applications.resnet50 import preprocess_input as resnet_preprocess
-# If you switch to EfficientNetV2 as primary model later:
-# from tensorflow.keras.applications.efficientnet_v2 import preprocess_input as effnet_preprocess
+class ImageContext:
+    """
+    Encoded bytes, decoded pixels and metadata of one image, passed from preprocessing through
+    inference, Grad-CAM and overlay.
+
+    Attributes:
+        data: encoded image bytes (file contents or upload)
+        source: description used in error messages
+        info: probe_image() header (format, width, height, channels), or None if unrecognised
+        tensor: uint8 (1, H, W, C) model input once preprocess() has run, else None
+        original: full-resolution pixels (BGR, or (H, W) for single-channel sources)
+    """
+    __slots__ = ('data', 'source', 'info', 'tensor', '_original', '_lock')
+
+    def __init__(self, data, source="bytes input"):
+        self.data = data
+        self.source = source
+        self.info = probe_image(data)
+        self.tensor = None
+        self._original = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_input(cls, input_data, is_bytes=False):
+        """Context for a file path or raw bytes (an existing context is returned as-is)."""
+        if isinstance(input_data, cls):
+            return input_data
+        if is_bytes:
+            return cls(input_data)
+        with open(input_data, 'rb') as f:
+            return cls(f.read(), f"file path '{input_data}'")
+
+    @property
+    def original(self):
+        """
+        Original-resolution pixels, or None if the bytes cannot be decoded. Reuses the decode from
+        preprocess() when that one ran at full size (PNGs, small JPEGs); large JPEGs are decoded
+        reduced for the model, so their full-size pixels are decoded here on first use.
+        """
+        with self._lock:
+            if self._original is None:
+                gray = self.info is not None and self.info[3] == 1
+                with stage('overlay_decode'):
+                    self._original = cv2.imdecode(np.frombuffer(self.data, np.uint8),
+                                                  cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR)
+            return self._original
+
+    def release_pixels(self):
+        """Drops the decoded original (it is re-decoded on demand), e.g. before queueing deferred work."""
+        with self._lock:
+            self._original = None
+
+    def preprocess(self, target_size=(224, 224), interpolation=cv2.INTER_AREA, channels=3, keep_original=True):
+        """
+        Decodes and resizes into `tensor` (see preprocess_image) and returns it.
+        keep_original=False drops the full-size decode right away (no overlay will be drawn).
+        Raises ValueError if the bytes cannot be decoded.
+        """
+        # Step 1: Decode (reduced scale for large JPEGs); keep it as `original` if it is full size
+        with stage('decode'):
+            img, full_size = _decode(self.data, self.info, target_size, grayscale=channels == 1)
+
+        if img is None:
+            raise ValueError(f"Failed to load image from {self.source} (file missing or corrupted)")
+        if full_size and keep_original:
+            with self._lock:
+                self._original = img
+
+        # Step 2: Resize with good interpolation for medical images (on 1 channel for grayscale sources)
+        with stage('resize'):
+            img = cv2.resize(img, target_size, interpolation=interpolation)
+
+        # Step 3: BGR (OpenCV default) / grayscale → RGB, or keep the single channel
+        if channels == 1:
+            img = img[..., np.newaxis]
+        else:
+            with stage('color_convert'):
+                img = to_rgb(img)
+
+        # Step 4: Add batch dimension (model expects (1, H, W, C))
+        self.tensor = np.expand_dims(img, axis=0)
+        return self.tensor
+
+
+def load_image_context(
+    input_data,
+    is_bytes=False,
+    target_size=(224, 224),
+    interpolation=cv2.INTER_AREA,
+    channels=3,
+    keep_original=True
+):
+    """
+    Like preprocess_image, but returns the whole ImageContext (tensor + decoded original), so the
+    heatmap overlay can reuse the decode. input_data may also be an ImageContext (bytes already read).
+    keep_original=False when no overlay will be drawn: the full-size pixels are not held on to.
+
+    Returns:
+        ImageContext with `tensor` set, or None if loading/preprocessing failed
+    """
+    source = "bytes input" if is_bytes else f"file path '{input_data}'"
+    try:
+        context = ImageContext.from_input(input_data, is_bytes)
+        source = context.source
+        context.preprocess(target_size, interpolation, channels, keep_original)
+        return context
+    except Exception as e:
+        print(f"Preprocessing failed for {source}: {str(e)}")
+        return None
 
-PREPROCESS_FUNC = resnet_preprocess  # ← change here if needed
 
 def preprocess_image(
     input_data,
     is_bytes=False,
     target_size=(224, 224),
-    interpolation=cv2.INTER_AREA
+    interpolation=cv2.INTER_AREA,
+    channels=3
 ):
     """
     Preprocesses a single chest X-ray image for model input.
@@ -28,54 +249,111 @@ def preprocess_image(
       - str: file path (used in test_core.py, single image inference)
       - bytes: raw image bytes (used when loading from Hugging Face datasets)
 
+    channels=3 gives RGB; channels=1 a single gray channel for the grayscale-native models.
+
     Returns:
-        np.ndarray of shape (1, height, width, 3) ready for model.predict()
+        uint8 np.ndarray of shape (1, height, width, channels) ready for model.predict()
         or None if loading/preprocessing failed
 
     Key features:
-    - Converts BGR → RGB
+    - Decodes large JPEGs at reduced scale and grayscale sources as one channel (decode_image)
+    - Converts BGR / grayscale → RGB
     - Uses INTER_AREA for high-quality downscaling of medical images
-    - Applies correct ImageNet preprocessing (mean subtraction + scaling)
+    - Leaves normalization to the models (each member has its own, in-graph)
     - Clear error messages with context
     """
-    try:
-        # Step 1: Load image
-        if is_bytes:
-            # Hugging Face dataset → bytes
-            nparr = np.frombuffer(input_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            source = "bytes input"
-        else:
-            # Local file path
-            img = cv2.imread(input_data)
-            source = f"file path '{input_data}'"
+    context = load_image_context(input_data, is_bytes, target_size, interpolation, channels, keep_original=False)
+    return context.tensor if context is not None else None
 
-        if img is None:
-            raise ValueError(f"Failed to load image from {source} (file missing or corrupted)")
 
-        # Step 2: Convert BGR (OpenCV default) → RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+# ────────────────────────────────────────────────────────────────
+# Batch preprocessing
+# imdecode / cvtColor / resize release the GIL, so decoding on a thread pool scales with cores.
+# Every item is resized straight into its row of one preallocated uint8 (N, H, W, C) block, which
+# is the model input as-is: no per-image expand_dims / stack and no float copy.
+# ────────────────────────────────────────────────────────────────
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=PREPROCESS_CONFIG['threads'] or os.cpu_count(),
+                                       thread_name_prefix='preprocess')
+        return _pool
+
 
-        # Step 3: Resize with good interpolation for medical images
-        img = cv2.resize(img, target_size, interpolation=interpolation)
+def _load_into(item, is_bytes, dst, interpolation):
+    """
+    Decodes one image and resizes it into `dst` ((H, W, 3) → RGB, (H, W, 1) → gray), uint8.
+    Returns False if it cannot be loaded.
+    """
+    try:
+        target_size = (dst.shape[1], dst.shape[0])
+        grayscale = dst.shape[2] == 1
+        with stage('decode'):
+            if not is_bytes:
+                with open(item, 'rb') as f:
+                    item = f.read()
+            img = decode_image(item, target_size, grayscale=grayscale)
+        if img is None:
+            raise ValueError("file missing or corrupted")
 
-        # Step 4: Apply model-specific ImageNet preprocessing
-        # This is CRITICAL for transfer learning accuracy
-        img = img.astype(np.float32)
-        img = PREPROCESS_FUNC(img)
+        if grayscale:
+            with stage('resize'):
+                cv2.resize(img, target_size, dst=dst[..., 0], interpolation=interpolation)
+            return True
 
-        # Step 5: Add batch dimension (model expects (1, H, W, 3))
-        return np.expand_dims(img, axis=0)
+        # Resize first, then convert: same pixels, and the conversion only touches H×W
+        with stage('resize'):
+            if img.ndim == 2:
+                small = cv2.resize(img, target_size, interpolation=interpolation)
+            else:
+                small = cv2.resize(img, target_size, dst=dst, interpolation=interpolation)
+        with stage('color_convert'):
+            to_rgb(small, dst=dst)
+        return True
 
     except Exception as e:
+        source = "bytes input" if is_bytes else f"file path '{item}'"
         print(f"Preprocessing failed for {source}: {str(e)}")
-        return None
+        return False
 
 
-# Optional helper (useful for batch inference or debugging)
-def preprocess_batch(items, is_bytes=False):
+def preprocess_batch(
+    items,
+    is_bytes=False,
+    target_size=(224, 224),
+    interpolation=cv2.INTER_AREA,
+    executor=None,
+    channels=3
+):
     """
-    Preprocess multiple images at once.
-    Returns list of preprocessed arrays (None for failed items).
+    Preprocesses multiple images into one contiguous model-ready tensor.
+
+    Args:
+        items: file paths, or raw image bytes when is_bytes=True
+        is_bytes: see preprocess_image
+        target_size: (width, height), as for preprocess_image
+        interpolation: cv2 resize interpolation
+        executor: thread pool for decode/resize (default: shared pool, PREPROCESS_THREADS)
+        channels: 3 (RGB) or 1 (gray), as for preprocess_image
+
+    Returns:
+        (batch, valid)
+        batch: uint8 np.ndarray (N, height, width, channels), like preprocess_image;
+               rows of failed items are all zeros
+        valid: bool np.ndarray (N,), False where loading/preprocessing failed
     """
-    return [preprocess_image(item, is_bytes=is_bytes) for item in items]
+    items = list(items)
+    width, height = target_size
+    batch = np.empty((len(items), height, width, channels), dtype=np.uint8)
+    executor = executor or _executor()
+
+    valid = np.fromiter(
+        executor.map(lambda i: _load_into(items[i], is_bytes, batch[i], interpolation), range(len(items))),
+        dtype=bool, count=len(items))
+    batch[~valid] = 0
+    return batch, valid
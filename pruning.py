@@ -0,0 +1,162 @@
+# pruning.py - Structured channel pruning for the CNN members (ResNet50, EfficientNetV2-S)
+# Removes low-importance filters and rebuilds a physically smaller dense model (not a mask).
+
+import re
+import time
+
+import numpy as np
+import tensorflow as tf
+
+PRUNE_RATIO = 0.3        # fraction of prunable channels removed per group
+CHANNEL_MULTIPLE = 8     # keep channel counts CPU-kernel friendly
+MIN_CHANNELS = 8
+
+
+# ────────────────────────────────────────────────────────────────
+# Which channels can go
+# ────────────────────────────────────────────────────────────────
+def prunable_groups(model):
+    """
+    Finds (conv, bn, next_conv) triples whose inner channels can be removed without
+    touching residual additions or squeeze-excite branches:
+      - ResNet50 bottlenecks:   convS_blockB_1_conv → _1_bn → _2_conv
+                                convS_blockB_2_conv → _2_bn → _3_conv
+      - EfficientNetV2 fused-MBConv: blockNx_expand_conv → _expand_bn → _project_conv
+                                (only blocks without depthwise conv / SE)
+    Block outputs (feeding an Add) are never pruned, so skip connections keep their width.
+    Returns: list of (conv_name, bn_name, next_conv_name)
+    """
+    names = {layer.name for layer in model.layers}
+    groups = []
+    for name in sorted(names):
+        resnet = re.match(r'^(conv\d_block\d+)_([12])_conv$', name)
+        fused = re.match(r'^(block\d+[a-z]_)expand_conv$', name)
+        if resnet:
+            block, idx = resnet.group(1), int(resnet.group(2))
+            bn, next_conv = f'{block}_{idx}_bn', f'{block}_{idx + 1}_conv'
+        elif fused:
+            prefix = fused.group(1)
+            if prefix + 'dwconv2' in names or prefix + 'se_reduce' in names:
+                continue  # MBConv block: depthwise + SE share these channels
+            bn, next_conv = prefix + 'expand_bn', prefix + 'project_conv'
+        else:
+            continue
+        if bn in names and next_conv in names:
+            groups.append((name, bn, next_conv))
+    return groups
+
+
+def channel_importance(conv_layer, bn_layer):
+    """L1 norm of each output filter, scaled by its BatchNorm gain |gamma| / sqrt(var + eps)."""
+    kernel = conv_layer.get_weights()[0]                      # (kh, kw, in, out)
+    l1 = np.abs(kernel).sum(axis=(0, 1, 2))
+    gamma, _, _, moving_var = bn_layer.get_weights()
+    return l1 * np.abs(gamma) / np.sqrt(moving_var + bn_layer.epsilon)
+
+
+def select_channels(model, prune_ratio=PRUNE_RATIO, groups=None):
+    """Returns {conv_name: sorted indices of the output channels to keep}."""
+    keep = {}
+    for conv_name, bn_name, _ in groups or prunable_groups(model):
+        scores = channel_importance(model.get_layer(conv_name), model.get_layer(bn_name))
+        n_keep = int(round(len(scores) * (1 - prune_ratio) / CHANNEL_MULTIPLE)) * CHANNEL_MULTIPLE
+        n_keep = min(len(scores), max(MIN_CHANNELS, n_keep))
+        keep[conv_name] = np.sort(np.argsort(scores)[::-1][:n_keep])
+    return keep
+
+
+# ────────────────────────────────────────────────────────────────
+# Rebuild a smaller dense model
+# ────────────────────────────────────────────────────────────────
+def prune_model(model, prune_ratio=PRUNE_RATIO):
+    """
+    Structured pruning: rebuilds `model` with fewer filters in every prunable group and
+    copies the surviving weights (conv outputs, BN statistics, next conv inputs).
+    Returns: (pruned_model, {conv_name: (channels_before, channels_after)})
+    """
+    groups = prunable_groups(model)
+    keep = select_channels(model, prune_ratio, groups)
+    bn_keep = {bn: keep[conv] for conv, bn, _ in groups}
+    in_keep = {next_conv: keep[conv] for conv, _, next_conv in groups}
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        if layer.name in keep:
+            config['filters'] = len(keep[layer.name])
+        return layer.__class__.from_config(config)
+
+    pruned = tf.keras.models.clone_model(model, clone_function=clone_layer)
+
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue
+        if layer.name in in_keep:  # drop input channels of the consuming conv
+            weights[0] = weights[0][:, :, in_keep[layer.name], :]
+        if layer.name in keep:     # drop output filters (+ bias)
+            weights = [weights[0][..., keep[layer.name]]] + [w[keep[layer.name]] for w in weights[1:]]
+        if layer.name in bn_keep:  # gamma, beta, moving mean, moving variance
+            weights = [w[bn_keep[layer.name]] for w in weights]
+        pruned.get_layer(layer.name).set_weights(weights)
+
+    summary = {conv: (model.get_layer(conv).filters, len(idx)) for conv, idx in keep.items()}
+    return pruned, summary
+
+
+# ────────────────────────────────────────────────────────────────
+# Cost / quality measurements
+# ────────────────────────────────────────────────────────────────
+def count_flops(model):
+    """Forward FLOPs (2 × multiply-accumulates) of Conv2D / DepthwiseConv2D / Dense layers, batch 1."""
+    macs = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.DepthwiseConv2D):
+            _, h, w, c = layer.output.shape
+            kh, kw = layer.kernel_size
+            macs += h * w * c * kh * kw
+        elif isinstance(layer, tf.keras.layers.Conv2D):
+            _, h, w, c_out = layer.output.shape
+            kh, kw = layer.kernel_size
+            c_in = layer.input.shape[-1] // layer.groups
+            macs += h * w * c_out * kh * kw * c_in
+        elif isinstance(layer, tf.keras.layers.Dense):
+            macs += layer.input.shape[-1] * layer.units
+    return 2 * macs
+
+
+def cpu_latency_ms(model, runs=20):
+    """Median single-image forward latency (ms)."""
+    x = tf.zeros((1,) + tuple(model.input_shape[1:]), dtype=model.inputs[0].dtype)
+    fn = tf.function(lambda t: model(t, training=False))
+    fn(x)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(x)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def model_stats(model, test_ds=None):
+    """Params, FLOPs, CPU latency and (if test_ds given) test recall."""
+    stats = {
+        'params': model.count_params(),
+        'gflops': count_flops(model) / 1e9,
+        'latency_ms': cpu_latency_ms(model),
+        'recall': None,
+    }
+    if test_ds is not None:
+        results = model.evaluate(test_ds, verbose=0, return_dict=True)
+        stats['recall'] = next((v for k, v in results.items() if k.startswith('recall')), None)
+    return stats
+
+
+def print_pruning_report(name, before, after):
+    print(f"\n=== Pruning report: {name} ===")
+    print(f"{'':<14}{'before':>14}{'after':>14}{'change':>10}")
+    for key, fmt in [('params', '{:,.0f}'), ('gflops', '{:.3f}'), ('latency_ms', '{:.1f}'), ('recall', '{:.4f}')]:
+        b, a = before[key], after[key]
+        if b is None or a is None:
+            continue
+        change = f"{(a - b) / b * 100:+.1f}%" if b else ''
+        print(f"{key:<14}{fmt.format(b):>14}{fmt.format(a):>14}{change:>10}")
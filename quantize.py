@@ -0,0 +1,199 @@
+# quantize.py - Post-training quantization of the ensemble members to TFLite (int8 / float16)
+# Serve the artifacts with PneumoniaEnsemble(inference_mode='tflite').
+#
+# Usage:
+#   python quantize.py                       → export int8 (float16 fallback) + float16 for every member
+#   python quantize.py --report              → accuracy / recall / latency / size per member and level
+#   python quantize.py --calibration 300     → number of training images used for int8 calibration
+#   python quantize.py --grayscale           → the 1-channel '_gray' members (tflite/<name>_gray_<level>.tflite)
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from models import (MEMBER_BUILDERS, DEFAULT_MEMBERS, DEFAULT_TFLITE_DIR, TFLITE_QUANTIZATIONS,
+                    load_member, member_weight_path, tflite_path, fast_weights_path, TFLiteMember)
+
+IMG_SIZE = (224, 224)
+DATASET_NAME = "hf-vision/chest-xray-pneumonia"
+REPORT_PATH = 'quantization_report.md'
+
+
+# ────────────────────────────────────────────────────────────────
+# Data (same preprocessing as inference: RGB / gray → INTER_AREA resize → uint8; members normalize in-graph)
+# ────────────────────────────────────────────────────────────────
+def _prepare_pil(pil_img, channels=3):
+    img = cv2.resize(np.array(pil_img.convert('L' if channels == 1 else 'RGB')), IMG_SIZE,
+                     interpolation=cv2.INTER_AREA)
+    return img.reshape(IMG_SIZE + (channels,))
+
+
+def load_split(split, limit=None, seed=0, channels=3):
+    """Returns (images (N, 224, 224, channels) uint8, labels (N,)) from the HF dataset split."""
+    from datasets import load_dataset  # only needed for calibration / reporting
+
+    ds = load_dataset(DATASET_NAME, split=split)
+    if limit is not None and limit < len(ds):
+        ds = ds.shuffle(seed=seed).select(range(limit))
+    images = np.stack([_prepare_pil(example['image'], channels) for example in ds])
+    labels = np.array(ds['label'])
+    return images, labels
+
+
+def representative_dataset(calibration_images):
+    """Calibration generator for the int8 converter (one image per step)."""
+    def gen():
+        for img in calibration_images:
+            yield [img[np.newaxis]]
+    return gen
+
+
+# ────────────────────────────────────────────────────────────────
+# Export
+# ────────────────────────────────────────────────────────────────
+def members_to_quantize(channels=3):
+    """Default ensemble members, plus optional ones (the distilled student) once trained."""
+    optional = [name for name in MEMBER_BUILDERS if name not in DEFAULT_MEMBERS]
+    return DEFAULT_MEMBERS + [name for name in optional
+                              if os.path.exists(member_weight_path(name, channels))
+                              or os.path.isdir(fast_weights_path(member_weight_path(name, channels)))]
+
+
+def convert_to_tflite(model, quantization, calibration_images=None):
+    """
+    Converts a Keras member to a TFLite flatbuffer.
+    int8: full-integer kernels calibrated on `calibration_images` (uint8 pixels in, float32 probabilities out).
+    float16: float16 weights, float32 compute.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == 'int8':
+        if calibration_images is None:
+            raise ValueError("int8 quantization needs calibration images")
+        converter.representative_dataset = representative_dataset(calibration_images)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        raise ValueError(f"quantization must be one of {TFLITE_QUANTIZATIONS}, got '{quantization}'")
+
+    return converter.convert()
+
+
+def export_member(name, model, calibration_images, tflite_dir=DEFAULT_TFLITE_DIR, channels=3):
+    """
+    Writes '<name>_int8.tflite' and '<name>_float16.tflite'.
+    If int8 conversion fails (e.g. ops without int8 kernels), only float16 is written and
+    the ensemble's int8 backend falls back to it.
+    Returns: {quantization: path}
+    """
+    os.makedirs(tflite_dir, exist_ok=True)
+    written = {}
+    for quant in TFLITE_QUANTIZATIONS:
+        try:
+            flatbuffer = convert_to_tflite(model, quant, calibration_images)
+        except Exception as e:
+            print(f"{name}: {quant} conversion failed ({e})")
+            continue
+        path = tflite_path(name, quant, tflite_dir, channels)
+        with open(path, 'wb') as f:
+            f.write(flatbuffer)
+        written[quant] = path
+        print(f"{name}: {quant} → {path} ({len(flatbuffer) / 1e6:.1f} MB)")
+
+    if not written:
+        print(f"{name}: no TFLite artifact written — the tflite backend will skip this member")
+    elif 'int8' not in written:
+        print(f"{name}: int8 unavailable — the int8 backend falls back to float16")
+    return written
+
+
+# ────────────────────────────────────────────────────────────────
+# Accuracy / latency report on the test split
+# ────────────────────────────────────────────────────────────────
+def evaluate(run_fn, images, labels, batch_size=32, latency_runs=30):
+    """Accuracy, pneumonia recall and single-image latency (median ms) of one predictor."""
+    probs = np.concatenate([run_fn(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+    preds = probs.argmax(axis=1)
+    positives = labels > 0
+    recall = float((preds[positives] > 0).mean()) if positives.any() else float('nan')
+
+    single = images[:1]
+    run_fn(single)  # warmup
+    times = []
+    for _ in range(latency_runs):
+        start = time.perf_counter()
+        run_fn(single)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {'accuracy': float((preds == labels).mean()), 'recall': recall, 'latency_ms': float(np.median(times))}
+
+
+def build_report(test_limit=None, tflite_dir=DEFAULT_TFLITE_DIR, report_path=REPORT_PATH, channels=3):
+    """Compares float32 Keras vs float16 vs int8 per member on the test split, writes a Markdown table."""
+    images, labels = load_split('test', limit=test_limit, channels=channels)
+    rows = []
+    for name in members_to_quantize(channels):
+        try:
+            model, _, source = load_member(name, channels=channels)
+        except FileNotFoundError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        if model is None:
+            continue
+        size_mb = sum(w.size * w.dtype.itemsize for w in model.get_weights()) / 1e6
+        metrics = evaluate(lambda batch: model.predict(batch, verbose=0), images, labels)
+        rows.append((name, 'float32 (keras)', size_mb, metrics))
+
+        for quant in TFLITE_QUANTIZATIONS:
+            path = tflite_path(name, quant, tflite_dir, channels)
+            if not os.path.isfile(path):
+                continue
+            member = TFLiteMember(path)
+            rows.append((name, quant, os.path.getsize(path) / 1e6, evaluate(member, images, labels)))
+
+    lines = [
+        f"# Quantization report ({len(labels)} test images)",
+        "",
+        "| member | precision | size MB | accuracy | recall | latency ms (1 img) |",
+        "|---|---|---|---|---|---|",
+    ]
+    for name, precision, size_mb, m in rows:
+        lines.append(f"| {name} | {precision} | {size_mb:.1f} | {m['accuracy']:.4f} | "
+                     f"{m['recall']:.4f} | {m['latency_ms']:.1f} |")
+    report = "\n".join(lines) + "\n"
+
+    with open(report_path, 'w') as f:
+        f.write(report)
+    print(report)
+    print(f"Report written to {report_path}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quantize ensemble members to TFLite')
+    parser.add_argument('--report', action='store_true', help='only build the comparison report')
+    parser.add_argument('--calibration', type=int, default=200, help='training images for int8 calibration')
+    parser.add_argument('--test-limit', type=int, default=None, help='cap test images in the report')
+    parser.add_argument('--out', default=DEFAULT_TFLITE_DIR)
+    parser.add_argument('--grayscale', action='store_true', help='1-channel members (train.py INPUT_CHANNELS = 1)')
+    args = parser.parse_args()
+    channels = 1 if args.grayscale else 3
+
+    if not args.report:
+        calibration_images, _ = load_split('train', limit=args.calibration, channels=channels)
+        for name in members_to_quantize(channels):
+            try:
+                model, _, source = load_member(name, channels=channels)
+            except FileNotFoundError as e:
+                print(f"Skipping {name}: {e}")  # an untrained artifact would be served as-is
+                continue
+            if model is None:
+                continue
+            export_member(name, model, calibration_images, args.out, channels)
+
+    build_report(test_limit=args.test_limit, tflite_dir=args.out, channels=channels)
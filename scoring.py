@@ -46,13 +46,13 @@ def calculate_final_score(xray_probs, symptom_score, past_score, config=CONFIG):
     """
     Conditional final pneumonia risk score.
     Args:
-        xray_probs (numpy array): [Normal, Bacterial, Viral].
+        xray_probs (numpy array): [Normal, Pneumonia] or [Normal, Bacterial, Viral].
         symptom_score (float): From symptoms.
         past_score (float): From past.
         config (dict): Weights/thresholds.
     Returns: (float, str) - Score (0-100), explanation.
     """
-    pneumonia_prob = xray_probs[1] + xray_probs[2]  # Positive classes
+    pneumonia_prob = float(sum(xray_probs[1:]))  # Positive classes (Pneumonia, or Bacterial + Viral)
     if pneumonia_prob >= config['high_conf_thresh']:
         return pneumonia_prob * 100, "High confidence from X-ray alone."
     elif pneumonia_prob <= config['low_conf_thresh']:
@@ -0,0 +1,229 @@
+# serve.py - Prefork production launcher for the API (N uvicorn workers on one shared socket)
+# The parent imports the heavy modules once, pulls the weight artifacts into the page cache,
+# freezes the GC and forks. Workers share those pages copy-on-write / via the page cache.
+#
+# TF is not fork-safe once its runtime is initialised, so the parent never runs a TF op:
+# each worker builds its own runtime (sized by configure_threading, slot = worker index) and
+# maps the weight files itself. What is shared between workers:
+#   - imported Python modules (tensorflow, numpy, cv2, fastapi…) — forked COW, kept clean by gc.freeze()
+#   - ENSEMBLE_INFERENCE_MODE=tflite: the .tflite flatbuffers, memory-mapped by every interpreter
+#   - fast '.weights/' blobs: page cache only (set_weights copies them into private TF variables)
+# Only the TFLite members actually share one copy of the weights, so the launcher serves
+# ENSEMBLE_INFERENCE_MODE=tflite unless another mode is set explicitly ('compiled' / 'keras'
+# cost a private copy of every member per worker). Each interpreter runs on the worker's
+# intra-op thread budget (configure_threading → get_ensemble).
+# Not shared: Grad-CAM needs gradients, which TFLite cannot give, so every worker builds its
+# own float32 Keras copy of the Grad-CAM member at startup — ResNet50, ~95 MB of private TF
+# variables per worker (set_weights copies out of the mapped '.weights/' blob). Budget for it
+# in the per-worker memory, or serve ENSEMBLE_MEMBERS=student (Grad-CAM on the ~10 MB student).
+#
+# Usage:
+#   python quantize.py                                       → write the .tflite artifacts first
+#   python serve.py --workers 4 --port 8000
+#   python serve.py --memory-report <pid> [<pid> ...]      → USS / PSS / RSS of running processes
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import numpy as np  # noqa: F401  (imported pre-fork so workers share it)
+import tensorflow as tf  # noqa: F401  (import only — no ops run in the parent)
+import cv2  # noqa: F401
+import uvicorn
+from models import (DEFAULT_MEMBERS, DEFAULT_TFLITE_DIR, TFLITE_QUANTIZATIONS, fast_weights_path,
+                    member_weight_path, tflite_path)
+
+PAGE_CACHE_CHUNK = 1 << 20
+
+
+# ────────────────────────────────────────────────────────────────
+# Shared weight files
+# ────────────────────────────────────────────────────────────────
+def shared_weight_files(inference_mode, members=None, tflite_dir=DEFAULT_TFLITE_DIR, channels=3):
+    """Weight artifacts the workers will map for `inference_mode` (existing files only)."""
+    paths = []
+    for name in members or DEFAULT_MEMBERS:
+        if inference_mode == 'tflite':
+            paths += [tflite_path(name, quant, tflite_dir, channels) for quant in TFLITE_QUANTIZATIONS]
+        paths.append(os.path.join(fast_weights_path(member_weight_path(name, channels)), 'weights.bin'))
+        paths.append(member_weight_path(name, channels))
+    return [p for p in paths if os.path.isfile(p)]
+
+
+def warm_page_cache(paths):
+    """Reads each file once so every worker maps already-cached pages. Returns bytes read."""
+    total = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(PAGE_CACHE_CHUNK)
+                if not chunk:
+                    break
+                total += len(chunk)
+    return total
+
+
+# ────────────────────────────────────────────────────────────────
+# Memory report (Linux /proc)
+# ────────────────────────────────────────────────────────────────
+def process_memory(pid):
+    """
+    Returns {'rss', 'pss', 'uss', 'shared'} in MB for one process.
+    USS (private pages) is what each extra worker really costs; PSS splits shared pages fairly.
+    """
+    fields = {}
+    rollup = f'/proc/{pid}/smaps_rollup'
+    path = rollup if os.path.exists(rollup) else f'/proc/{pid}/smaps'
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                key = parts[0].rstrip(':')
+                fields[key] = fields.get(key, 0) + int(parts[1])
+    uss = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    shared = fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    return {
+        'rss': fields.get('Rss', 0) / 1024,
+        'pss': fields.get('Pss', 0) / 1024,
+        'uss': uss / 1024,
+        'shared': shared / 1024,
+    }
+
+
+def print_memory_report(pids, labels=None):
+    labels = labels or {pid: str(pid) for pid in pids}
+    print(f"\n{'process':<14}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'shared MB':>11}")
+    totals = {'rss': 0.0, 'pss': 0.0, 'uss': 0.0}
+    for pid in pids:
+        try:
+            mem = process_memory(pid)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+        for key in totals:
+            totals[key] += mem[key]
+        print(f"{labels[pid]:<14}{pid:>8}{mem['rss']:>10.1f}{mem['pss']:>10.1f}{mem['uss']:>10.1f}{mem['shared']:>11.1f}")
+    # PSS sums to the real footprint; RSS double-counts the shared pages
+    print(f"{'total':<14}{'':>8}{totals['rss']:>10.1f}{totals['pss']:>10.1f}{totals['uss']:>10.1f}")
+
+
+# ────────────────────────────────────────────────────────────────
+# Prefork supervisor
+# ────────────────────────────────────────────────────────────────
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index, num_workers, sock, args):
+    """Child process: claim slot `index` (threading / pinning in main.py), then serve the shared socket."""
+    os.environ['WORKER_INDEX'] = str(index)
+    os.environ['WEB_CONCURRENCY'] = str(num_workers)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config('main:app', log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+    os._exit(0)
+
+
+def fork_worker(index, num_workers, sock, args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(index, num_workers, sock, args)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def supervise(args):
+    # Inherited by the forked workers (pipeline.py reads it there)
+    inference_mode = os.environ.setdefault('ENSEMBLE_INFERENCE_MODE', 'tflite')
+    channels = int(os.getenv('ENSEMBLE_INPUT_CHANNELS', '3'))
+    if inference_mode == 'tflite':
+        if not any(os.path.isfile(tflite_path(name, quant, DEFAULT_TFLITE_DIR, channels))
+                   for name in DEFAULT_MEMBERS for quant in TFLITE_QUANTIZATIONS):
+            sys.exit(f"No TFLite artifacts in '{DEFAULT_TFLITE_DIR}': run quantize.py first, or set "
+                     f"ENSEMBLE_INFERENCE_MODE=compiled (each worker then holds its own copy of the weights)")
+    else:
+        print(f"Warning: ENSEMBLE_INFERENCE_MODE={inference_mode} — every worker keeps a private copy "
+              f"of the weights; only 'tflite' shares them")
+    print("Note: each worker also holds a private float32 copy of the Grad-CAM member (not shared)")
+    files = shared_weight_files(inference_mode, channels=channels)
+    start = time.perf_counter()
+    cached = warm_page_cache(files)
+    print(f"Page cache: {len(files)} weight files, {cached / 1e6:.0f} MB in {time.perf_counter() - start:.1f}s "
+          f"(mode: {inference_mode})")
+
+    sock = bind_socket(args.host, args.port)
+    gc.collect()
+    gc.freeze()  # keep pre-fork objects out of GC passes so their pages stay shared
+
+    workers = {}  # pid → slot
+    for index in range(args.workers):
+        workers[fork_worker(index, args.workers, sock, args)] = index
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers: {sorted(workers)}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def report(*_):
+        print_memory_report([os.getpid()] + sorted(workers),
+                            {os.getpid(): 'parent', **{pid: f'worker-{slot}' for pid, slot in workers.items()}})
+
+    signal.signal(signal.SIGUSR1, report)  # kill -USR1 <parent pid> prints the report on demand
+
+    report_at = time.monotonic() + args.report_after if args.report_after > 0 else None
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if report_at is not None and time.monotonic() >= report_at:
+                report()
+                report_at = None
+            time.sleep(0.5)
+            continue
+        slot = workers.pop(pid)
+        if not stopping:
+            print(f"Worker {slot} (pid {pid}) exited with status {status} — restarting")
+            workers[fork_worker(slot, args.workers, sock, args)] = slot
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Prefork launcher for the pneumonia API')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', '2')))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--keep-alive', type=int, default=5)
+    parser.add_argument('--report-after', type=float, default=120.0,
+                        help='print the per-worker memory report after N seconds (0 = only on SIGUSR1)')
+    parser.add_argument('--memory-report', nargs='+', type=int, metavar='PID',
+                        help='print USS / PSS / RSS for running processes and exit')
+    args = parser.parse_args()
+
+    if args.memory_report:
+        print_memory_report(args.memory_report)
+        sys.exit(0)
+    supervise(args)
@@ -0,0 +1,245 @@
+# test_admission.py - Unit tests for admission.py and its HTTP mapping (run with: python -m pytest -q)
+
+import asyncio
+import threading
+
+import pytest
+
+from admission import ADMISSION_CONFIG, AdmissionController, DeadlineExceeded, Overloaded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def hold(controller, release, deadline_s=5.0):
+    """Admitted request that keeps its slot until `release` (asyncio.Event) is set."""
+    async with controller.admit(controller.deadline(deadline_s)):
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+# ────────────────────────────────────────────────────────────────
+# Overload and deadlines
+# ────────────────────────────────────────────────────────────────
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(controller, release))
+        queued = asyncio.create_task(hold(controller, release))
+        await settle()
+        assert (controller.active, controller.waiting) == (1, 1)
+        with pytest.raises(Overloaded) as rejected:
+            async with controller.admit(controller.deadline()):
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+        controller.shutdown()
+        return rejected.value, controller.stats()
+
+    error, stats = run(scenario())
+    assert error.retry_after >= 1
+    assert (stats['rejected'], stats['admitted'], stats['completed']) == (1, 2, 2)
+
+
+def test_retry_after_scales_with_backlog_and_service_time():
+    controller = AdmissionController(max_concurrent=2)
+    assert controller.retry_after() == 1                 # nothing measured, nothing queued
+    controller.service_ms, controller.active, controller.waiting = 2000.0, 2, 3
+    assert controller.retry_after() == 5                 # ceil(5 requests × 2 s / 2 slots)
+    controller.shutdown()
+
+
+def test_deadline_expiring_in_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=4)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(controller, release))
+        await settle()
+        with pytest.raises(DeadlineExceeded) as expired:
+            async with controller.admit(controller.deadline(0.05)):
+                pass
+        release.set()
+        await running
+        controller.shutdown()
+        return expired.value, controller.stats()
+
+    error, stats = run(scenario())
+    assert error.stage == 'queued' and error.retry_after >= 1
+    assert stats['deadline_dropped'] == 1 and stats['queue_length'] == 0
+
+
+def test_budget_below_typical_service_time_is_dropped_after_admission():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1)
+        controller.service_ms = 1000.0
+        with pytest.raises(DeadlineExceeded) as short:
+            async with controller.admit(controller.deadline(0.1)):
+                pass
+        async with controller.admit(controller.deadline(5)):
+            pass                                          # the slot was handed back
+        controller.shutdown()
+        return short.value
+
+    assert run(scenario()).stage == 'insufficient time'
+
+
+def test_deadline_expiring_while_running():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1)
+        deadline = controller.deadline(0.05)
+        with pytest.raises(DeadlineExceeded) as expired:
+            async with controller.admit(deadline):
+                await controller.within(deadline, asyncio.sleep(1))
+        controller.shutdown()
+        return expired.value
+
+    assert run(scenario()).stage == 'running'
+
+
+# ────────────────────────────────────────────────────────────────
+# Slots held by abandoned pool work
+# ────────────────────────────────────────────────────────────────
+def test_slot_is_held_until_abandoned_work_finishes():
+    finish = threading.Event()
+
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1)
+        deadline = controller.deadline(0.05)
+        with pytest.raises(DeadlineExceeded):
+            async with controller.admit(deadline):
+                await controller.within(deadline, controller.run(finish.wait, 5))
+        assert controller.stats()['abandoned'] == 1
+
+        # The thread is still running, so the only slot is still taken
+        with pytest.raises(DeadlineExceeded) as blocked:
+            async with controller.admit(controller.deadline(0.05)):
+                pass
+        finish.set()
+        async with controller.admit(controller.deadline(2)):
+            abandoned_after = controller.stats()['abandoned']
+        controller.shutdown()
+        return blocked.value, abandoned_after
+
+    try:
+        blocked, abandoned_after = run(scenario())
+    finally:
+        finish.set()
+    assert blocked.stage == 'queued' and abandoned_after == 0
+
+
+def test_finished_work_releases_the_slot_immediately():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1)
+        async with controller.admit(controller.deadline()):
+            assert await controller.run(sum, [1, 2, 3]) == 6
+        stats = controller.stats()
+        async with controller.admit(controller.deadline(0.05)):
+            pass
+        controller.shutdown()
+        return stats
+
+    stats = run(scenario())
+    assert (stats['abandoned'], stats['active'], stats['completed']) == (0, 0, 1)
+
+
+# ────────────────────────────────────────────────────────────────
+# Bulk items
+# ────────────────────────────────────────────────────────────────
+def test_bulk_items_wait_outside_the_queue_instead_of_being_rejected():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=0, bulk_queue=1)
+        release = asyncio.Event()
+
+        async def item():
+            async with controller.admit_bulk(timeout_s=5):
+                await release.wait()
+
+        items = [asyncio.create_task(item()) for _ in range(4)]
+        await settle()
+        during = controller.stats()
+        release.set()
+        await asyncio.gather(*items)
+        controller.shutdown()
+        return during, controller.stats()
+
+    during, after = run(scenario())
+    # One runs, one takes the bulk share of the queue (despite max_queue=0), two wait outside it
+    assert (during['active'], during['queue_length'], during['bulk_waiting']) == (1, 1, 2)
+    assert (after['completed'], after['rejected'], after['bulk_waiting']) == (4, 0, 0)
+
+
+def test_bulk_deadline_starts_once_the_item_gets_in():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, bulk_queue=0)  # gate: one bulk item at a time
+        release = asyncio.Event()
+
+        async def item(timeout_s, hold_slot):
+            async with controller.admit_bulk(timeout_s=timeout_s) as deadline:
+                remaining = controller.remaining(deadline)
+                if hold_slot:
+                    await release.wait()
+                return remaining
+
+        first = asyncio.create_task(item(5, hold_slot=True))
+        await settle()
+        later = asyncio.create_task(item(5, hold_slot=False))
+        await asyncio.sleep(0.3)
+        assert controller.stats()['bulk_waiting'] == 1
+        release.set()
+        await first
+        remaining = await later
+        controller.shutdown()
+        return remaining
+
+    # The 0.3 s spent at the gate did not come out of the budget
+    assert 4.9 < run(scenario()) <= 5
+
+
+# ────────────────────────────────────────────────────────────────
+# Configuration
+# ────────────────────────────────────────────────────────────────
+def test_concurrency_defaults_to_the_batch_size(monkeypatch):
+    monkeypatch.setitem(ADMISSION_CONFIG, 'max_concurrent', None)
+    controller = AdmissionController.from_config(batch_size=16)
+    assert controller.max_concurrent == 16
+    controller.shutdown()
+
+    monkeypatch.setitem(ADMISSION_CONFIG, 'max_concurrent', 4)
+    controller = AdmissionController.from_config(batch_size=16)
+    assert controller.max_concurrent == 4
+    controller.shutdown()
+
+
+# ────────────────────────────────────────────────────────────────
+# HTTP mapping (imports the app, which loads TensorFlow)
+# ────────────────────────────────────────────────────────────────
+@pytest.fixture
+def client(monkeypatch):
+    main = pytest.importorskip('main')
+    from fastapi.testclient import TestClient
+    monkeypatch.setitem(main.READINESS, 'ready', True)
+    return main, TestClient(main.app)
+
+
+@pytest.mark.parametrize('error, status_code, retry_after', [
+    (Overloaded(3), 429, '3'),
+    (DeadlineExceeded('queued', 7), 503, '7'),
+    (DeadlineExceeded('running'), 503, '1'),
+])
+def test_backpressure_maps_to_status_and_retry_after(client, monkeypatch, error, status_code, retry_after):
+    main, http = client
+
+    async def rejected(deadline, fn, *args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(main, '_admitted', rejected)
+    response = http.post('/analyze-xray', files={'image': ('xray.png', b'\x89PNG', 'image/png')})
+    assert response.status_code == status_code
+    assert response.headers['Retry-After'] == retry_after
+    assert response.json()['detail'] == str(error)
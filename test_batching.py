@@ -0,0 +1,143 @@
+# test_batching.py - Unit tests for batching.MicroBatcher (run with: python -m pytest -q)
+
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+
+
+def rows(*ids):
+    """(n, 1) request array whose rows carry their ids, so results can be traced back."""
+    return np.array(ids, dtype=np.float32).reshape(-1, 1)
+
+
+class Recorder:
+    """predict_fn stand-in: records every batch and returns its rows × 10."""
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, batch):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        self.batches.append(batch[:, 0].tolist())
+        return batch * 10
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_requests_share_one_batch():
+    predict = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(predict, max_batch_size=8, max_wait_ms=50)
+        results = await asyncio.gather(batcher.submit(rows(1)), batcher.submit(rows(2, 3)), batcher.submit(rows(4)))
+        await batcher.stop()
+        return results, batcher.stats()
+
+    results, stats = run(scenario())
+    assert predict.batches == [[1, 2, 3, 4]]
+    assert [r[:, 0].tolist() for r in results] == [[10], [20, 30], [40]]
+    assert stats['batches_run'] == 1 and stats['items_run'] == 3 and stats['batch_size_histogram'] == {'4': 1}
+
+
+def test_full_batch_dispatches_without_waiting():
+    predict = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(predict, max_batch_size=2, max_wait_ms=10_000)
+        result = await asyncio.wait_for(asyncio.gather(batcher.submit(rows(1)), batcher.submit(rows(2))), 2)
+        await batcher.stop()
+        return result
+
+    run(scenario())
+    assert predict.batches == [[1, 2]]
+
+
+def test_request_that_does_not_fit_is_carried_into_the_next_batch():
+    predict = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(batcher.submit(rows(1, 2, 3)), batcher.submit(rows(4, 5)),
+                                       batcher.submit(rows(6)))
+        await batcher.stop()
+        return results
+
+    results = run(scenario())
+    # Requests are never split: (4, 5) would overflow the first batch, so it leads the second
+    assert predict.batches == [[1, 2, 3], [4, 5, 6]]
+    assert [r[:, 0].tolist() for r in results] == [[10, 20, 30], [40, 50], [60]]
+
+
+def test_cancelled_request_is_dropped_from_its_batch():
+    gate = threading.Event()
+    predict = Recorder(gate)
+
+    async def scenario():
+        batcher = MicroBatcher(predict, max_batch_size=1, max_wait_ms=1)
+        first = asyncio.create_task(batcher.submit(rows(1)))     # occupies predict_fn until the gate opens
+        await asyncio.sleep(0.05)
+        cancelled = asyncio.create_task(batcher.submit(rows(2)))
+        kept = asyncio.create_task(batcher.submit(rows(3)))
+        await asyncio.sleep(0.05)
+        cancelled.cancel()
+        gate.set()
+        results = await asyncio.gather(first, kept)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await batcher.stop()
+        return results
+
+    results = run(scenario())
+    assert predict.batches == [[1], [3]]
+    assert [r[:, 0].tolist() for r in results] == [[10], [30]]
+
+
+def test_predict_error_fails_every_request_in_the_batch():
+    def failing(batch):
+        raise RuntimeError("model exploded")
+
+    async def scenario():
+        batcher = MicroBatcher(failing, max_batch_size=4, max_wait_ms=20)
+        outcomes = await asyncio.gather(batcher.submit(rows(1)), batcher.submit(rows(2)), return_exceptions=True)
+        await batcher.stop()
+        return outcomes
+
+    outcomes = run(scenario())
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+
+
+def test_tuple_outputs_are_sliced_per_request():
+    async def scenario():
+        batcher = MicroBatcher(lambda batch: (batch * 10, [f'row{int(v)}' for v in batch[:, 0]]),
+                               max_batch_size=4, max_wait_ms=20)
+        results = await asyncio.gather(batcher.submit(rows(1, 2)), batcher.submit(rows(3)))
+        await batcher.stop()
+        return results
+
+    (probs_a, names_a), (probs_b, names_b) = run(scenario())
+    assert probs_a[:, 0].tolist() == [10, 20] and names_a == ['row1', 'row2']
+    assert probs_b[:, 0].tolist() == [30] and names_b == ['row3']
+
+
+def test_stop_fails_running_and_waiting_requests():
+    gate = threading.Event()
+
+    async def scenario():
+        batcher = MicroBatcher(Recorder(gate), max_batch_size=1, max_wait_ms=1)
+        running = asyncio.create_task(batcher.submit(rows(1)))
+        await asyncio.sleep(0.05)
+        waiting = asyncio.create_task(batcher.submit(rows(2)))
+        await asyncio.sleep(0.05)
+        await batcher.stop()
+        gate.set()
+        return await asyncio.wait_for(asyncio.gather(running, waiting, return_exceptions=True), 2)
+
+    outcomes = run(scenario())
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
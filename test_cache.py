@@ -0,0 +1,120 @@
+# test_cache.py - Unit tests for cache.py (run with: python -m pytest -q)
+
+import json
+import os
+
+from cache import ResultCache, cache_key
+
+
+def findings(tag, pad=0):
+    return {'tag': tag, 'pad': 'x' * pad}
+
+
+def size(entry):
+    """Serialised size, the unit the in-process budget is counted in."""
+    return len(json.dumps(entry).encode('utf-8'))
+
+
+def disk_files(directory):
+    return sorted(name for _, _, names in os.walk(directory) for name in names if name.endswith('.json'))
+
+
+# ────────────────────────────────────────────────────────────────
+# Keys
+# ────────────────────────────────────────────────────────────────
+def test_key_depends_on_bytes_and_fingerprint():
+    fingerprint = {'mode': 'keras', 'members': ['resnet50']}
+    key = cache_key(b'image', fingerprint)
+    assert key == cache_key(b'image', dict(reversed(list(fingerprint.items()))))  # key order is irrelevant
+    assert key != cache_key(b'other image', fingerprint)
+    assert key != cache_key(b'image', {**fingerprint, 'mode': 'tflite'})
+
+
+# ────────────────────────────────────────────────────────────────
+# In-process LRU
+# ────────────────────────────────────────────────────────────────
+def test_least_recently_used_entry_is_evicted_by_bytes():
+    entry = findings('a', pad=100)
+    cache = ResultCache(max_bytes=2 * size(entry) + 10)
+    cache.put('a', findings('a', pad=100))
+    cache.put('b', findings('b', pad=100))
+    assert cache.get('a')['tag'] == 'a'          # 'a' is now the most recently used
+    cache.put('c', findings('c', pad=100))
+
+    assert cache.get('b') is None
+    assert cache.get('a')['tag'] == 'a' and cache.get('c')['tag'] == 'c'
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['entries'] == 2
+    assert stats['memory_bytes'] == 2 * size(entry)
+
+
+def test_replacing_a_key_does_not_double_count():
+    cache = ResultCache(max_bytes=10_000)
+    cache.put('a', findings('a', pad=100))
+    cache.put('a', findings('a', pad=10))
+    assert cache.stats()['memory_bytes'] == size(findings('a', pad=10))
+    assert cache.get('a')['pad'] == 'x' * 10
+
+
+def test_entry_larger_than_budget_is_not_kept_in_memory(tmp_path):
+    cache = ResultCache(max_bytes=50, disk_dir=str(tmp_path))
+    cache.put('big', findings('big', pad=500))
+    assert cache.stats()['entries'] == 0
+    assert cache.get('big')['tag'] == 'big'      # still served from disk
+    assert cache.stats()['entries'] == 0
+
+
+def test_hit_and_miss_counters():
+    cache = ResultCache(max_bytes=10_000)
+    cache.put('a', findings('a'))
+    cache.get('a')
+    cache.get('missing')
+    cache.get('missing', count=False)
+    stats = cache.stats()
+    assert (stats['memory_hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+# ────────────────────────────────────────────────────────────────
+# On-disk tier
+# ────────────────────────────────────────────────────────────────
+def test_disk_tier_survives_a_new_instance_and_is_promoted(tmp_path):
+    key = cache_key(b'image', {'mode': 'keras'})
+    ResultCache(max_bytes=10_000, disk_dir=str(tmp_path)).put(key, findings('a'))
+
+    restarted = ResultCache(max_bytes=10_000, disk_dir=str(tmp_path))
+    assert restarted.get(key) == findings('a')
+    assert restarted.get(key) == findings('a')
+    stats = restarted.stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['entries']) == (1, 1, 1)
+    assert os.path.exists(tmp_path / key[:2] / f'{key}.json')
+
+
+def test_clear_only_empties_memory(tmp_path):
+    cache = ResultCache(max_bytes=10_000, disk_dir=str(tmp_path))
+    cache.put('ab12', findings('a'))
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    assert cache.get('ab12') == findings('a')
+
+
+def test_unreadable_disk_entry_is_a_miss(tmp_path):
+    cache = ResultCache(max_bytes=10_000, disk_dir=str(tmp_path))
+    os.makedirs(tmp_path / 'ab')
+    (tmp_path / 'ab' / 'ab12.json').write_bytes(b'{not json')
+    assert cache.get('ab12') is None
+    assert cache.stats()['disk_errors'] == 1
+
+
+def test_disk_prune_removes_oldest_files_past_budget(tmp_path):
+    entry = findings('x', pad=200)
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=3 * size(entry))
+    cache.DISK_PRUNE_EVERY = 5
+    keys = [f'{i:02d}key' for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, findings('x', pad=200))          # the 5th write runs the budget check
+        if i < 4:
+            os.utime(tmp_path / key[:2] / f'{key}.json', (1_000 + i, 1_000 + i))  # distinct, increasing mtimes
+            assert len(disk_files(tmp_path)) == i + 1   # no pruning between checks
+
+    assert disk_files(tmp_path) == [f'{key}.json' for key in keys[2:]]
+    assert cache.get(keys[0]) is None and cache.get(keys[4]) is not None
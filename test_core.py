@@ -6,7 +6,7 @@ import numpy as np
 import os
 import datetime
 from models import PneumoniaEnsemble
-from preprocess import preprocess_image
+from preprocess import load_image_context
 from explainability import get_ensemble_heatmap
 from scoring import calculate_symptom_score, past_record_score, calculate_final_score, SYMPTOMS_DICT
 
@@ -35,24 +35,28 @@ if force_untrained:
     ensemble = PneumoniaEnsemble(
         resnet_path='does_not_exist.h5',
         effnet_path='does_not_exist.h5',
-        vit_path='does_not_exist.h5'
+        vit_path='does_not_exist.h5',
+        inference_mode='compiled',
+        allow_untrained=True
     )
 else:
-    ensemble = PneumoniaEnsemble()  # Loads trained weights automatically if files present
+    ensemble = PneumoniaEnsemble(inference_mode='compiled')  # Loads trained weights automatically if files present
 
 print(f"Ensemble loaded with {len(ensemble)} models "
       f"(ResNet50 + EfficientNetV2-S + {'ViT-Tiny' if len(ensemble) == 3 else 'no ViT'})\n")
 
 # Step 2: Preprocess image
-img_array = preprocess_image(test_img_path, is_bytes=False)
-if img_array is None:
+# (the context keeps the decoded image, so the heatmap overlay does not read the file again)
+image_context = load_image_context(test_img_path, is_bytes=False)
+if image_context is None:
     print("Error: Failed to load/preprocess image. Check path, file format, or preprocess.py.")
     exit(1)
+img_array = image_context.tensor
 
 print(f"Image preprocessed successfully (shape: {img_array.shape})")
 
 # Step 3: Prediction (with optional TTA)
-probs = ensemble.predict(img_array)  # base prediction
+probs = ensemble.predict(img_array)[0]  # base prediction (predict returns (N, num_classes))
 
 if USE_TTA:
     print("Applying Test-Time Augmentation...")
@@ -61,7 +65,7 @@ if USE_TTA:
     # Horizontal flip
     if TTA_FLIPS:
         flipped = np.flip(img_array, axis=2)  # flip width axis
-        tta_probs.append(ensemble.predict(flipped))
+        tta_probs.append(ensemble.predict(flipped)[0])
 
     # Small rotations
     for angle in TTA_ROTATIONS:
@@ -71,7 +75,7 @@ if USE_TTA:
         M = cv2.getRotationMatrix2D((cols / 2, rows / 2), angle, 1.0)
         rotated = cv2.warpAffine(img_array[0], M, (cols, rows))  # apply to single image
         rotated = np.expand_dims(rotated, axis=0)  # re-add batch
-        tta_probs.append(ensemble.predict(rotated))
+        tta_probs.append(ensemble.predict(rotated)[0])
 
     probs = np.mean(tta_probs, axis=0)
     print(f"TTA applied ({len(tta_probs)} variants)")
@@ -85,7 +89,7 @@ print("\nGenerating Grad-CAM heatmap...")
 heatmap_matrix, overlaid_img = get_ensemble_heatmap(
     img_array,
     ensemble,
-    test_img_path,
+    image_context,
     alpha=0.45,
     add_colorbar=True  # Set False if matplotlib still causes trouble
 )
@@ -0,0 +1,123 @@
+# test_dedup.py - Unit tests for dedup.py (run with: python -m pytest -q)
+
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from dedup import CHUNK_BITS, CHUNKS, NearDuplicateIndex, hamming, perceptual_hash
+from preprocess import preprocess_image
+
+BASE = 0x0123_4567_89AB_CDEF
+
+
+def flip(h, per_chunk):
+    """Flips per_chunk[i] low bits inside chunk i, so the distance is sum(per_chunk)."""
+    for chunk, n in enumerate(per_chunk):
+        for bit in range(n):
+            h ^= 1 << (chunk * CHUNK_BITS + bit)
+    return h
+
+
+# ────────────────────────────────────────────────────────────────
+# Multi-index lookup
+# ────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize('per_chunk', [(0, 0, 0, 7), (2, 2, 2, 1), (1, 2, 2, 2), (3, 3, 1, 0)])
+def test_hash_at_exactly_max_distance_is_found(per_chunk):
+    # max_distance 7 → radius 1 per chunk; 7 flipped bits always leave one chunk within 1
+    index = NearDuplicateIndex(max_distance=7)
+    index.add(BASE, 'stored')
+    assert index.lookup(flip(BASE, per_chunk)) == ('stored', 7)
+
+
+@pytest.mark.parametrize('per_chunk', [(2, 2, 2, 2), (0, 0, 0, 8), (5, 3, 0, 0)])
+def test_hash_one_past_max_distance_is_missed(per_chunk):
+    index = NearDuplicateIndex(max_distance=7)
+    index.add(BASE, 'stored')
+    assert index.lookup(flip(BASE, per_chunk)) == (None, None)
+    assert index.lookup(flip(BASE, per_chunk), max_distance=8) == ('stored', 8)
+
+
+def test_lookup_matches_a_linear_scan():
+    rng = random.Random(0)
+    stored = [rng.getrandbits(64) for _ in range(200)]
+    # Queries near stored hashes plus unrelated ones
+    queries = [h ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for h in stored[:50]]
+    queries += [flip(h, (rng.randrange(4), rng.randrange(4), rng.randrange(4), rng.randrange(4))) for h in stored[:50]]
+    queries += [rng.getrandbits(64) for _ in range(50)]
+
+    index = NearDuplicateIndex(max_distance=9)
+    for i, h in enumerate(stored):
+        index.add(h, i)
+    for q in queries:
+        best = min(hamming(q, h) for h in stored)
+        payload, distance = index.lookup(q)
+        if best <= 9:
+            assert distance == best and hamming(q, stored[payload]) == best
+        else:
+            assert (payload, distance) == (None, None)
+
+
+def test_nearest_match_wins():
+    index = NearDuplicateIndex(max_distance=8)
+    index.add(flip(BASE, (2, 2, 0, 0)), 'far')
+    index.add(flip(BASE, (1, 0, 0, 0)), 'near')
+    assert index.lookup(BASE) == ('near', 1)
+
+
+def test_namespaces_are_isolated():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add(BASE, 'keras result', namespace='keras')
+    assert index.lookup(BASE, namespace='tflite') == (None, None)
+    assert index.lookup(BASE, namespace='keras') == ('keras result', 0)
+
+
+def test_negative_distance_disables_reuse():
+    index = NearDuplicateIndex(max_distance=-1)
+    index.add(BASE, 'stored')
+    assert index.lookup(BASE) == (None, None)
+    assert index.lookup(BASE, max_distance=0) == ('stored', 0)
+
+
+def test_oldest_entries_are_evicted():
+    index = NearDuplicateIndex(max_distance=0, max_entries=2)
+    for i in range(3):
+        index.add(BASE + i, i)
+    assert index.lookup(BASE) == (None, None)
+    assert index.lookup(BASE + 2) == (2, 0)
+    stats = index.stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 1
+    # Evicted ids are gone from every bucket, not just the entry table
+    assert sum(len(ids) for bucket in index._buckets for ids in bucket.values()) == 2 * CHUNKS
+
+
+# ────────────────────────────────────────────────────────────────
+# perceptual_hash
+# ────────────────────────────────────────────────────────────────
+def radiograph(seed=0):
+    """Smooth synthetic image with large-scale structure (what pHash keys on)."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:512, 0:448].astype(np.float32)
+    img = sum(rng.uniform(20, 60) * np.sin(xx / rng.uniform(30, 90) + rng.uniform(0, 6))
+              * np.cos(yy / rng.uniform(30, 90)) for _ in range(4)) + 128
+    return cv2.cvtColor(np.clip(img, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+
+def phash(img, ext='.png', params=()):
+    ok, buf = cv2.imencode(ext, img, list(params))
+    assert ok
+    return perceptual_hash(preprocess_image(buf.tobytes(), is_bytes=True))
+
+
+def test_hash_is_stable_under_re_encoding():
+    img = radiograph()
+    original = phash(img)
+    assert hamming(original, phash(img, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, 60])) <= 4
+    half = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    assert hamming(original, phash(half, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, 90])) <= 4
+
+
+def test_different_images_hash_far_apart():
+    hashes = [phash(radiograph(seed)) for seed in range(4)]
+    assert min(hamming(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:]) > 10
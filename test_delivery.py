@@ -0,0 +1,113 @@
+# test_delivery.py - Unit tests for delivery.py (run with: python -m pytest -q)
+
+import base64
+import email
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from delivery import (check_formats, dequantize_heatmap, encode_image, encode_image_base64, iter_bytes,
+                      multipart_parts, quantize_heatmap)
+
+RESULT = {'prediction': 'PNEUMONIA', 'confidence': 0.91, 'heatmap': None}
+
+
+def parse_multipart(content_type, chunks):
+    """Parses a multipart body with the stdlib MIME parser (a strict, independent reader)."""
+    body = b''.join(chunks)
+    return body, email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode('ascii') + body)
+
+
+# ────────────────────────────────────────────────────────────────
+# multipart/mixed
+# ────────────────────────────────────────────────────────────────
+def test_multipart_holds_json_then_image():
+    image = bytes(range(256)) * 300 + b'\r\n--not-a-boundary\r\n'   # binary, spans several chunks
+    content_type, chunks = multipart_parts(RESULT, image, fmt='png', boundary='b0undary')
+    assert content_type == 'multipart/mixed; boundary=b0undary'
+
+    body, message = parse_multipart(content_type, chunks)
+    assert body.startswith(b'--b0undary\r\n') and body.endswith(b'--b0undary--\r\n')
+    json_part, image_part = message.get_payload()
+    assert json_part.get_content_type() == 'application/json'
+    assert json.loads(json_part.get_payload(decode=True)) == RESULT
+    assert image_part.get_content_type() == 'image/png'
+    assert image_part['Content-Length'] == str(len(image))
+    assert image_part.get_filename() == 'heatmap.png'
+    assert image_part.get_payload(decode=True) == image
+
+
+def test_multipart_without_image_has_only_the_json_part():
+    content_type, chunks = multipart_parts(RESULT, None, boundary='b0undary')
+    _, message = parse_multipart(content_type, chunks)
+    assert [part.get_content_type() for part in message.get_payload()] == ['application/json']
+
+
+def test_multipart_boundary_is_random_by_default():
+    first, _ = multipart_parts(RESULT, None)
+    second, _ = multipart_parts(RESULT, None)
+    assert first != second
+
+
+def test_iter_bytes_chunks_cover_the_input():
+    data = bytes(range(256)) * 10
+    chunks = list(iter_bytes(data, chunk_size=1000))
+    assert [len(c) for c in chunks] == [1000, 1000, 560]
+    assert b''.join(chunks) == data
+    assert list(iter_bytes(b'')) == []
+
+
+# ────────────────────────────────────────────────────────────────
+# Raw heatmap matrix
+# ────────────────────────────────────────────────────────────────
+def test_heatmap_matrix_round_trip():
+    heatmap = np.random.default_rng(0).random((7, 7)).astype(np.float32)
+    matrix = quantize_heatmap(heatmap)
+    assert len(matrix) == 7 and all(len(row) == 7 for row in matrix)
+    assert all(isinstance(v, int) and 0 <= v <= 255 for row in matrix for v in row)
+    json.dumps(matrix)  # plain JSON, no numpy types
+    np.testing.assert_allclose(dequantize_heatmap(matrix), heatmap, atol=0.5 / 255 + 1e-6)
+
+
+def test_heatmap_matrix_clips_out_of_range_values():
+    assert quantize_heatmap([[-0.2, 0.0, 1.0, 1.3]]) == [[0, 0, 255, 255]]
+
+
+# ────────────────────────────────────────────────────────────────
+# Formats and image encoding
+# ────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize('kwargs', [
+    {'response_format': 'xml'},
+    {'heatmap_format': 'gif'},
+    {'heatmap_format': 'png', 'quality': 10},
+    {'heatmap_format': 'jpeg', 'quality': 101},
+    {'heatmap_format': 'webp', 'quality': -1},
+])
+def test_check_formats_rejects(kwargs):
+    with pytest.raises(ValueError):
+        check_formats(**kwargs)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'response_format': 'multipart', 'heatmap_format': 'png', 'quality': 9},
+                                    {'response_format': 'matrix', 'heatmap_format': 'webp', 'quality': 0}])
+def test_check_formats_accepts(kwargs):
+    check_formats(**kwargs)
+
+
+@pytest.mark.parametrize('fmt', ['jpeg', 'png', 'webp'])
+def test_encoded_image_decodes_to_the_same_rgb_image(fmt):
+    rgb = np.zeros((64, 48, 3), np.uint8)
+    rgb[..., 0] = 200                                      # red in RGB order
+    decoded = cv2.imdecode(np.frombuffer(encode_image(rgb, fmt), np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == (64, 48, 3)
+    assert np.abs(decoded[..., ::-1].astype(int) - rgb).max() <= 8
+
+
+def test_png_is_lossless_and_base64_matches_binary():
+    rgb = np.random.default_rng(1).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    encoded = encode_image(rgb, 'png')
+    decoded = cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_COLOR)
+    np.testing.assert_array_equal(decoded[..., ::-1], rgb)
+    assert base64.b64decode(encode_image_base64(rgb, 'png')) == encoded
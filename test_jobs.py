@@ -0,0 +1,101 @@
+# test_jobs.py - Unit tests for jobs.py (run with: python -m pytest -q)
+
+import threading
+import types
+
+import pytest
+
+import jobs
+from jobs import JobStore, JobStoreFull
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Manual monotonic clock for jobs.py; advance with clock.now += seconds."""
+    fake = types.SimpleNamespace(now=1_000.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(jobs, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def gate():
+    """Blocks submitted jobs until set (released on teardown so workers never hang)."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def wait_done(store, job_id):
+    store.get(job_id).future.result(timeout=5)
+
+
+def test_done_and_failed_jobs(clock):
+    store = JobStore(workers=1)
+
+    def boom():
+        raise ValueError("no conv layer")
+
+    ok, failed = store.submit(lambda x: x * 2, 21), store.submit(boom)
+    store._executor.shutdown(wait=True)     # done callbacks (counters, finish time) have run
+
+    assert store.get(ok).to_dict() == {'job_id': ok, 'status': 'done', 'result': 42, 'seconds': 0.0}
+    assert store.get(failed).to_dict() == {'job_id': failed, 'status': 'failed', 'error': 'no conv layer'}
+    stats = store.stats()
+    assert (stats['submitted'], stats['completed'], stats['failed'], stats['pending']) == (2, 1, 1, 0)
+
+
+def test_jobs_expire_after_ttl(clock):
+    store = JobStore(workers=1, ttl_seconds=60)
+    first = store.submit(lambda: 'a')
+    clock.now += 30
+    second = store.submit(lambda: 'b')
+    wait_done(store, first)
+    wait_done(store, second)
+
+    clock.now += 30                          # first is exactly ttl old
+    assert store.get(first) is None
+    assert store.get(second).to_dict()['result'] == 'b'
+    clock.now += 30
+    assert store.get(second) is None
+    assert store.stats()['expired'] == 2
+    store.shutdown()
+
+
+def test_unknown_job_is_none(clock):
+    store = JobStore(workers=1)
+    assert store.get('missing') is None
+    store.shutdown()
+
+
+def test_full_store_of_pending_jobs_rejects(clock, gate):
+    store = JobStore(workers=1, max_jobs=2)
+    store.submit(gate.wait)
+    store.submit(gate.wait)
+    with pytest.raises(JobStoreFull):
+        store.submit(gate.wait)
+    assert store.stats()['rejected'] == 1
+    store.shutdown()
+
+
+def test_finished_job_makes_room_for_a_new_one(clock, gate):
+    store = JobStore(workers=1, max_jobs=2)
+    finished = store.submit(lambda: 'done')
+    wait_done(store, finished)
+    running = store.submit(gate.wait)
+    newest = store.submit(gate.wait)         # evicts the finished job, never a pending one
+    assert store.get(finished) is None
+    assert store.get(running) is not None and store.get(newest) is not None
+    store.shutdown()
+
+
+def test_expired_pending_job_is_cancelled_and_frees_its_slot(clock, gate):
+    store = JobStore(workers=1, max_jobs=2, ttl_seconds=10)
+    store.submit(gate.wait)                  # occupies the only worker
+    queued = store.submit(gate.wait)
+    queued_future = store.get(queued).future
+    clock.now += 10
+    replacement = store.submit(lambda: 'fresh')
+    assert queued_future.cancelled()
+    assert store.get(queued) is None and store.get(replacement) is not None
+    store.shutdown()
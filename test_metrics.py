@@ -0,0 +1,104 @@
+# test_metrics.py - Unit tests for metrics.py and the request middleware (run with: python -m pytest -q)
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, register_collector, render
+
+
+def samples(metric):
+    """{'name{labels}': value} for one metric's rendered sample lines."""
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1]) for line in metric.render()[2:]}
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Fresh registry per test, so the metrics created here never reach the app's /metrics."""
+    monkeypatch.setattr(metrics, '_REGISTRY', [])
+    monkeypatch.setattr(metrics, '_COLLECTORS', [])
+
+
+def test_counter_render(registry):
+    requests = Counter('t_requests_total', 'Requests', labels=('endpoint', 'status'))
+    requests.inc(endpoint='/b', status=200)
+    requests.inc(endpoint='/a', status=200)
+    requests.inc(2, endpoint='/a', status=200)
+    assert requests.render() == [
+        '# HELP t_requests_total Requests',
+        '# TYPE t_requests_total counter',
+        't_requests_total{endpoint="/a",status="200"} 3',
+        't_requests_total{endpoint="/b",status="200"} 1',
+    ]
+
+
+def test_gauge_set_and_track(registry):
+    depth = Gauge('t_depth', 'Depth')
+    in_flight = Gauge('t_in_flight', 'In flight', labels=('endpoint',))
+    depth.set(7)
+    with in_flight.track(endpoint='/x'):
+        assert in_flight.render()[-1] == 't_in_flight{endpoint="/x"} 1'
+        with pytest.raises(RuntimeError):
+            with in_flight.track(endpoint='/x'):
+                raise RuntimeError
+        assert in_flight.render()[-1] == 't_in_flight{endpoint="/x"} 1'
+    assert in_flight.render()[-1] == 't_in_flight{endpoint="/x"} 0'
+    assert depth.render()[-1] == 't_depth 7'
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = Histogram('t_seconds', 'Latency', labels=('stage',), buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+        latency.observe(value, stage='decode')
+    assert latency.render()[2:] == [
+        't_seconds_bucket{stage="decode",le="0.1"} 2',     # upper bounds are inclusive
+        't_seconds_bucket{stage="decode",le="0.5"} 3',
+        't_seconds_bucket{stage="decode",le="1.0"} 4',
+        't_seconds_bucket{stage="decode",le="+Inf"} 5',
+        f't_seconds_sum{{stage="decode"}} {0.05 + 0.1 + 0.3 + 0.7 + 2.0}',
+        't_seconds_count{stage="decode"} 5',
+    ]
+
+
+def test_histogram_time_observes_failures_too(registry):
+    latency = Histogram('t_seconds', 'Latency', buckets=(10.0,))
+    with pytest.raises(ValueError):
+        with latency.time():
+            raise ValueError
+    assert latency.render()[-1] == 't_seconds_count 1'
+
+
+def test_render_includes_registry_and_collectors(registry):
+    Counter('t_total', 'Total').inc()
+
+    @register_collector
+    def queue():
+        yield ('t_queue_depth', 'gauge', 'Queue depth', {(): 3, (('pool', 'bulk'),): 1})
+
+    assert render() == '\n'.join([
+        '# HELP t_total Total', '# TYPE t_total counter', 't_total 1',
+        '# HELP t_queue_depth Queue depth', '# TYPE t_queue_depth gauge',
+        't_queue_depth 3', 't_queue_depth{pool="bulk"} 1',
+    ]) + '\n'
+
+
+# ────────────────────────────────────────────────────────────────
+# Request middleware (imports the app, which loads TensorFlow)
+# ────────────────────────────────────────────────────────────────
+def test_requests_are_counted_by_route_template():
+    main = pytest.importorskip('main')
+    from fastapi.testclient import TestClient
+
+    http = TestClient(main.app)
+    before = samples(main.REQUESTS)
+    assert http.get('/health').status_code == 200
+    assert http.get('/heatmap-jobs/abc123').status_code == 404
+    assert http.get('/heatmap-jobs/def456').status_code == 404
+    after = samples(main.REQUESTS)
+
+    def delta(series):
+        return after.get(series, 0) - before.get(series, 0)
+
+    assert delta('xray_requests_total{endpoint="/health",status="200"}') == 1
+    assert delta('xray_requests_total{endpoint="/heatmap-jobs/{job_id}",status="404"}') == 2
+    assert not any('abc123' in series for series in after)
+    assert all(value == 0 for value in samples(main.IN_FLIGHT).values())
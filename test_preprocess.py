@@ -0,0 +1,185 @@
+# test_preprocess.py - Unit tests for preprocess.py (run with: python -m pytest -q)
+
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from preprocess import (PREPROCESS_CONFIG, decode_image, preprocess_batch, preprocess_image, probe_image,
+                        reduction_factor)
+
+# ────────────────────────────────────────────────────────────────
+# Synthetic images (no dataset needed)
+# ────────────────────────────────────────────────────────────────
+def encoded(width, height, ext='.png', gray=False, seed=0):
+    """Random-gradient image encoded as `ext` bytes (smooth, so JPEG decodes stay close)."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :].repeat(height, axis=0)
+    img = np.clip(ramp + rng.normal(0, 8, (height, width)), 0, 255).astype(np.uint8)
+    if not gray:
+        img = np.dstack([img, 255 - img, np.roll(img, width // 3, axis=1)])
+    ok, buf = cv2.imencode(ext, img)
+    assert ok
+    return buf.tobytes()
+
+
+def segment(marker, payload=b''):
+    """One JPEG marker segment: FF <marker> <length> <payload>."""
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def sof(marker, width, height, channels):
+    """Start-of-frame segment: precision, height, width, component count + one spec per component."""
+    return segment(marker, struct.pack('>BHHB', 8, height, width, channels) + b'\x01\x11\x00' * channels)
+
+
+# ────────────────────────────────────────────────────────────────
+# probe_image
+# ────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize('ext', ['.png', '.jpg'])
+@pytest.mark.parametrize('gray', [False, True])
+def test_probe_matches_encoded_image(ext, gray):
+    info = probe_image(encoded(320, 240, ext, gray))
+    assert info == ('png' if ext == '.png' else 'jpeg', 320, 240, 1 if gray else 3)
+
+
+def test_probe_png_with_alpha_counts_colour_channels():
+    ok, buf = cv2.imencode('.png', np.zeros((10, 12, 4), np.uint8))
+    assert ok
+    assert probe_image(buf.tobytes()) == ('png', 12, 10, 3)
+
+
+def test_probe_skips_non_frame_markers_and_fill_bytes():
+    # DHT (C4), JPG (C8) and DAC (CC) sit in the SOF range but are not frames
+    data = (b'\xff\xd8' + segment(0xE0, b'JFIF\x00' + bytes(9)) + segment(0xC4, bytes(20)) + segment(0xC8, bytes(4))
+            + segment(0xCC, bytes(2)) + b'\xff\xff' + sof(0xC2, 2048, 2500, 1) + b'\xff\xda')
+    assert probe_image(data) == ('jpeg', 2048, 2500, 1)
+
+
+@pytest.mark.parametrize('marker', [0xC0, 0xC1, 0xC2, 0xC3, 0xC9, 0xCF])
+def test_probe_reads_every_sof_kind(marker):
+    assert probe_image(b'\xff\xd8' + sof(marker, 640, 480, 3)) == ('jpeg', 640, 480, 3)
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'not an image',
+    b'\xff\xd8',                                             # SOI only
+    b'\xff\xd8' + sof(0xC0, 640, 480, 3)[:8],                # SOF cut before the dimensions
+    b'\xff\xd8' + segment(0xE0, bytes(14))[:6],              # cut inside APP0, no frame
+    b'\xff\xd8\x00\x10' + sof(0xC0, 640, 480, 3),            # garbage instead of a marker
+    b'\x89PNG\r\n\x1a\n' + bytes(10),                        # PNG signature, IHDR missing
+], ids=['empty', 'text', 'soi-only', 'truncated-sof', 'truncated-app0', 'bad-marker', 'truncated-png'])
+def test_probe_rejects_truncated_and_unknown_headers(data):
+    assert probe_image(data) is None
+
+
+def test_probe_truncated_real_files():
+    assert probe_image(encoded(320, 240, '.png')[:25]) is None
+    jpeg = encoded(320, 240, '.jpg')
+    assert probe_image(jpeg[:jpeg.index(b'\xff\xc0') + 6]) is None
+
+
+# ────────────────────────────────────────────────────────────────
+# Reduced-scale decode
+# ────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize('width, height, factor', [
+    (2400, 3000, 8),   # typical radiograph: 2400 // 8 = 300 ≥ 224
+    (1792, 5000, 8),   # exactly 224 at 1/8
+    (1791, 5000, 4),
+    (1000, 1000, 4),
+    (600, 600, 2),
+    (447, 2000, 1),    # short side decides, whatever the orientation
+    (3000, 400, 1),
+    (224, 224, 1),
+])
+def test_reduction_factor(width, height, factor):
+    assert reduction_factor(width, height, (224, 224)) == factor
+
+
+def test_reduction_factor_uses_longer_target_side():
+    assert reduction_factor(2000, 2000, (224, 300)) == 4
+
+
+def test_large_gray_jpeg_is_decoded_reduced_single_channel():
+    data = encoded(1800, 2000, '.jpg', gray=True)
+    img = decode_image(data)
+    assert img.shape == (250, 225)
+
+
+def test_reduced_decode_can_be_disabled(monkeypatch):
+    monkeypatch.setitem(PREPROCESS_CONFIG, 'reduced_decode', False)
+    assert decode_image(encoded(1800, 2000, '.jpg', gray=True)).shape == (2000, 1800)
+
+
+def test_png_is_decoded_full_size():
+    assert decode_image(encoded(1800, 2000, '.png')).shape == (2000, 1800, 3)
+
+
+def test_grayscale_decode_of_colour_source():
+    img = decode_image(encoded(640, 480, '.jpg'), grayscale=True)
+    assert img.ndim == 2
+
+
+def test_undecodable_bytes():
+    assert decode_image(b'\xff\xd8' + sof(0xC0, 640, 480, 3)) is None
+    assert decode_image(b'not an image') is None
+
+
+def test_reduced_decode_matches_full_decode_after_resize(monkeypatch):
+    data = encoded(1800, 2000, '.jpg', seed=4)
+    reduced = preprocess_image(data, is_bytes=True)
+    monkeypatch.setitem(PREPROCESS_CONFIG, 'reduced_decode', False)
+    full = preprocess_image(data, is_bytes=True)
+    diff = np.abs(reduced.astype(np.int16) - full.astype(np.int16))
+    assert diff.mean() < 2.0
+
+
+# ────────────────────────────────────────────────────────────────
+# preprocess_batch
+# ────────────────────────────────────────────────────────────────
+def test_batch_is_one_contiguous_uint8_tensor():
+    items = [encoded(300, 260, seed=i) for i in range(4)]
+    batch, valid = preprocess_batch(items, is_bytes=True)
+    assert batch.shape == (4, 224, 224, 3)
+    assert batch.dtype == np.uint8
+    assert batch.flags['C_CONTIGUOUS']
+    assert valid.dtype == bool and valid.all()
+
+
+def test_batch_rows_match_preprocess_image():
+    items = [encoded(300, 260, seed=1), encoded(640, 480, '.jpg', seed=2), encoded(256, 256, gray=True, seed=3)]
+    batch, valid = preprocess_batch(items, is_bytes=True)
+    assert valid.all()
+    for row, item in zip(batch, items):
+        np.testing.assert_array_equal(row, preprocess_image(item, is_bytes=True)[0])
+
+
+def test_failed_item_is_zeroed_and_marked_invalid(tmp_path):
+    items = [encoded(300, 260, seed=1), b'not an image', encoded(300, 260, seed=2)]
+    batch, valid = preprocess_batch(items, is_bytes=True)
+    assert valid.tolist() == [True, False, True]
+    assert not batch[1].any()
+    assert batch[0].any() and batch[2].any()
+
+    path = tmp_path / 'xray.png'
+    path.write_bytes(items[0])
+    batch, valid = preprocess_batch([str(path), str(tmp_path / 'missing.png')])
+    assert valid.tolist() == [True, False]
+    assert not batch[1].any()
+
+
+@pytest.mark.parametrize('gray_source', [False, True])
+def test_single_channel_batch(gray_source):
+    items = [encoded(300, 260, gray=gray_source, seed=i) for i in range(2)]
+    batch, valid = preprocess_batch(items, is_bytes=True, channels=1)
+    assert batch.shape == (2, 224, 224, 1)
+    assert valid.all()
+    np.testing.assert_array_equal(batch[0], preprocess_image(items[0], is_bytes=True, channels=1)[0])
+
+
+def test_empty_batch():
+    batch, valid = preprocess_batch([], is_bytes=True)
+    assert batch.shape == (0, 224, 224, 3)
+    assert valid.shape == (0,)
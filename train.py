@@ -3,8 +3,12 @@
 
 import tensorflow as tf
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
-from datasets import load_dataset
-from models import build_resnet_model, build_efficientnet_model, build_vit_tiny_model
+from datasets import Image, load_dataset
+from models import build_resnet_model, build_efficientnet_model, build_vit_tiny_model, build_student_model
+from models import export_fast_weights, fast_weights_path, grayscale_path, member_weight_path, PneumoniaEnsemble
+from pruning import prune_model, model_stats, print_pruning_report
+from distill import distill_student, evaluate_predictor, serving_rss_mb, print_distillation_report
+from preprocess import preprocess_image
 import numpy as np
 from sklearn.utils.class_weight import compute_class_weight
 
@@ -13,48 +17,63 @@ from sklearn.utils.class_weight import compute_class_weight
 # ────────────────────────────────────────────────────────────────
 NUM_CLASSES = 2               # Normal (0) vs Pneumonia (1)
 IMG_SIZE = (224, 224)
+INPUT_CHANNELS = 3            # 1 = grayscale-native members (ImageNet RGB kernels folded), saved as *_gray artifacts
 BATCH_SIZE = 32
 EPOCHS = 15                   # monitor val_loss
 LEARNING_RATE = 1e-4
 AUTOTUNE = tf.data.AUTOTUNE
 
+# Structured pruning of the CNN members (after training, before final evaluation)
+RUN_PRUNING = True
+PRUNE_RATIO = 0.3             # fraction of prunable channels removed
+PRUNE_FINETUNE_EPOCHS = 3     # short recovery fine-tune
+
+# Distill the trained ensemble into one MobileNetV2 student (served as PneumoniaEnsemble(members=['student']))
+RUN_DISTILLATION = True
+DISTILL_EPOCHS = 10
+
 # ────────────────────────────────────────────────────────────────
 # Load dataset
 # ────────────────────────────────────────────────────────────────
 print("Loading Hugging Face dataset 'hf-vision/chest-xray-pneumonia'...")
-dataset = load_dataset("hf-vision/chest-xray-pneumonia")
+# Images stay encoded: they are decoded by preprocess_image, exactly as at inference
+dataset = load_dataset("hf-vision/chest-xray-pneumonia").cast_column('image', Image(decode=False))
 print(f"Train: {len(dataset['train'])} | Val: {len(dataset['validation'])} | Test: {len(dataset['test'])}")
 
 # ────────────────────────────────────────────────────────────────
 # Preprocessing + Augmentation (safe & compatible)
+# Pixels come from preprocess_image, the inference path (cv2 decode incl. reduced-scale JPEG,
+# INTER_AREA resize, RGB / one gray channel → uint8), so the models train on exactly what they
+# are served. Augmentation works on a [0, 1] float copy and re-quantizes to uint8 afterwards;
+# each model normalizes its uint8 input in-graph.
 # ────────────────────────────────────────────────────────────────
-def preprocess_and_augment(example, augment=False):
-    # 'image' is PIL JpegImageFile
-    pil_img = example['image']
-
-    # PIL → numpy → TF tensor
-    img_np = np.array(pil_img.convert('RGB'))
-    img = tf.convert_to_tensor(img_np, dtype=tf.float32)
+def load_pixels(example):
+    """Encoded dataset image → uint8 (H, W, INPUT_CHANNELS), as preprocess_image gives at inference."""
+    img = preprocess_image(example['image']['bytes'], is_bytes=True, target_size=IMG_SIZE, channels=INPUT_CHANNELS)
+    if img is None:
+        raise ValueError("Failed to decode dataset image")
+    return img[0]
 
-    # Resize
-    img = tf.image.resize(img, IMG_SIZE, method='area')
 
-    # ImageNet preprocessing
-    img = tf.keras.applications.resnet50.preprocess_input(img)
+def preprocess_and_augment(example, augment=False):
+    img = tf.convert_to_tensor(load_pixels(example))
 
     # Label
     label = tf.one_hot(example['label'], depth=NUM_CLASSES)
 
-    # Augmentation (only for training)
+    # Augmentation (only for training), on [0, 1] pixels
     if augment:
+        img = tf.image.convert_image_dtype(img, tf.float32)
         img = tf.image.random_flip_left_right(img)
         img = tf.image.random_flip_up_down(img)  # safe vertical flip
         img = tf.image.random_brightness(img, max_delta=0.1)
         img = tf.image.random_contrast(img, lower=0.9, upper=1.1)
-        img = tf.image.random_saturation(img, lower=0.9, upper=1.1)
+        if INPUT_CHANNELS == 3:
+            img = tf.image.random_saturation(img, lower=0.9, upper=1.1)
         # Simple 90° rotation steps (safe & compatible)
         k = tf.random.uniform(shape=[], minval=0, maxval=4, dtype=tf.int32)
         img = tf.image.rot90(img, k=k)
+        img = tf.image.convert_image_dtype(img, tf.uint8, saturate=True)
 
     # Return a dictionary instead of a tuple
     return {'image': img, 'label': label}
@@ -67,27 +86,26 @@ def create_tf_dataset(hf_split, augment=False, shuffle=False, buffer_size=1000):
     def generator():
         for example in hf_split:
             # Preprocess on-the-fly (one example at a time → no memory explosion)
-            pil_img = example['image']
-            img_np = np.array(pil_img.convert('RGB'))
-            img = tf.convert_to_tensor(img_np, dtype=tf.float32)
-            img = tf.image.resize(img, IMG_SIZE, method='area')
-            img = tf.keras.applications.resnet50.preprocess_input(img)
+            img = tf.convert_to_tensor(load_pixels(example))  # uint8, as served
             label = tf.one_hot(example['label'], depth=NUM_CLASSES)
 
             if augment:
+                img = tf.image.convert_image_dtype(img, tf.float32)  # [0, 1] for the augmentations
                 img = tf.image.random_flip_left_right(img)
                 img = tf.image.random_brightness(img, max_delta=0.1)
                 img = tf.image.random_contrast(img, lower=0.9, upper=1.1)
-                img = tf.image.random_saturation(img, lower=0.9, upper=1.1)
+                if INPUT_CHANNELS == 3:
+                    img = tf.image.random_saturation(img, lower=0.9, upper=1.1)
                 k = tf.random.uniform(shape=[], minval=0, maxval=4, dtype=tf.int32)
                 img = tf.image.rot90(img, k=k)  # safe 90° rotations
+                img = tf.image.convert_image_dtype(img, tf.uint8, saturate=True)  # back to served uint8
 
             yield img, label
 
     ds = tf.data.Dataset.from_generator(
         generator,
         output_signature=(
-            tf.TensorSpec(shape=(IMG_SIZE[0], IMG_SIZE[1], 3), dtype=tf.float32),
+            tf.TensorSpec(shape=(IMG_SIZE[0], IMG_SIZE[1], INPUT_CHANNELS), dtype=tf.uint8),
             tf.TensorSpec(shape=(NUM_CLASSES,), dtype=tf.float32)
         )
     )
@@ -133,7 +151,7 @@ callbacks = [
 # Train ResNet50
 # ────────────────────────────────────────────────────────────────
 print("\n=== Training ResNet50 ===")
-resnet_model = build_resnet_model(learning_rate=LEARNING_RATE, num_classes=NUM_CLASSES)
+resnet_model = build_resnet_model(learning_rate=LEARNING_RATE, num_classes=NUM_CLASSES, channels=INPUT_CHANNELS)
 
 for layer in resnet_model.layers:
     if 'conv5_block' in layer.name:
@@ -154,13 +172,14 @@ resnet_model.fit(
     callbacks=callbacks,
     verbose=1
 )
-resnet_model.save('resnet50_trained_final.h5')
+resnet_model.save(member_weight_path('resnet50', INPUT_CHANNELS))
+export_fast_weights(resnet_model, fast_weights_path(member_weight_path('resnet50', INPUT_CHANNELS)))  # fast serving load
 
 # ────────────────────────────────────────────────────────────────
 # Train EfficientNetV2-S
 # ────────────────────────────────────────────────────────────────
 print("\n=== Training EfficientNetV2-S ===")
-effnet_model = build_efficientnet_model(learning_rate=LEARNING_RATE, num_classes=NUM_CLASSES)
+effnet_model = build_efficientnet_model(learning_rate=LEARNING_RATE, num_classes=NUM_CLASSES, channels=INPUT_CHANNELS)
 
 for layer in effnet_model.layers[-int(len(effnet_model.layers) * 0.3):]:
     layer.trainable = True
@@ -178,12 +197,13 @@ effnet_model.fit(
     callbacks=callbacks,
     verbose=1
 )
-effnet_model.save('efficientnetv2s_trained_final.h5')
+effnet_model.save(member_weight_path('efficientnetv2s', INPUT_CHANNELS))
+export_fast_weights(effnet_model, fast_weights_path(member_weight_path('efficientnetv2s', INPUT_CHANNELS)))
 
 # ────────────────────────────────────────────────────────────────
 # ViT-Tiny (optional)
 # ────────────────────────────────────────────────────────────────
-vit_model = build_vit_tiny_model(learning_rate=LEARNING_RATE / 2, num_classes=NUM_CLASSES)
+vit_model = build_vit_tiny_model(learning_rate=LEARNING_RATE / 2, num_classes=NUM_CLASSES, channels=INPUT_CHANNELS)
 if vit_model is not None:
     print("\n=== Training ViT-Tiny ===")
     vit_model.fit(
@@ -194,10 +214,81 @@ if vit_model is not None:
         callbacks=callbacks,
         verbose=1
     )
-    vit_model.save('vit_tiny_trained_final.h5')
+    vit_model.save(member_weight_path('vit_tiny', INPUT_CHANNELS))
+    export_fast_weights(vit_model, fast_weights_path(member_weight_path('vit_tiny', INPUT_CHANNELS)))
 else:
     print("\nViT-Tiny skipped (vit-keras not available)")
 
+# ────────────────────────────────────────────────────────────────
+# Structured pruning (ResNet50 + EfficientNetV2-S)
+# Removes low-importance channels, fine-tunes briefly, exports a smaller dense model.
+# Serve it with e.g. PneumoniaEnsemble(resnet_path='resnet50_pruned.h5').
+# ────────────────────────────────────────────────────────────────
+if RUN_PRUNING:
+    for name, model, out_path in [('ResNet50', resnet_model, 'resnet50_pruned.h5'),
+                                  ('EfficientNetV2-S', effnet_model, 'efficientnetv2s_pruned.h5')]:
+        out_path = out_path if INPUT_CHANNELS == 3 else grayscale_path(out_path)
+        print(f"\n=== Pruning {name} ({PRUNE_RATIO:.0%} of prunable channels) ===")
+        before = model_stats(model, test_ds)
+
+        pruned_model, summary = prune_model(model, PRUNE_RATIO)
+        print(f"Pruned {len(summary)} conv groups")
+
+        # Short recovery fine-tune of the whole (smaller) network at a lower LR
+        for layer in pruned_model.layers:
+            layer.trainable = True
+        pruned_model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=LEARNING_RATE / 10),
+                             loss='categorical_crossentropy',
+                             metrics=['accuracy', 'Recall'])
+        pruned_model.fit(
+            train_ds,
+            validation_data=val_ds,
+            epochs=PRUNE_FINETUNE_EPOCHS,
+            class_weight=class_weights_dict,
+            callbacks=[EarlyStopping(monitor='val_loss', patience=2, restore_best_weights=True, verbose=1)],
+            verbose=1
+        )
+
+        after = model_stats(pruned_model, test_ds)
+        print_pruning_report(name, before, after)
+        if after['recall'] is not None and before['recall'] is not None and after['recall'] < before['recall']:
+            # A pruned artifact on disk is ready to serve: never write one that misses more pneumonia
+            print(f"Not saving pruned {name}: recall dropped {before['recall']:.4f} → {after['recall']:.4f} "
+                  f"— lower PRUNE_RATIO or fine-tune longer")
+            continue
+
+        pruned_model.save(out_path)
+        export_fast_weights(pruned_model, fast_weights_path(out_path), include_architecture=True)
+        print(f"Saved pruned {name}: {out_path}")
+
+# ────────────────────────────────────────────────────────────────
+# Knowledge distillation (ensemble soft votes → compact student)
+# ────────────────────────────────────────────────────────────────
+if RUN_DISTILLATION:
+    print("\n=== Distilling ensemble into MobileNetV2 student ===")
+    teacher = PneumoniaEnsemble(inference_mode='compiled', input_channels=INPUT_CHANNELS)  # loads the artifacts saved above
+    student_model = build_student_model(learning_rate=LEARNING_RATE, num_classes=NUM_CLASSES, channels=INPUT_CHANNELS)
+    distill_student(
+        student_model,
+        teacher,
+        train_ds,
+        val_ds,
+        num_classes=NUM_CLASSES,
+        epochs=DISTILL_EPOCHS,
+        learning_rate=LEARNING_RATE,
+        callbacks=[EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True, verbose=1)]
+    )
+    student_model.save(member_weight_path('student', INPUT_CHANNELS))
+    export_fast_weights(student_model, fast_weights_path(member_weight_path('student', INPUT_CHANNELS)))
+
+    # Side-by-side through the same prediction interface
+    student = PneumoniaEnsemble(members=['student'], inference_mode='compiled', input_channels=INPUT_CHANNELS)
+    ensemble_stats = evaluate_predictor(teacher, test_ds)
+    student_stats = evaluate_predictor(student, test_ds)
+    ensemble_stats['rss_mb'] = serving_rss_mb(channels=INPUT_CHANNELS)
+    student_stats['rss_mb'] = serving_rss_mb(['student'], channels=INPUT_CHANNELS)
+    print_distillation_report(ensemble_stats, student_stats)
+
 # ────────────────────────────────────────────────────────────────
 # Final evaluation
 # ────────────────────────────────────────────────────────────────